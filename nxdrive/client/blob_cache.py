@@ -0,0 +1,189 @@
+# coding: utf-8
+""" A size-bounded cache of downloaded contents, addressed by their digest. """
+import hashlib
+import os
+from collections import OrderedDict
+from logging import getLogger
+from threading import Lock, get_ident
+from typing import Any, Optional
+
+from .file_copy import copy_file
+from ..constants import FILE_BUFFER_SIZE
+from ..objects import Metrics
+from ..utils import guess_digest_algorithm
+
+__all__ = ("BlobCache",)
+
+log = getLogger(__name__)
+
+TMP_SUFFIX = ".tmp"
+
+
+def _hasher(digest: str) -> Optional[Any]:
+    """ Return a hash object for the algorithm of *digest*, if it is known. """
+    try:
+        return hashlib.new(guess_digest_algorithm(digest))
+    except ValueError:
+        return None
+
+
+def _copy(src: str, dst: str, digest: str) -> bool:
+    """ Copy *src* to *dst*, return True if the copy matches *digest*. """
+    hasher = _hasher(digest)
+    if hasher is None:
+        return False
+
+    # A clone is cheaper than a copy, even if the copy is read again
+    copy_file(src, dst)
+    with open(dst, "rb") as f:
+        while "Hashing":
+            buf = f.read(FILE_BUFFER_SIZE)
+            if not buf:
+                break
+            hasher.update(buf)
+    return hasher.hexdigest() == digest
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        log.warning("Cannot remove cached content %r", path, exc_info=True)
+
+
+class BlobCache:
+    """
+    Keep copies of downloaded contents in *folder*, named after their digest,
+    up to *max_size* bytes. The least recently used contents are evicted first.
+    Contents are checked against their digest when copied in and out, so that
+    a damaged copy is never served.
+    """
+
+    def __init__(self, folder: str, max_size: int) -> None:
+        self.folder = folder
+        self.max_size = max_size
+        self._lock = Lock()
+        # digest -> size, the most recently used last
+        self._blobs: OrderedDict = OrderedDict()
+        self._size = 0
+        self._metrics = {"hits": 0, "misses": 0, "bytes_saved": 0}
+
+        os.makedirs(folder, exist_ok=True)
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._blobs)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.folder, digest)
+
+    def _load(self) -> None:
+        """ Index the contents kept by a previous run, by last use. """
+        blobs = []
+        for entry in os.scandir(self.folder):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(TMP_SUFFIX):
+                # Interrupted while being added
+                _remove(entry.path)
+                continue
+            if _hasher(entry.name) is None:
+                continue
+            stat = entry.stat()
+            blobs.append((stat.st_mtime, entry.name, stat.st_size))
+
+        for _, digest, size in sorted(blobs):
+            self._blobs[digest] = size
+            self._size += size
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._size > self.max_size and self._blobs:
+            digest, size = self._blobs.popitem(last=False)
+            self._size -= size
+            _remove(self._path(digest))
+
+    def _forget(self, digest: str) -> None:
+        size = self._blobs.pop(digest, None)
+        if size is not None:
+            self._size -= size
+            _remove(self._path(digest))
+
+    def get(self, digest: str, file_out: str) -> bool:
+        """ Copy the content with that *digest* to *file_out*, if it is cached. """
+        with self._lock:
+            size = self._blobs.get(digest)
+            if size is None:
+                self._metrics["misses"] += 1
+                return False
+            self._blobs.move_to_end(digest)
+
+        path = self._path(digest)
+        try:
+            valid = _copy(path, file_out, digest)
+            # Keep the last use for the next run
+            os.utime(path)
+        except OSError:
+            log.warning("Cannot copy cached content %r", path, exc_info=True)
+            valid = False
+
+        with self._lock:
+            if not valid:
+                log.warning("Discarding damaged cached content %r", path)
+                self._forget(digest)
+                self._metrics["misses"] += 1
+            else:
+                self._metrics["hits"] += 1
+                self._metrics["bytes_saved"] += size
+        if not valid:
+            _remove(file_out)
+        return valid
+
+    def add(self, digest: str, file_path: str) -> None:
+        """ Keep a copy of *file_path*, if its content matches *digest*. """
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return
+        if size > self.max_size or _hasher(digest) is None:
+            return
+
+        with self._lock:
+            if digest in self._blobs:
+                self._blobs.move_to_end(digest)
+                return
+
+        path = self._path(digest)
+        tmp_path = "{}.{}{}".format(path, get_ident(), TMP_SUFFIX)
+        try:
+            valid = _copy(file_path, tmp_path, digest)
+            if valid:
+                os.replace(tmp_path, path)
+        except OSError:
+            log.warning("Cannot cache content %r", file_path, exc_info=True)
+            valid = False
+        finally:
+            _remove(tmp_path)
+
+        if not valid:
+            log.debug("Not caching %r, its content does not match", file_path)
+            return
+
+        with self._lock:
+            if digest not in self._blobs:
+                self._blobs[digest] = size
+                self._size += size
+            self._evict()
+
+    def get_metrics(self) -> Metrics:
+        with self._lock:
+            requests = self._metrics["hits"] + self._metrics["misses"]
+            ratio = self._metrics["hits"] / requests if requests else 0.0
+            return {
+                **self._metrics,
+                "hit_ratio": ratio,
+                "count": len(self._blobs),
+                "size": self._size,
+            }
@@ -0,0 +1,65 @@
+# coding: utf-8
+""" A small thread-safe LRU cache whose entries expire. """
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable
+
+from ..objects import Metrics
+
+__all__ = ("TTLCache",)
+
+
+class TTLCache:
+    """
+    Keep at most *maxsize* entries, for *ttl* seconds.
+    The least recently used entry is evicted first.
+    Nothing is kept when *ttl* is 0.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: int = 10) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = Lock()
+        # key -> (expiration time, value), the most recently used last
+        self._data: OrderedDict = OrderedDict()
+        self._metrics = {"hits": 0, "misses": 0}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            expiration, value = self._data.get(key, (0, default))
+            if expiration <= time.time():
+                self._data.pop(key, None)
+                self._metrics["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self._metrics["hits"] += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """ Remove entries for which *predicate(key, value)* is true. """
+        with self._lock:
+            keys = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def get_metrics(self) -> Metrics:
+        with self._lock:
+            return {**self._metrics, "size": len(self._data)}
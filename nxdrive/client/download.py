@@ -0,0 +1,343 @@
+# coding: utf-8
+"""
+Resumable and multi-range downloads.
+
+The content is written into a temporary file that is kept when the download
+fails. The next try asks the server for the missing bytes only, using a Range
+request guarded by the validator of the content the file was started with.
+Very big contents can be split into several ranges fetched concurrently and
+written in place. Written ranges are reported so that only the missing ones
+are fetched on the next try.
+
+Single stream downloads are hashed while they are written, and ranges once
+they are assembled, so that the content does not have to be read again at
+the end to check its digest.
+"""
+import hashlib
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from logging import getLogger
+from threading import Event, Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ..constants import FILE_BUFFER_SIZE
+
+__all__ = ("download",)
+
+log = getLogger(__name__)
+
+# Callable doing a streamed GET of the content with additional headers
+Getter = Callable[[Dict[str, str]], "requests.Response"]
+
+# Maximum size of a range, smaller ranges lose less on interruptions
+RANGE_SIZE = 32 * 1024 ** 2
+
+
+class _ContentChanged(Exception):
+    """ The content changed since the first ranges were written. """
+
+
+def _split(size: int, count: int) -> List[Tuple[int, int]]:
+    """ Split *size* bytes into *count* inclusive ranges. """
+    step = -(-size // count)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+class _Progress:
+    """ Thread-safe progress of the current file action. """
+
+    def __init__(self, action: Optional["FileAction"]) -> None:
+        self.action = action
+        self.lock = Lock()
+
+    def start(self, size: int, done: int) -> None:
+        if self.action:
+            self.action.size = size
+            self.action.progress = done
+
+    def add(self, count: int) -> None:
+        if self.action:
+            with self.lock:
+                self.action.progress += count
+
+
+def _write(
+    resp: "requests.Response",
+    file_out: str,
+    offset: int,
+    progress: _Progress,
+    stop: Callable[[], None],
+    hasher: Any = None,
+    chunk_size: int = FILE_BUFFER_SIZE,
+) -> None:
+    """
+    Write the streamed content of *resp* at *offset* in *file_out*.
+    Written chunks are fed to the optional *hasher*.
+    """
+    mode = "r+b" if os.path.isfile(file_out) else "wb"
+    with open(file_out, mode) as output:
+        output.seek(offset)
+        for chunk in resp.iter_content(chunk_size):
+            stop()
+            output.write(chunk)
+            if hasher:
+                hasher.update(chunk)
+            progress.add(len(chunk))
+
+
+def _hash_prefix(file_out: str, offset: int, hasher: Any) -> None:
+    """ Feed the *offset* first bytes of an interrupted download to *hasher*. """
+    with open(file_out, "rb") as f:
+        while offset > 0:
+            chunk = f.read(min(FILE_BUFFER_SIZE, offset))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            offset -= len(chunk)
+
+
+def _hash_assembled(
+    file_out: str, offset: int, written: Dict[int, int], hasher: Any
+) -> int:
+    """
+    Feed the ranges *written* contiguously from *offset* to *hasher*.
+    Return the offset of the first byte not hashed yet.
+    """
+    end = offset
+    while end in written:
+        end = written[end] + 1
+    with open(file_out, "rb") as f:
+        f.seek(offset)
+        while offset < end:
+            chunk = f.read(min(FILE_BUFFER_SIZE, end - offset))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            offset += len(chunk)
+    return offset
+
+
+def _download_ranges(
+    get: Getter,
+    file_out: str,
+    size: int,
+    count: int,
+    progress: _Progress,
+    validator: str = None,
+    done: List[Tuple[int, int]] = None,
+    on_range: Callable[[int, int], None] = None,
+    check_suspended: Callable = None,
+    digest_func: str = None,
+) -> Optional[str]:
+    """
+    Fetch the ranges not *done* yet on *count* threads and assemble them in
+    place. *on_range* is called with each range written.
+    Ranges are hashed once they are contiguous, while the next ones are
+    fetched, and the digest is returned when *digest_func* is given.
+    Raise _ContentChanged if the *validator* does not match anymore.
+    """
+    stopped = Event()
+    headers = {"If-Range": validator} if validator else {}
+
+    def stop() -> None:
+        if stopped.is_set():
+            raise InterruptedError("Download stopped")
+
+    def fetch(start: int, end: int) -> None:
+        resp = get({**headers, "Range": "bytes={}-{}".format(start, end)})
+        try:
+            if resp.status_code == 200 and validator:
+                raise _ContentChanged(file_out)
+            if resp.status_code != 206:
+                err = "Range {}-{} not served: HTTP {}"
+                raise ValueError(err.format(start, end, resp.status_code))
+            _write(resp, file_out, start, progress, stop)
+        finally:
+            resp.close()
+
+    if not done:
+        # Allocate the file so that ranges can be written in any order
+        with open(file_out, "wb") as output:
+            output.truncate(size)
+
+    # The same ranges are computed when resuming with the same options
+    written = dict(done or [])
+    ranges = _split(size, max(count, -(-size // RANGE_SIZE)))
+    missing = [(start, end) for start, end in ranges if written.get(start) != end]
+    progress.start(size, size - sum(end - start + 1 for start, end in missing))
+    hasher = hashlib.new(digest_func) if digest_func else None
+    hashed = 0
+
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        futures = {executor.submit(fetch, *rng): rng for rng in missing}
+        pending = set(futures)
+        try:
+            while "Fetching ranges":
+                if hasher:
+                    hashed = _hash_assembled(file_out, hashed, written, hasher)
+                if not pending:
+                    break
+                done_now, pending = wait(
+                    pending, timeout=1, return_when=FIRST_COMPLETED
+                )
+                for future in done_now:
+                    if future.exception() is None:
+                        start, end = futures[future]
+                        written[start] = end
+                        if on_range:
+                            on_range(start, end)
+                for future in done_now:
+                    # Raise the first error, once written ranges are saved
+                    future.result()
+                if check_suspended:
+                    check_suspended("Download")
+        except Exception:
+            stopped.set()
+            for future in pending:
+                future.cancel()
+            raise
+
+    return hasher.hexdigest() if hasher and hashed == size else None
+
+
+def download(
+    get: Getter,
+    file_out: str,
+    validator: str = None,
+    on_validator: Callable[[Optional[str]], None] = None,
+    action: "FileAction" = None,
+    check_suspended: Callable = None,
+    split_size: int = 0,
+    ranges: int = 1,
+    done_ranges: List[Tuple[int, int]] = None,
+    on_range: Callable[[int, int], None] = None,
+    digest_func: str = None,
+) -> Optional[str]:
+    """
+    Download a content into *file_out*.
+
+    If *file_out* already exists and the *validator* (ETag) of the content it
+    was started with is given, only the missing bytes are requested.
+    *on_validator* is called with the validator of the content being
+    downloaded, it has to be saved to resume a failed download later.
+    Contents bigger than *split_size* bytes are fetched in *ranges* parallel
+    ranges, when the server allows it. *on_range* is called with each range
+    written, they have to be saved too and given back as *done_ranges*.
+
+    When *digest_func* is given, the content is hashed while it is written
+    and its digest is returned.
+    """
+    progress = _Progress(action)
+    offset = os.path.getsize(file_out) if os.path.isfile(file_out) else 0
+    headers = {}
+    if offset:
+        headers["Range"] = "bytes={}-".format(offset)
+        if validator:
+            headers["If-Range"] = validator
+
+    def restart() -> Optional[str]:
+        # The file cannot be resumed, it is bigger than the content or
+        # the content changed
+        log.debug("Cannot resume %r, downloading it again", file_out)
+        os.remove(file_out)
+        return download(
+            get,
+            file_out,
+            on_validator=on_validator,
+            action=action,
+            check_suspended=check_suspended,
+            split_size=split_size,
+            ranges=ranges,
+            on_range=on_range,
+            digest_func=digest_func,
+        )
+
+    if offset and validator and done_ranges:
+        log.debug("Resuming download of %r in ranges", file_out)
+        try:
+            return _download_ranges(
+                get,
+                file_out,
+                offset,
+                max(1, ranges),
+                progress,
+                validator=validator,
+                done=done_ranges,
+                on_range=on_range,
+                check_suspended=check_suspended,
+                digest_func=digest_func,
+            )
+        except _ContentChanged:
+            return restart()
+
+    try:
+        resp = get(headers)
+    except Exception as exc:
+        # Clients raising on HTTP errors
+        if offset and getattr(exc, "status", None) == 416:
+            return restart()
+        raise
+
+    try:
+        if offset and resp.status_code == 416:
+            resp.close()
+            return restart()
+        resp.raise_for_status()
+
+        size = int(resp.headers.get("Content-Length", 0))
+        if resp.status_code == 206:
+            log.debug("Resuming download of %r from byte %d", file_out, offset)
+            size += offset
+        else:
+            # Full content
+            offset = 0
+            if (
+                ranges > 1
+                and split_size
+                and size >= split_size
+                and resp.headers.get("Accept-Ranges") == "bytes"
+            ):
+                resp.close()
+                etag = resp.headers.get("ETag")
+                if on_validator:
+                    on_validator(etag)
+                # Weak validators cannot be used with If-Range
+                if etag and etag.startswith("W/"):
+                    etag = None
+                log.debug("Downloading %r in %d ranges", file_out, ranges)
+                try:
+                    return _download_ranges(
+                        get,
+                        file_out,
+                        size,
+                        ranges,
+                        progress,
+                        validator=etag,
+                        on_range=on_range,
+                        check_suspended=check_suspended,
+                        digest_func=digest_func,
+                    )
+                except _ContentChanged:
+                    # The next try will start again
+                    err = "Content of {!r} changed while it was downloaded"
+                    raise ValueError(err.format(file_out)) from None
+
+            with open(file_out, "wb"):
+                pass
+
+        if on_validator:
+            on_validator(resp.headers.get("ETag"))
+        progress.start(size, offset)
+
+        def stop() -> None:
+            if check_suspended:
+                check_suspended("Download")
+
+        hasher = hashlib.new(digest_func) if digest_func else None
+        if hasher and offset:
+            _hash_prefix(file_out, offset, hasher)
+        _write(resp, file_out, offset, progress, stop, hasher=hasher)
+    finally:
+        resp.close()
+
+    return hasher.hexdigest() if hasher else None
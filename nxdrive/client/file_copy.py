@@ -0,0 +1,120 @@
+# coding: utf-8
+"""
+Copy of local files with the fastest mechanism the file system allows.
+
+A clone (reflink) shares the blocks of the source until one of the files is
+modified: it is instant on Btrfs, XFS or APFS. Otherwise the kernel copies
+the data itself, without going through user space buffers. A buffered copy
+is the last resort.
+"""
+import ctypes
+import errno
+import os
+import shutil
+from logging import getLogger
+from typing import BinaryIO, Callable, List, Tuple
+
+from ..constants import FILE_BUFFER_SIZE, LINUX, MAC
+
+__all__ = ("copy_file",)
+
+log = getLogger(__name__)
+
+# Errors meaning that a mechanism cannot be used for these files
+UNSUPPORTED = {
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTSUP,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EXDEV,
+}
+
+# Maximum size copied by one call to the kernel
+KERNEL_CHUNK_SIZE = 1024 ** 3
+
+# ioctl() request to clone a file on Linux, from <linux/fs.h>
+FICLONE = 0x40049409
+
+
+def _reflink(fsrc: BinaryIO, fdst: BinaryIO) -> None:
+    import fcntl
+
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def _copy_file_range(fsrc: BinaryIO, fdst: BinaryIO) -> None:
+    # Python 3.8+, the offsets of both files are updated
+    while os.copy_file_range(  # type: ignore
+        fsrc.fileno(), fdst.fileno(), KERNEL_CHUNK_SIZE
+    ):
+        pass
+
+
+def _sendfile(fsrc: BinaryIO, fdst: BinaryIO) -> None:
+    # Only Linux accepts a file as destination
+    while os.sendfile(fdst.fileno(), fsrc.fileno(), None, KERNEL_CHUNK_SIZE):
+        pass
+
+
+STRATEGIES: List[Tuple[str, Callable[[BinaryIO, BinaryIO], None]]] = []
+if LINUX:
+    STRATEGIES.append(("reflink", _reflink))
+    if hasattr(os, "copy_file_range"):
+        STRATEGIES.append(("copy_file_range", _copy_file_range))
+    STRATEGIES.append(("sendfile", _sendfile))
+
+
+def _clonefile(src: str, dst: str) -> bool:
+    """ Clone *src* on macOS, return False if the volume does not allow it. """
+    libc = ctypes.CDLL(None, use_errno=True)
+    clonefile = getattr(libc, "clonefile", None)
+    if clonefile is None:
+        # Before macOS 10.12
+        return False
+
+    # The destination must not exist
+    if os.path.isfile(dst):
+        os.remove(dst)
+    if not clonefile(os.fsencode(src), os.fsencode(dst), 0):
+        return True
+
+    err = ctypes.get_errno()
+    if err in UNSUPPORTED:
+        return False
+    raise OSError(err, os.strerror(err), dst)
+
+
+def _copy_content(fsrc: BinaryIO, fdst: BinaryIO) -> str:
+    for name, strategy in STRATEGIES:
+        try:
+            strategy(fsrc, fdst)
+            return name
+        except OSError as exc:
+            if exc.errno not in UNSUPPORTED:
+                raise
+            log.trace("Cannot copy %r with %s: %s", fsrc.name, name, exc)
+            # Start again with the next mechanism
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+
+    shutil.copyfileobj(fsrc, fdst, FILE_BUFFER_SIZE)
+    return "buffered"
+
+
+def copy_file(src: str, dst: str) -> str:
+    """
+    Copy the content and the permission bits of *src* to *dst*, as
+    shutil.copy() does. Return the name of the mechanism used.
+    """
+    if MAC and _clonefile(src, dst):
+        method = "clonefile"
+    else:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            method = _copy_content(fsrc, fdst)
+
+    shutil.copymode(src, dst)
+    log.trace("Copied %r to %r with %s", src, dst, method)
+    return method
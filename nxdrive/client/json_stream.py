@@ -0,0 +1,145 @@
+# coding: utf-8
+"""
+Incremental decoding of the large arrays sent by the server.
+
+Children listings, scroll pages, change summaries and query results are JSON
+arrays, possibly inside an object. Decoding the whole response at once keeps
+the body, its text and all decoded items in memory at the same time, which
+amounts to gigabytes for a folder with hundreds of thousands of children.
+
+Items are decoded here while the body is received, one at a time, so that
+only the current chunk and the items kept by the caller are in memory.
+"""
+import codecs
+import json
+import re
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+__all__ = ("CHUNK_SIZE", "JSONArrayStream")
+
+# Size of the chunks read from responses
+CHUNK_SIZE = 64 * 1024
+NUMBER_CHARS = "0123456789.eE+-"
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class JSONArrayStream:
+    """
+    Iterate over the items of the *key* array of the JSON object read from
+    *chunks*, or of the JSON array itself if *key* is None.
+    The other members of the object are stored in *fields* as they are read:
+    all of them are known once the iteration is over.
+    """
+
+    def __init__(
+        self,
+        chunks: Iterable[bytes],
+        key: Optional[str] = None,
+        close: Callable[[], None] = None,
+    ) -> None:
+        self.key = key
+        self.fields: Dict[str, Any] = {}
+        self._chunks = iter(chunks)
+        self._close = close
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def __iter__(self) -> Iterator[Any]:
+        try:
+            yield from self._items()
+        finally:
+            self.close()
+
+    def __del__(self) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """ Release the connection, the remaining items are not read. """
+        if self._close:
+            self._close()
+            self._close = None
+
+    def _read(self) -> bool:
+        """ Append the next chunk to the buffer, return False at the end. """
+        if self._eof:
+            return False
+
+        # Forget what was decoded, but keep the pending text
+        self._buffer = self._buffer[self._pos :]
+        self._pos = 0
+        for chunk in self._chunks:
+            if chunk:
+                self._buffer += self._text.decode(chunk)
+                return True
+
+        self._buffer += self._text.decode(b"", final=True)
+        self._eof = True
+        return False
+
+    def _next_char(self) -> str:
+        """ Skip whitespaces, return the next character without consuming it. """
+        while "Looking for a character":
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read():
+                raise ValueError("Unexpected end of JSON data")
+
+    def _expect(self, chars: str) -> str:
+        char = self._next_char()
+        if char not in chars:
+            raise ValueError(
+                "Expected one of {!r} at position {}, got {!r}".format(
+                    chars, self._pos, char
+                )
+            )
+        self._pos += 1
+        return char
+
+    def _value(self) -> Any:
+        """ Decode the next value, reading as many chunks as needed. """
+        self._next_char()
+        while "Decoding":
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if self._read():
+                    continue
+                raise
+
+            # A number may have been cut, its end being in the next chunk
+            cut = end == len(self._buffer) or self._buffer[end] in NUMBER_CHARS
+            if not cut or not self._read():
+                self._pos = end
+                return value
+
+    def _array(self) -> Iterator[Any]:
+        self._expect("[")
+        if self._next_char() == "]":
+            self._pos += 1
+            return
+        while "Items":
+            yield self._value()
+            if self._expect(",]") == "]":
+                return
+
+    def _items(self) -> Iterator[Any]:
+        if self.key is None:
+            yield from self._array()
+            return
+
+        self._expect("{")
+        if self._next_char() == "}":
+            return
+        while "Members":
+            name = self._value()
+            self._expect(":")
+            if name == self.key and self._next_char() == "[":
+                yield from self._array()
+            else:
+                self.fields[name] = self._value()
+            if self._expect(",}") == "}":
+                return
@@ -14,10 +14,11 @@ from contextlib import suppress
 from datetime import datetime
 from logging import getLogger
 from time import mktime, strptime
-from typing import Any, List, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from send2trash import send2trash
 
+from .file_copy import copy_file
 from ..constants import (
     DOWNLOAD_TMP_FILE_PREFIX,
     DOWNLOAD_TMP_FILE_SUFFIX,
@@ -69,6 +70,8 @@ class FileInfo:
         # Function to check during long-running processing like digest
         # computation if the synchronization thread needs to be suspended
         self.check_suspended = kwargs.pop("check_suspended", None)
+        # Context manager factory to limit concurrent digest computations
+        self.digest_slot = kwargs.pop("digest_slot", None)
         self.size = kwargs.pop("size", 0)
         filepath = os.path.join(root, path[1:].replace("/", os.path.sep))
         root = unicodedata.normalize("NFC", root)
@@ -92,6 +95,8 @@ class FileInfo:
 
         # Function to use
         self._digest_func = kwargs.pop("digest_func", "MD5").lower()
+        # Digests already known, by function
+        self._digests: Dict[str, str] = {}
 
         # Precompute base name once and for all are it's often useful in
         # practice
@@ -106,14 +111,18 @@ class FileInfo:
         if self.folderish:
             return None
 
-        digest_func = digest_func or self._digest_func
+        digest_func = (digest_func or self._digest_func).lower()
+        if digest_func in self._digests:
+            return self._digests[digest_func]
+
         digester = getattr(hashlib, digest_func, None)
         if digester is None:
             raise ValueError("Unknown digest method: " + digest_func)
 
         h = digester()
+        slot = self.digest_slot() if self.digest_slot else suppress()
         try:
-            with open(safe_long_path(self.filepath), "rb") as f:
+            with slot, open(safe_long_path(self.filepath), "rb") as f:
                 while True:
                     # Check if synchronization thread was suspended
                     if self.check_suspended is not None:
@@ -124,7 +133,18 @@ class FileInfo:
                     h.update(buf)
         except OSError:
             return UNACCESSIBLE_HASH
-        return h.hexdigest()
+        self._digests[digest_func] = h.hexdigest()
+        return self._digests[digest_func]
+
+    def set_digest(self, digest: str) -> None:
+        """
+        Save a digest of the file content computed elsewhere, e.g. while it
+        was downloaded, so that the file is not read again.
+        """
+        if not digest:
+            return
+        with suppress(ValueError):
+            self._digests[guess_digest_algorithm(digest)] = digest
 
 
 class LocalClient:
@@ -138,6 +158,8 @@ class LocalClient:
         # Function to check during long-running processing like digest
         # computation if the synchronization thread needs to be suspended
         self.check_suspended = kwargs.pop("check_suspended", None)
+        # Context manager factory to limit concurrent digest computations
+        self.digest_slot = kwargs.pop("digest_slot", None)
 
         while len(base_folder) > 1 and base_folder.endswith(os.path.sep):
             base_folder = base_folder[:-1]
@@ -453,6 +475,7 @@ FolderType=Generic
             mtime,
             digest_func=self._digest_func,
             check_suspended=self.check_suspended,
+            digest_slot=self.digest_slot,
             remote_ref=remote_ref,
             size=size,
         )
@@ -652,6 +675,14 @@ FolderType=Generic
     def exists(self, ref: str) -> bool:
         return os.path.exists(self.abspath(ref))
 
+    def copy_file(self, ref: str, file_out: str) -> None:
+        """
+        Copy a local file to *file_out*, cloning it when the file system
+        allows it, see client/file_copy.py.
+        """
+        method = copy_file(self.abspath(ref), file_out)
+        log.debug("Copied local file %r to %r with %s", ref, file_out, method)
+
     def rename(self, ref: str, to_name: str) -> FileInfo:
         """ Rename a local file or folder. """
 
@@ -0,0 +1,209 @@
+# coding: utf-8
+"""
+HTTP connection pools shared by the clients of a same server.
+
+Each `Remote` has its own requests session, and so had its own connection
+pools: processors, Direct Edit and the engines bound to a same server were
+opening connections, and doing TLS handshakes, again and again, while the
+small default pools were discarding connections under concurrency.
+
+Sessions now mount a transport adapter shared by all clients using the same
+server URL and proxy settings. The pools are sized for all the threads of
+these clients and connections are kept alive with TCP keep-alive probes.
+Cookies and credentials are still held by each session.
+"""
+import socket
+from logging import getLogger
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from weakref import WeakKeyDictionary
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.poolmanager import PoolManager, ProxyManager
+
+from ..objects import Metrics
+
+__all__ = ("ConnectionPools", "POOL_SIZE", "PoolAdapter", "shared_pools")
+
+log = getLogger(__name__)
+
+# Connections kept per host by default, as requests does
+POOL_SIZE = 10
+
+# TCP keep-alive: first probe after 60 seconds of inactivity,
+# then every 10 seconds, and the connection is dropped after 6 failures
+KEEP_ALIVE_IDLE = 60
+KEEP_ALIVE_INTERVAL = 10
+KEEP_ALIVE_COUNT = 6
+
+
+def _socket_options() -> List[Tuple[int, int, int]]:
+    """ Default socket options, with TCP keep-alive when the OS supports it. """
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+    tunings = (
+        # TCP_KEEPALIVE is the idle time on macOS
+        ("TCP_KEEPALIVE", KEEP_ALIVE_IDLE),
+        ("TCP_KEEPIDLE", KEEP_ALIVE_IDLE),
+        ("TCP_KEEPINTVL", KEEP_ALIVE_INTERVAL),
+        ("TCP_KEEPCNT", KEEP_ALIVE_COUNT),
+    )
+    for name, value in tunings:
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+
+class _Stats:
+    """ Thread-safe counters of a shared adapter. """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.counters = {"requests": 0, "connections": 0, "waits": 0}
+
+    def add(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] += 1
+
+
+class _CountingPool:
+    """
+    Mixin counting the new connections of a pool, and the requests that found
+    all the connections of the pool busy.
+    """
+
+    stats: _Stats = None
+
+    def _get_conn(self, timeout: float = None) -> Any:
+        if self.pool is not None and self.pool.empty():
+            self.stats.add("waits")
+        return super()._get_conn(timeout=timeout)
+
+    def _new_conn(self) -> Any:
+        self.stats.add("connections")
+        return super()._new_conn()
+
+
+class PoolAdapter(HTTPAdapter):
+    """ A transport adapter with keep-alive connections and statistics. """
+
+    def __init__(self, size: int = POOL_SIZE, **kwargs: Any) -> None:
+        self.stats = _Stats()
+        attrs = {"stats": self.stats}
+        self._pool_classes = {
+            "http": type("HTTPPool", (_CountingPool, HTTPConnectionPool), attrs),
+            "https": type("HTTPSPool", (_CountingPool, HTTPSConnectionPool), attrs),
+        }
+        super().__init__(pool_maxsize=size, **kwargs)
+
+    @property
+    def size(self) -> int:
+        return self._pool_maxsize
+
+    def _count(self, manager: PoolManager) -> None:
+        manager.pool_classes_by_scheme = self._pool_classes
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        kwargs["socket_options"] = _socket_options()
+        super().init_poolmanager(*args, **kwargs)
+        self._count(self.poolmanager)
+
+    def proxy_manager_for(self, proxy: str, **proxy_kwargs: Any) -> PoolManager:
+        new = proxy not in self.proxy_manager
+        if new and not proxy.lower().startswith("socks"):
+            proxy_kwargs["socket_options"] = _socket_options()
+        manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+        if new and isinstance(manager, ProxyManager):
+            self._count(manager)
+        return manager
+
+    def resize(self, size: int) -> None:
+        """
+        Recreate the pools to hold *size* connections per host.
+        Idle connections are closed, busy ones are closed once released.
+        """
+        log.debug("Resizing the connection pool from %d to %d", self.size, size)
+        self.close()
+        self.proxy_manager = {}
+        self.init_poolmanager(self._pool_connections, size, block=self._pool_block)
+
+    def send(self, *args: Any, **kwargs: Any) -> Any:
+        self.stats.add("requests")
+        return super().send(*args, **kwargs)
+
+    def get_metrics(self) -> Metrics:
+        with self.stats.lock:
+            metrics = dict(self.stats.counters)
+        # Ratio of requests sent on an already opened connection
+        requests = metrics["requests"]
+        reused = max(0, requests - metrics["connections"])
+        metrics["reuse_ratio"] = round(reused / requests, 2) if requests else 0.0
+        metrics["size"] = self.size
+        return metrics
+
+
+class ConnectionPools:
+    """ Adapters shared by the sessions using the same server and proxies. """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._adapters: Dict[Tuple[str, Tuple], PoolAdapter] = {}
+        # Pool size needed by each session, sessions are weakly referenced
+        self._sizes: Dict[Tuple[str, Tuple], WeakKeyDictionary] = {}
+
+    @staticmethod
+    def _key(url: str, proxies: Optional[Dict[str, str]]) -> Tuple[str, Tuple]:
+        parts = urlsplit(url)
+        server = "{}://{}".format(parts.scheme, parts.netloc).lower()
+        return server, tuple(sorted((proxies or {}).items()))
+
+    def mount(
+        self,
+        session: Session,
+        url: str,
+        proxies: Dict[str, str] = None,
+        size: int = POOL_SIZE,
+    ) -> PoolAdapter:
+        """
+        Mount on *session* the adapter shared by the clients of *url* using
+        the same *proxies*. The adapter pools grow to hold the connections
+        needed by all its sessions, *size* being the need of this one.
+        """
+        key = self._key(url, proxies)
+        with self._lock:
+            for sizes in self._sizes.values():
+                sizes.pop(session, None)
+
+            sizes = self._sizes.setdefault(key, WeakKeyDictionary())
+            sizes[session] = size
+            needed = sum(sizes.values())
+
+            adapter = self._adapters.get(key)
+            if adapter is None:
+                adapter = self._adapters[key] = PoolAdapter(size=needed)
+            elif needed > adapter.size:
+                adapter.resize(needed)
+
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return adapter
+
+    def get_metrics(self) -> Metrics:
+        with self._lock:
+            adapters = list(self._adapters.items())
+
+        metrics = {}
+        for (server, proxies), adapter in adapters:
+            # Proxy URLs may contain credentials, only keep their host
+            hosts = sorted({urlsplit(url).hostname or "" for _, url in proxies})
+            name = server + "".join(" via " + host for host in hosts)
+            metrics[name] = adapter.get_metrics()
+        return metrics
+
+
+# Pools shared by all the clients of the application
+shared_pools = ConnectionPools()
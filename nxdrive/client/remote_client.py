@@ -1,20 +1,43 @@
 # coding: utf-8
+import hashlib
+import json
 import os
 import socket
 import tempfile
 import time
+from datetime import datetime
 from logging import getLogger
-from threading import Lock, current_thread
-from typing import Any, Callable, Dict, List, Optional, Union
-from urllib.parse import unquote
+from threading import BoundedSemaphore
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from urllib.parse import unquote, urlparse
+
+import requests
 
+from nuxeo import constants as nuxeo_constants
 from nuxeo.auth import TokenAuth
 from nuxeo.client import Nuxeo
 from nuxeo.compat import get_text
-from nuxeo.exceptions import HTTPError
-from nuxeo.models import FileBlob
+from nuxeo.exceptions import CorruptedFile, HTTPError
+from nuxeo.models import Batch, FileBlob
 
+from .cache import TTLCache
+from .download import download
+from .json_stream import CHUNK_SIZE, JSONArrayStream
+from .pool import POOL_SIZE, shared_pools
 from .proxy import Proxy
+from .upload_batch import SMALL_FILE_SIZE, SentBlobs, SharedBatch
+from .uploader import ChunkedUploadsAPI, execution_headers, upload_blob
 from ..constants import (
     APP_NAME,
     DOWNLOAD_TMP_FILE_PREFIX,
@@ -26,9 +49,15 @@ from ..constants import (
 )
 from ..engine.activity import Action, FileAction
 from ..exceptions import NotFound
-from ..objects import NuxeoDocumentInfo, RemoteFileInfo
+from ..objects import DocPair, NuxeoDocumentInfo, RemoteFileInfo
 from ..options import Options
-from ..utils import get_device, lock_path, unlock_path, version_le
+from ..utils import (
+    get_device,
+    guess_digest_algorithm,
+    lock_path,
+    unlock_path,
+    version_le,
+)
 
 __all__ = ("FilteredRemote", "Remote")
 
@@ -53,9 +82,16 @@ class Remote(Nuxeo):
         dao: "EngineDAO" = None,
         repository: str = Options.remote_repo,
         timeout: int = TIMEOUT,
+        transfers: "TransferService" = None,
+        max_uploads: int = None,
+        pool_size: int = POOL_SIZE,
+        docs_cache_ttl: int = 0,
+        blob_cache: "BlobCache" = None,
         **kwargs: Any,
     ) -> None:
         auth = TokenAuth(token) if token else (user_id, password)
+        if Options.ca_bundle:
+            kwargs.setdefault("verify", Options.ca_bundle)
         self.kwargs = kwargs
 
         super().__init__(
@@ -75,10 +111,10 @@ class Remote(Nuxeo):
             }
         )
 
+        self.pool_size = pool_size
         self.set_proxy(proxy)
 
-        if dao:
-            self._dao = dao
+        self._dao = dao
 
         self.timeout = timeout if timeout > 0 else TIMEOUT
 
@@ -92,7 +128,15 @@ class Remote(Nuxeo):
             upload_tmp_dir if upload_tmp_dir is not None else tempfile.gettempdir()
         )
 
-        self.upload_lock = Lock()
+        self.upload_slots = BoundedSemaphore(max(1, max_uploads or Options.max_uploads))
+        # Upload batches shared by small new files, by folder
+        self.small_uploads = SharedBatch(self.uploads.batch)
+        self.sent_blobs = SentBlobs(self.small_uploads, self._send_small)
+        # Documents metadata and parents, by reference
+        self.docs_cache = TTLCache(ttl=docs_cache_ttl)
+        self.transfers = transfers
+        # Downloaded contents shared by all engines, by digest
+        self.blob_cache = blob_cache
 
         if base_folder is not None:
             base_folder_doc = self.fetch(base_folder)
@@ -119,6 +163,15 @@ class Remote(Nuxeo):
         :param include_versions:
         :rtype: bool
         """
+        return self._query_doc(ref, use_trash, include_versions) is not None
+
+    def _query_doc(
+        self, ref: str, use_trash: bool, include_versions: bool
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Return the document with that reference, if it exists.
+        The JSON of the document holds the UID of its parent in "parentRef".
+        """
         ref = self._check_ref(ref)
         id_prop = "ecm:path" if ref.startswith("/") else "ecm:uuid"
 
@@ -131,8 +184,8 @@ class Remote(Nuxeo):
             trash,
             version,
         )
-        results = self.query(query)
-        return len(results["entries"]) == 1
+        entries = self.query(query)["entries"]
+        return entries[0] if entries else None
 
     def request_token(self, revoke: bool = False) -> str:
         """Request and return a new token for the user"""
@@ -151,39 +204,164 @@ class Remote(Nuxeo):
         self.auth = TokenAuth(token)
         self.client.auth = self.auth
 
+    def _use_transfers(self) -> bool:
+        """ Check if transfers can be handed to the asynchronous service. """
+        return self.transfers is not None and self.transfers.is_started()
+
+    def _transfer_params(self, url: str) -> Dict[str, Any]:
+        """ Headers, with credentials, and proxy to use for an async transfer. """
+        request = requests.Request(
+            "GET", url, headers=self.client.headers, auth=self.client.auth
+        ).prepare()
+        headers = dict(request.headers)
+        headers.pop("Content-Type", None)
+        proxies = self.client.client_kwargs.get("proxies") or {}
+        return {"headers": headers, "proxy": proxies.get(urlparse(url).scheme)}
+
     def download(
-        self, url: str, file_out: str = None, digest: str = None, **kwargs: Any
+        self,
+        url: str,
+        file_out: str = None,
+        digest: str = None,
+        doc_pair: DocPair = None,
+        **kwargs: Any,
     ) -> str:
         log.trace(
             "Downloading file from %r to %r with digest=%r", url, file_out, digest
         )
 
-        resp = self.client.request("GET", url.replace(self.client.host, ""))
+        if file_out and digest and self._get_cached_blob(file_out, digest):
+            return file_out
 
-        current_action = Action.get_current_action()
-        if current_action and resp:
-            current_action.size = int(resp.headers.get("Content-Length", 0))
+        if file_out and self._use_transfers():
+            check_suspended = kwargs.pop("check_suspended", self.check_suspended)
+            job = self.transfers.download(
+                url,
+                file_out,
+                digest=digest,
+                action=Action.get_current_action(),
+                **self._transfer_params(url),
+            )
+            locker = unlock_path(file_out)
+            try:
+                tmp_file = self.transfers.run(job, interact=check_suspended)
+            finally:
+                lock_path(file_out, locker)
+            self._cache_blob(tmp_file, digest)
+            return tmp_file
 
+        path = url.replace(self.client.host, "")
         if file_out:
             check_suspended = kwargs.pop("check_suspended", self.check_suspended)
+
+            def get(headers: Dict[str, str]) -> requests.Response:
+                return self.client.request("GET", path, headers=headers, stream=True)
+
+            def save_validator(etag: Optional[str]) -> None:
+                if self._dao and digest:
+                    pair_id = doc_pair.id if doc_pair else None
+                    self._dao.save_download(file_out, digest, etag, doc_pair=pair_id)
+
+            def save_range(start: int, end: int) -> None:
+                if self._dao and digest:
+                    self._dao.add_download_range(file_out, start, end)
+
+            try:
+                digest_func = guess_digest_algorithm(digest) if digest else None
+            except ValueError:
+                digest_func = None
+
+            validator, done_ranges = self._get_partial_download(file_out, digest)
             locker = unlock_path(file_out)
             try:
-                self.operations.save_to_file(
-                    current_action,
-                    resp,
+                computed = download(
+                    get,
                     file_out,
-                    digest=digest,
-                    chunk_size=FILE_BUFFER_SIZE,
+                    validator=validator,
+                    on_validator=save_validator,
+                    action=Action.get_current_action(),
                     check_suspended=check_suspended,
+                    split_size=Options.download_split_threshold * 1024 ** 2,
+                    ranges=Options.download_ranges,
+                    done_ranges=done_ranges,
+                    on_range=save_range,
+                    digest_func=digest_func,
                 )
+                self._check_digest(file_out, digest, computed=computed)
             finally:
                 lock_path(file_out, locker)
-                del resp
+            if self._dao:
+                self._dao.remove_download(file_out)
+            self._cache_blob(file_out, digest)
             return file_out
-        else:
-            result = resp.content
-            del resp
-            return result
+
+        resp = self.client.request("GET", path)
+        result = resp.content
+        del resp
+        return result
+
+    def _get_cached_blob(self, file_out: str, digest: str) -> bool:
+        """ Copy the content from the blob cache instead of downloading it. """
+        if not self.blob_cache:
+            return False
+
+        locker = unlock_path(file_out)
+        try:
+            if not self.blob_cache.get(digest, file_out):
+                return False
+        finally:
+            lock_path(file_out, locker)
+
+        log.debug("Copied content %r from the cache to %r", digest, file_out)
+        if self._dao:
+            self._dao.remove_download(file_out)
+        return True
+
+    def _cache_blob(self, file_out: str, digest: Optional[str]) -> None:
+        if self.blob_cache and digest:
+            self.blob_cache.add(digest, file_out)
+
+    def _get_partial_download(
+        self, file_out: str, digest: str
+    ) -> Tuple[Optional[str], List[Tuple[int, int]]]:
+        """
+        Return the validator and the ranges already written to resume the
+        download of a partial file. The file is removed if it cannot be resumed.
+        """
+        saved = self._dao.get_download(file_out) if self._dao and digest else None
+        if saved and saved.digest == digest:
+            if os.path.isfile(file_out):
+                log.debug("Partial download %r may be resumed", file_out)
+            ranges = [rng.split("-") for rng in saved.ranges.split(",") if rng]
+            return saved.etag, [(int(start), int(end)) for start, end in ranges]
+
+        if os.path.isfile(file_out):
+            os.remove(file_out)
+        return None, []
+
+    def _check_digest(self, file_out: str, digest: str, computed: str = None) -> None:
+        """
+        Ensure the downloaded content is the expected one.
+        The file is read only if its digest was not *computed* while
+        it was downloaded.
+        """
+        if not computed:
+            try:
+                hasher = hashlib.new(guess_digest_algorithm(digest))
+            except ValueError:
+                return
+
+            with open(file_out, "rb") as f:
+                for chunk in iter(lambda: f.read(FILE_BUFFER_SIZE), b""):
+                    hasher.update(chunk)
+            computed = hasher.hexdigest()
+
+        if computed != digest:
+            # Cannot be resumed
+            os.remove(file_out)
+            if self._dao:
+                self._dao.remove_download(file_out)
+            raise CorruptedFile(file_out, digest, computed)
 
     def upload(
         self,
@@ -191,55 +369,84 @@ class Remote(Nuxeo):
         filename: str = None,
         mime_type: str = None,
         command: str = None,
+        doc_pair: DocPair = None,
         **params: Any,
     ):
         """ Upload a file with a batch.
 
         If command is not None, the operation is executed
         with the batch as an input.
+        Big files of a known *doc_pair* are uploaded by chunks
+        and the upload is resumed on the next try, small new files
+        are batched. Other files are sent in one request, by the
+        transfer service when it is started.
         """
-        with self.upload_lock:
+        chunk_size = Options.upload_chunk_size * 1024 ** 2
+        if (
+            command
+            and self._dao
+            and doc_pair
+            and doc_pair.local_digest
+            and os.path.getsize(file_path) > chunk_size
+        ):
+            with self.upload_slots:
+                return self._upload_chunked(
+                    file_path,
+                    filename=filename,
+                    mime_type=mime_type,
+                    command=command,
+                    doc_pair=doc_pair,
+                    chunk_size=chunk_size,
+                    **params,
+                )
+
+        if command == "NuxeoDrive.CreateFile":
+            if os.path.getsize(file_path) <= SMALL_FILE_SIZE:
+                with self.upload_slots:
+                    return self._upload_small(
+                        file_path,
+                        filename=filename,
+                        mime_type=mime_type,
+                        command=command,
+                        **params,
+                    )
+
+        if command and command.startswith("NuxeoDrive.") and self._use_transfers():
+            return self._upload_async(
+                file_path,
+                filename=filename,
+                mime_type=mime_type,
+                command=command,
+                **params,
+            )
+
+        # Each upload has its own batch and action, only the number
+        # of concurrent uploads is limited
+        with self.upload_slots:
             tick = time.time()
             action = FileAction("Upload", file_path, filename)
             try:
-                # Init resumable upload getting a batch generated by the
-                # server. This batch is to be used as a resumable session
-                batch = self.uploads.batch()
-
                 blob = FileBlob(file_path)
                 if filename:
                     blob.name = filename
                 if mime_type:
                     blob.mimetype = mime_type
-                upload_result = batch.upload(blob)
-                blob.fd.close()
-
-                upload_duration = int(time.time() - tick)
-                action.transfer_duration = upload_duration
-                # Use upload duration * 2 as Nuxeo transaction timeout
-                tx_timeout = max(TX_TIMEOUT, upload_duration * 2)
-                log.trace(
-                    "Using %d seconds [max(%d, 2 * upload time=%d)] as "
-                    "Nuxeo transaction timeout for batch execution of %r "
-                    "with file %r",
-                    tx_timeout,
-                    TX_TIMEOUT,
-                    upload_duration,
-                    command,
-                    file_path,
-                )
-
-                if upload_duration > 0:
-                    size = os.stat(file_path).st_size
+                try:
+                    # In a batch generated by the server, with its own headers
+                    upload_result = upload_blob(self.client, blob)
+                finally:
+                    blob.fd.close()
+
+                headers = execution_headers(tick, action=action)
+                if action.transfer_duration > 0:
                     log.trace(
                         "Speed for %d bytes is %d sec: %f bytes/sec",
-                        size,
-                        upload_duration,
-                        size / upload_duration,
+                        action.size,
+                        action.transfer_duration,
+                        action.size / action.transfer_duration,
                     )
 
                 if command:
-                    headers = {"Nuxeo-Transaction-Timeout": str(tx_timeout)}
                     return self.operations.execute(
                         command=command,
                         input_obj=upload_result,
@@ -249,6 +456,198 @@ class Remote(Nuxeo):
             finally:
                 FileAction.finish_action()
 
+    def send_ahead(self, parent_id: str, files: List[Tuple[str, str]]) -> None:
+        """
+        Start sending the blobs of the small new *files* of the folder
+        *parent_id*, given as paths and names, in the batch of the folder.
+        Their documents are created by stream_file() as usual.
+        """
+        if not self._use_transfers():
+            self.sent_blobs.send(parent_id, files)
+
+    def _send_small(
+        self,
+        batch: Batch,
+        index: int,
+        file_path: str,
+        filename: str = None,
+        mime_type: str = None,
+    ) -> Any:
+        """ Upload a small file at *index* in a shared *batch*. """
+        blob = FileBlob(file_path)
+        if filename:
+            blob.name = filename
+        if mime_type:
+            blob.mimetype = mime_type
+        try:
+            return upload_blob(self.client, blob, batch_id=batch.uid, index=index)
+        except HTTPError as exc:
+            if exc.status == 404:
+                log.debug("Upload batch %s expired on the server", batch.uid)
+                self.small_uploads.discard(batch)
+            raise
+        finally:
+            blob.fd.close()
+
+    def _upload_small(
+        self,
+        file_path: str,
+        filename: str = None,
+        mime_type: str = None,
+        command: str = None,
+        **params: Any,
+    ) -> Any:
+        """
+        Upload a small file in the batch shared with the other new files of
+        its folder, unless its blob was sent ahead, then execute *command*
+        with it as input.
+        """
+        tick = time.time()
+        action = FileAction("Upload", file_path, filename)
+        try:
+            upload_result = None
+            sent = None
+            if not mime_type:
+                sent = self.sent_blobs.take(file_path, action.filename)
+            if sent:
+                batch, upload = sent
+                try:
+                    upload_result = upload.result()
+                except Exception:
+                    log.debug("Cannot send ahead %r", file_path, exc_info=True)
+                    self.small_uploads.release(batch)
+
+            if upload_result is None:
+                batch, index = self.small_uploads.acquire(
+                    action.size, group=params.get("parentId") or ""
+                )
+                try:
+                    upload_result = self._send_small(
+                        batch, index, file_path, action.filename, mime_type
+                    )
+                except Exception:
+                    self.small_uploads.release(batch)
+                    raise
+
+            action.progress = action.size
+            try:
+                headers = execution_headers(tick, action=action)
+                # The other files of the batch still need it
+                headers["X-Batch-No-Drop"] = "true"
+                return self.operations.execute(
+                    command=command, input_obj=upload_result, headers=headers, **params
+                )
+            finally:
+                self.small_uploads.release(batch)
+        finally:
+            FileAction.finish_action()
+
+    def _get_upload_batch(
+        self, doc_pair: int, digest: str, chunk_size: int
+    ) -> Tuple[str, Set[int]]:
+        """
+        Return the batch to use for the chunked upload of a given content,
+        and the indexes of the chunks already received by the server.
+        """
+        upload = self._dao.get_upload(doc_pair, digest)
+        if upload and upload.chunk_size == chunk_size:
+            try:
+                info = self.uploads.get(upload.batch_id, file_idx=0)
+            except HTTPError as exc:
+                log.debug("Cannot resume batch %s: %s", upload.batch_id, exc)
+            else:
+                uploaded = {int(idx) for idx in upload.chunks.split(",") if idx}
+                uploaded &= {int(idx) for idx in info.uploadedChunkIds}
+                log.debug(
+                    "Resuming upload in batch %s, %d chunks already sent",
+                    upload.batch_id,
+                    len(uploaded),
+                )
+                return upload.batch_id, uploaded
+
+        batch_id = self.uploads.batch().uid
+        self._dao.save_upload(doc_pair, digest, batch_id, chunk_size)
+        return batch_id, set()
+
+    def _upload_chunked(
+        self,
+        file_path: str,
+        filename: str = None,
+        mime_type: str = None,
+        command: str = None,
+        doc_pair: DocPair = None,
+        chunk_size: int = FILE_BUFFER_SIZE,
+        **params: Any,
+    ) -> Any:
+        """
+        Upload a file by chunks then execute *command* with it as input.
+        The batch and acknowledged chunks are saved in the database
+        so that an interrupted upload of the same content can be resumed.
+        """
+        tick = time.time()
+        action = FileAction("Upload", file_path, filename)
+        try:
+            batch_id, uploaded = self._get_upload_batch(
+                doc_pair.id, doc_pair.local_digest, chunk_size
+            )
+            action.progress = min(action.size, len(uploaded) * chunk_size)
+
+            def sent(index: int, size: int) -> None:
+                self._dao.add_upload_chunk(doc_pair.id, index)
+                action.progress = min(action.size, action.progress + size)
+                if self.check_suspended:
+                    self.check_suspended("Chunked upload")
+
+            blob = FileBlob(file_path)
+            blob.name = action.filename
+            if mime_type:
+                blob.mimetype = mime_type
+            service = ChunkedUploadsAPI(
+                self.client, chunk_size, uploaded=uploaded, callback=sent
+            )
+            batch = Batch(service=service, batchId=batch_id)
+            try:
+                upload_result = batch.upload(blob, chunked=True)
+            finally:
+                blob.fd.close()
+
+            headers = execution_headers(tick, action=action)
+            res = self.operations.execute(
+                command=command, input_obj=upload_result, headers=headers, **params
+            )
+            self._dao.remove_upload(doc_pair.id)
+            return res
+        finally:
+            FileAction.finish_action()
+
+    def _upload_async(
+        self,
+        file_path: str,
+        filename: str = None,
+        mime_type: str = None,
+        command: str = None,
+        **params: Any,
+    ) -> Any:
+        """ Upload a file and execute *command* using the transfer service. """
+        action = FileAction("Upload", file_path, filename)
+        try:
+            api_url = "{}{}/".format(self.client.host, self.client.api_path)
+            job = self.transfers.upload(
+                api_url,
+                file_path,
+                action.filename,
+                action.size,
+                mime_type,
+                command,
+                {key: value for key, value in params.items() if value is not None},
+                action=action,
+                **self._transfer_params(api_url),
+            )
+            with self.upload_slots:
+                return self.transfers.run(job, interact=self.check_suspended)
+        finally:
+            FileAction.finish_action()
+
     def get_fs_info(
         self,
         fs_item_id: str,
@@ -277,12 +676,14 @@ class Remote(Nuxeo):
         parent_fs_item_id: str = None,
         fs_item_info: str = None,
         file_out: str = None,
+        doc_pair: DocPair = None,
         **kwargs: Any,
     ) -> str:
         """Stream the binary content of a file system item to a tmp file
 
         Raises NotFound if file system item with id fs_item_id
-        cannot be found
+        cannot be found.
+        The partial download of a known *doc_pair* is removed with the pair.
         """
         fs_item_info = fs_item_info or self.get_fs_info(
             fs_item_id, parent_fs_item_id=parent_fs_item_id
@@ -290,26 +691,25 @@ class Remote(Nuxeo):
         download_url = self.client.host + fs_item_info.download_url
         file_name = os.path.basename(file_path)
         if file_out is None:
+            # A stable name allows to resume the download on the next try
             file_dir = os.path.dirname(file_path)
             file_out = os.path.join(
                 file_dir,
-                "".join(
-                    [
-                        DOWNLOAD_TMP_FILE_PREFIX,
-                        file_name,
-                        str(current_thread().ident),
-                        DOWNLOAD_TMP_FILE_SUFFIX,
-                    ]
-                ),
+                DOWNLOAD_TMP_FILE_PREFIX + file_name + DOWNLOAD_TMP_FILE_SUFFIX,
             )
 
         FileAction("Download", file_out, file_name, 0)
         try:
             tmp_file = self.download(
-                download_url, file_out=file_out, digest=fs_item_info.digest, **kwargs
+                download_url,
+                file_out=file_out,
+                digest=fs_item_info.digest,
+                doc_pair=doc_pair,
+                **kwargs,
             )
         except Exception as e:
-            if os.path.exists(file_out):
+            # Keep the partial download when it can be resumed
+            if not self._dao and os.path.exists(file_out):
                 os.remove(file_out)
             raise e
         finally:
@@ -321,27 +721,52 @@ class Remote(Nuxeo):
             command="NuxeoDrive.FileSystemItemExists", id=fs_item_id
         )
 
-    def get_fs_children(self, fs_item_id: str) -> List[RemoteFileInfo]:
-        children = self.operations.execute(
-            command="NuxeoDrive.GetChildren", id=fs_item_id
+    def _stream(
+        self, command: str, key: Optional[str], **params: Any
+    ) -> JSONArrayStream:
+        """
+        Execute the *command* operation, its result being decoded while it is
+        received: see JSONArrayStream for *key*.
+        The operation is executed now, its result is read while iterating.
+        """
+        if nuxeo_constants.CHECK_PARAMS:
+            self.operations.check_params(command, params)
+        resp = self.client.request(
+            "POST",
+            "site/automation/" + command,
+            headers=dict(self.operations.headers),
+            data=json.dumps(self.operations.get_params(params)),
+            raw=True,
+            stream=True,
+        )
+        return JSONArrayStream(
+            resp.iter_content(chunk_size=CHUNK_SIZE), key=key, close=resp.close
         )
-        return [RemoteFileInfo.from_dict(fs_item) for fs_item in children]
+
+    def get_fs_children(self, fs_item_id: str) -> List[RemoteFileInfo]:
+        return list(self.iter_fs_children(fs_item_id))
+
+    def iter_fs_children(self, fs_item_id: str) -> Iterable[RemoteFileInfo]:
+        """
+        Children decoded while they are received, for large folders.
+        The remote scan still gets them all at once, from get_fs_children().
+        """
+        children = self._stream("NuxeoDrive.GetChildren", None, id=fs_item_id)
+        return map(RemoteFileInfo.from_dict, children)
 
     def scroll_descendants(
         self, fs_item_id: str, scroll_id: str, batch_size: int = 100
     ) -> Dict[str, Any]:
-        res = self.operations.execute(
-            command="NuxeoDrive.ScrollDescendants",
+        res = self._stream(
+            "NuxeoDrive.ScrollDescendants",
+            "fileSystemItems",
             id=fs_item_id,
             scrollId=scroll_id,
             batchSize=batch_size,
         )
-        return {
-            "scroll_id": res["scrollId"],
-            "descendants": [
-                RemoteFileInfo.from_dict(fs_item) for fs_item in res["fileSystemItems"]
-            ],
-        }
+        # The scroll ID may follow the descendants
+        descendants = RemoteFileInfo.from_dicts(res)
+        return {"scroll_id": res.fields["scrollId"], "descendants": descendants}
 
     def is_filtered(self, path: str) -> bool:
         return False
@@ -364,6 +789,7 @@ class Remote(Nuxeo):
         filename: str = None,
         mime_type: str = None,
         overwrite: bool = False,
+        doc_pair: DocPair = None,
     ) -> RemoteFileInfo:
         """Create a document by streaming the file with the given path
 
@@ -375,6 +801,7 @@ class Remote(Nuxeo):
             filename=filename,
             mime_type=mime_type,
             command="NuxeoDrive.CreateFile",
+            doc_pair=doc_pair,
             parentId=parent_id,
             overwrite=overwrite,
         )
@@ -389,33 +816,42 @@ class Remote(Nuxeo):
         mime_type: str = None,
         fs: bool = True,
         apply_versioning_policy: bool = False,
+        doc_pair: DocPair = None,
     ) -> RemoteFileInfo:
         """Update a document by streaming the file with the given path"""
-        if fs:
-            fs_item = self.upload(
+        self.forget_doc(fs_item_id)
+        try:
+            if fs:
+                fs_item = self.upload(
+                    file_path,
+                    filename=filename,
+                    command="NuxeoDrive.UpdateFile",
+                    doc_pair=doc_pair,
+                    id=fs_item_id,
+                    parentId=parent_fs_item_id,
+                )
+                return RemoteFileInfo.from_dict(fs_item)
+
+            self.upload(
                 file_path,
                 filename=filename,
-                command="NuxeoDrive.UpdateFile",
-                id=fs_item_id,
-                parentId=parent_fs_item_id,
+                mime_type=mime_type,
+                command="NuxeoDrive.AttachBlob",
+                document=self._check_ref(fs_item_id),
+                applyVersioningPolicy=apply_versioning_policy,
             )
-            return RemoteFileInfo.from_dict(fs_item)
-
-        self.upload(
-            file_path,
-            filename=filename,
-            mime_type=mime_type,
-            command="NuxeoDrive.AttachBlob",
-            document=self._check_ref(fs_item_id),
-            applyVersioningPolicy=apply_versioning_policy,
-        )
+        finally:
+            # Metadata may have been cached again while the content was sent
+            self.forget_doc(fs_item_id)
 
     def delete(self, fs_item_id: str, parent_fs_item_id: str = None) -> None:
+        self.forget_doc(fs_item_id)
         self.operations.execute(
             command="NuxeoDrive.Delete", id=fs_item_id, parentId=parent_fs_item_id
         )
 
     def undelete(self, uid: str) -> str:
+        self.forget_doc(uid)
         input_obj = "doc:" + uid
         if not self._has_new_trash_service:
             return self.operations.execute(
@@ -425,13 +861,35 @@ class Remote(Nuxeo):
             return self.documents.untrash(uid)
 
     def rename(self, fs_item_id: str, new_name: str) -> RemoteFileInfo:
+        self.forget_doc(fs_item_id)
         return RemoteFileInfo.from_dict(
             self.operations.execute(
                 command="NuxeoDrive.Rename", id=fs_item_id, name=new_name
             )
         )
 
+    def copy_file(self, fs_item_id: str, parent_id: str, name: str) -> RemoteFileInfo:
+        """
+        Create the file *name* in the *parent_id* folder by copying the
+        *fs_item_id* file on the server, its content is not sent again.
+        """
+        doc = self.operations.execute(
+            command="Document.Copy",
+            input_obj="doc:" + fs_item_id.split("#")[-1],
+            target=parent_id.split("#")[-1],
+            name=name,
+        )
+        # The copy is handled by the same file system item factory
+        copy_id = "{}#{}".format(fs_item_id.rsplit("#", 1)[0], doc["uid"])
+        try:
+            # Update the title and the blob name like any other renaming
+            return self.rename(copy_id, name)
+        except HTTPError:
+            self.delete(copy_id, parent_fs_item_id=parent_id)
+            raise
+
     def move(self, fs_item_id: str, new_parent_id: str) -> RemoteFileInfo:
+        self.forget_doc(fs_item_id)
         return RemoteFileInfo.from_dict(
             self.operations.execute(
                 command="NuxeoDrive.Move", srcId=fs_item_id, destId=new_parent_id
@@ -460,19 +918,24 @@ class Remote(Nuxeo):
             # If available, use last event log id as 'lowerBound' parameter
             # according to the new implementation of the audit change finder,
             # see https://jira.nuxeo.com/browse/NXP-14826.
-            return self.operations.execute(
-                command="NuxeoDrive.GetChangeSummary",
-                lowerBound=log_id,
-                lastSyncActiveRootDefinitions=last_root_definitions,
-            )
-
-        # Use last sync date as 'lastSyncDate' parameter according to the
-        # old implementation of the audit change finder.
-        return self.operations.execute(
-            command="NuxeoDrive.GetChangeSummary",
-            lastSyncDate=last_sync_date,
+            params = {"lowerBound": log_id}
+        else:
+            # Use last sync date as 'lastSyncDate' parameter according to the
+            # old implementation of the audit change finder.
+            params = {"lastSyncDate": last_sync_date}
+
+        # Changes are decoded while received, but all kept in memory: the
+        # other members of the summary (syncDate, hasTooManyChanges, ...)
+        # follow them, and the watcher sorts them before acting. Their number
+        # is bounded by the server, that sets hasTooManyChanges beyond it.
+        res = self._stream(
+            "NuxeoDrive.GetChangeSummary",
+            "fileSystemChanges",
             lastSyncActiveRootDefinitions=last_root_definitions,
+            **params,
         )
+        changes = list(res)
+        return {**res.fields, "fileSystemChanges": changes}
 
     # From DocumentClient
     def fetch(self, ref: str, **kwargs: Any) -> Dict[str, Any]:
@@ -506,10 +969,11 @@ class Remote(Nuxeo):
             entry.update(
                 {"root": self._base_folder_ref, "repository": self.client.repository}
             )
-            if parent_uid is None and fetch_parent_uid:
-                parent_uid = self.fetch(os.path.dirname(entry["path"]))["uid"]
+            entry_parent_uid = parent_uid
+            if entry_parent_uid is None and fetch_parent_uid:
+                entry_parent_uid = self._get_parent_uid(entry)
 
-            info = NuxeoDocumentInfo.from_dict(entry, parent_uid=parent_uid)
+            info = NuxeoDocumentInfo.from_dict(entry, parent_uid=entry_parent_uid)
             name = info.name.lower()
             if name.endswith(Options.ignored_suffixes) or name.startswith(
                 Options.ignored_prefixes
@@ -523,6 +987,86 @@ class Remote(Nuxeo):
     def query(self, query: str) -> Dict[str, Any]:  # TODO: use Nuxeo.client.query()
         return self.operations.execute(command="Document.Query", query=query)
 
+    def get_modified_documents(
+        self, roots: List[str], since: int, page_size: int = 1000
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Documents under the *roots* UIDs modified since the *since* timestamp,
+        trashed ones included.
+        """
+        date = datetime.utcfromtimestamp(since).strftime("%Y-%m-%dT%H:%M:%SZ")
+        condition = " AND dc:modified >= TIMESTAMP '{}'".format(date)
+        return self._query_descendants(roots, condition, page_size)
+
+    def get_audit_entries(
+        self, events: Iterable[str], lower: int, upper: int, page_size: int = 1000
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Audit entries of the *events* in the current repository, logged after
+        the *lower* log ID and up to the *upper* one.
+        Pages are delimited by log IDs, like the ones of _query_descendants().
+        """
+        query = (
+            "FROM LogEntry log"
+            " WHERE log.repositoryId = '{}'"
+            "   AND log.eventId IN ({})"
+            "   AND log.id <= {}".format(
+                self.client.repository,
+                ", ".join("'{}'".format(event) for event in events),
+                upper,
+            )
+        )
+        last_id = lower
+        while "Paging":
+            entries = self._stream(
+                "Audit.QueryWithPageProvider",
+                "entries",
+                query=query + " AND log.id > {} ORDER BY log.id".format(last_id),
+                pageSize=page_size,
+            )
+            count = 0
+            for entry in entries:
+                count += 1
+                last_id = entry["id"]
+                yield entry
+            if count < page_size:
+                break
+
+    def _query_descendants(
+        self, roots: List[str], condition: str, page_size: int
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Documents under the *roots* UIDs matching the NXQL *condition*.
+        Pages are delimited by document UIDs, so that documents modified
+        while paging do not shift them.
+        """
+        query = (
+            "SELECT * FROM Document"
+            " WHERE ecm:ancestorId IN ({})"
+            "   AND ecm:isVersion = 0"
+            "   AND ecm:isProxy = 0"
+            "   AND ecm:mixinType != 'HiddenInNavigation'".format(
+                ", ".join("'{}'".format(uid) for uid in roots)
+            )
+            + condition
+        )
+        last_uid = None
+        while "Paging":
+            paging = " AND ecm:uuid > '{}'".format(last_uid) if last_uid else ""
+            entries = self._stream(
+                "Document.Query",
+                "entries",
+                query=query + paging + " ORDER BY ecm:uuid",
+                pageSize=page_size,
+            )
+            count = 0
+            for entry in entries:
+                count += 1
+                last_uid = entry["uid"]
+                yield entry
+            if count < page_size:
+                break
+
     def get_info(
         self,
         ref: str,
@@ -531,23 +1075,56 @@ class Remote(Nuxeo):
         use_trash: bool = True,
         include_versions: bool = False,
     ) -> Optional[NuxeoDocumentInfo]:
-        if not self.exists(ref, use_trash=use_trash, include_versions=include_versions):
-            if raise_if_missing:
-                raise NotFound(
-                    "Could not find '%s' on '%s'"
-                    % (self._check_ref(ref), self.client.host)
-                )
-            return None
+        key = (self._check_ref(ref), use_trash, include_versions)
+        doc = self.docs_cache.get(key)
+        if doc is None:
+            doc = self._query_doc(ref, use_trash, include_versions)
+            if doc is None:
+                if raise_if_missing:
+                    raise NotFound(
+                        "Could not find '%s' on '%s'" % (key[0], self.client.host)
+                    )
+                return None
 
-        doc = self.fetch(self._check_ref(ref))
-        parent_uid = None
-        if fetch_parent_uid:
-            parent_uid = self.fetch(os.path.dirname(doc["path"]))["uid"]
-        doc.update(
-            {"root": self._base_folder_ref, "repository": self.client.repository}
-        )
+            doc.update(
+                {"root": self._base_folder_ref, "repository": self.client.repository}
+            )
+            self.docs_cache.set(key, doc)
+
+        parent_uid = self._get_parent_uid(doc) if fetch_parent_uid else None
         return NuxeoDocumentInfo.from_dict(doc, parent_uid=parent_uid)
 
+    def _get_parent_uid(self, doc: Dict[str, Any]) -> str:
+        """ Return the UID of the parent of *doc*. """
+        if doc.get("parentRef"):
+            return doc["parentRef"]
+
+        # Not given by the server, fetch the parent
+        path = os.path.dirname(doc["path"])
+        parent_uid = self.docs_cache.get(("parent", path))
+        if parent_uid is None:
+            parent_uid = self.fetch(path)["uid"]
+            self.docs_cache.set(("parent", path), parent_uid)
+        return parent_uid
+
+    def forget_doc(self, ref: str = None) -> None:
+        """
+        Drop cached metadata of the document *ref* (a UID, a path or a file
+        system item ID), or of all documents, after it changed on the server.
+        """
+        if ref is None:
+            self.docs_cache.clear()
+            return
+
+        uid = self._check_ref(ref.split("#")[-1])
+
+        def outdated(key: Tuple, value: Any) -> bool:
+            if key[0] == "parent":
+                return value == uid
+            return uid in (key[0], value.get("uid"))
+
+        self.docs_cache.discard(outdated)
+
     def get_blob(
         self, ref: Union[NuxeoDocumentInfo, str], file_out: str = None, **kwargs: Any
     ) -> bytes:
@@ -562,16 +1139,22 @@ class Remote(Nuxeo):
                         with open(file_out, "wb") as f:
                             f.write(content)
                 return content
+            digest = ref.digest if file_out else None
         else:
-            doc_id = ref
+            doc_id, digest = ref, None
 
-        return self.operations.execute(
+        if digest and self._get_cached_blob(file_out, digest):
+            return file_out
+
+        blob = self.operations.execute(
             command="Blob.Get",
             input_obj="doc:" + doc_id,
             json=False,
             file_out=file_out,
             **kwargs,
         )
+        self._cache_blob(file_out, digest)
+        return blob
 
     def lock(self, ref: str) -> Dict[str, Any]:
         return self.operations.execute(
@@ -603,6 +1186,21 @@ class Remote(Nuxeo):
         if proxy:
             settings = proxy.settings(url=self.client.host)
             self.client.client_kwargs["proxies"] = settings
+        self._mount_pool()
+
+    def set_pool_size(self, size: int) -> None:
+        """ Set the number of connections needed by the threads using the client. """
+        self.pool_size = size
+        self._mount_pool()
+
+    def _mount_pool(self) -> None:
+        """ Use the connection pool shared with the clients of the same server. """
+        shared_pools.mount(
+            self.client._session,
+            self.client.host,
+            proxies=self.client.client_kwargs.get("proxies"),
+            size=self.pool_size,
+        )
 
     def _get_trash_condition(self) -> str:
         if not self._has_new_trash_service:
@@ -614,13 +1212,12 @@ class FilteredRemote(Remote):
     def is_filtered(self, path: str) -> bool:
         return self._dao.is_filter(path)
 
-    def get_fs_children(self, fs_item_id: str) -> List[RemoteFileInfo]:
-        result = super().get_fs_children(fs_item_id)
-        # Need to filter the children result
-        filtered = []
-        for item in result:
-            if not self.is_filtered(item.path):
-                filtered.append(item)
-            else:
+    def iter_fs_children(self, fs_item_id: str) -> Iterable[RemoteFileInfo]:
+        def keep(item: RemoteFileInfo) -> bool:
+            if self.is_filtered(item.path):
                 log.debug("Filtering item %r", item)
-        return filtered
+                return False
+            return True
+
+        # Need to filter the children result
+        return filter(keep, super().iter_fs_children(fs_item_id))
@@ -0,0 +1,181 @@
+# coding: utf-8
+"""
+Upload batches shared by the uploads of small new files.
+
+Each upload used to create its own batch, send its blob, then execute the
+operation creating the document: three round trips for a few bytes.
+The new files of a folder are sent in a shared batch instead, several blobs
+under one batch ID, while each one still creates its own document.
+The blobs of the next new files of a folder are sent while the document of
+the current one is created, so that a file handled by a processor usually
+only waits for the creation of its document.
+"""
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging import getLogger
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+__all__ = ("SMALL_FILE_SIZE", "SentBlobs", "SharedBatch")
+
+log = getLogger(__name__)
+
+# Files up to this size are sent in a shared batch
+SMALL_FILE_SIZE = 1024 ** 2
+
+
+class SharedBatch:
+    """
+    Hand out indexes in batches created by *new_batch*, one batch per group
+    of files, e.g. the new files of a folder. A new batch is started after
+    *max_count* files or *max_size* bytes.
+    A batch is dropped on the server once none of its files need it anymore.
+    A discarded batch, that the server does not know anymore, is forgotten.
+    """
+
+    def __init__(
+        self,
+        new_batch: Callable[[], Any],
+        max_count: int = 100,
+        max_size: int = 16 * 1024 ** 2,
+    ) -> None:
+        self.max_count = max_count
+        self.max_size = max_size
+        self._new_batch = new_batch
+        self._lock = Lock()
+        # Batch used by each group, with its number of files and size
+        self._current: Dict[str, Tuple[Any, int, int]] = {}
+        # Files being uploaded or created, by batch ID
+        self._pending: Dict[str, int] = {}
+        self._discarded: Set[str] = set()
+
+    def acquire(self, size: int, group: str = "") -> Tuple[Any, int]:
+        """ Return the batch and the index to upload a file of *size* bytes. """
+        with self._lock:
+            batch, count, total = self._current.get(group, (None, 0, 0))
+            if batch is None or count >= self.max_count or total + size > self.max_size:
+                batch, count, total = self._new_batch(), 0, 0
+                self._pending[batch.uid] = 0
+
+            self._current[group] = (batch, count + 1, total + size)
+            self._pending[batch.uid] += 1
+            return batch, count
+
+    def release(self, batch: Any) -> None:
+        """ The file uploaded in *batch* does not need it anymore. """
+        with self._lock:
+            self._pending[batch.uid] -= 1
+            if self._pending[batch.uid]:
+                return
+
+            # The next files of the group will start a new batch
+            del self._pending[batch.uid]
+            self._forget(batch)
+            if batch.uid in self._discarded:
+                self._discarded.remove(batch.uid)
+                return
+
+        try:
+            batch.cancel()
+        except Exception:
+            # It will expire on the server
+            log.debug("Cannot drop upload batch %s", batch.uid, exc_info=True)
+
+    def discard(self, batch: Any) -> None:
+        """ Stop using *batch*, the server does not know it anymore. """
+        with self._lock:
+            if batch.uid in self._pending:
+                self._discarded.add(batch.uid)
+            self._forget(batch)
+
+    def _forget(self, batch: Any) -> None:
+        for group, (current, _, _) in list(self._current.items()):
+            if current is batch:
+                del self._current[group]
+
+
+class SentBlobs:
+    """
+    Blobs of small files sent ahead of the creation of their document, each
+    group of files in its batch from *batches*. *send* uploads a file at a
+    given index of a batch, it is called by *workers* threads.
+    Blobs are taken once, they are released after *ttl* seconds otherwise.
+    """
+
+    def __init__(
+        self,
+        batches: SharedBatch,
+        send: Callable[[Any, int, str, str], Any],
+        workers: int = 2,
+        ttl: int = 60,
+    ) -> None:
+        self.batches = batches
+        self.ttl = ttl
+        self._send = send
+        self._workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = Lock()
+        # path -> (expiration time, name, size and mtime, batch, upload)
+        self._blobs: Dict[str, Tuple[float, str, Any, Any, Future]] = {}
+
+    @staticmethod
+    def _stat(path: str) -> Optional[Tuple[int, float]]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def send(self, group: str, files: List[Tuple[str, str]]) -> None:
+        """ Start uploading the small *files*, given as paths and names. """
+        now = time.time()
+        with self._lock:
+            for path in [p for p, entry in self._blobs.items() if entry[0] <= now]:
+                self._release(self._blobs.pop(path))
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._workers, thread_name_prefix="SentBlobs"
+                )
+
+            for path, name in files:
+                stat = self._stat(path)
+                if path in self._blobs or not stat or stat[0] > SMALL_FILE_SIZE:
+                    continue
+                batch, index = self.batches.acquire(stat[0], group=group)
+                upload = self._executor.submit(self._send, batch, index, path, name)
+                self._blobs[path] = (now + self.ttl, name, stat, batch, upload)
+
+    def take(self, path: str, name: str) -> Optional[Tuple[Any, Future]]:
+        """
+        Return the batch and the upload of the blob of *path*, if it was sent
+        with that *name* and the file did not change since.
+        The caller has to release the batch.
+        """
+        with self._lock:
+            entry = self._blobs.pop(path, None)
+        if entry is None:
+            return None
+
+        expiration, sent_name, stat, batch, upload = entry
+        if expiration <= time.time() or sent_name != name or stat != self._stat(path):
+            log.trace("Not using the blob sent ahead for %r", path)
+            self._release(entry)
+            return None
+        return batch, upload
+
+    def _release(self, entry: Tuple[float, str, Any, Any, Future]) -> None:
+        batch, upload = entry[3:]
+        upload.add_done_callback(lambda _: self.batches.release(batch))
+
+    def shutdown(self) -> None:
+        """ Stop sending blobs, the ones already sent are released. """
+        with self._lock:
+            executor, self._executor = self._executor, None
+            blobs, self._blobs = self._blobs, {}
+        if executor:
+            executor.shutdown(wait=False)
+        for entry in blobs.values():
+            entry[4].cancel()
+            self._release(entry)
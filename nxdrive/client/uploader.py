@@ -0,0 +1,126 @@
+# coding: utf-8
+"""
+Upload of blobs into batches.
+
+The uploads endpoint of the Nuxeo client keeps the headers of the blob being
+sent as an attribute, so that uploads sharing it would send each other's file
+name and size. Each upload here has its own endpoint.
+
+The headers describing a blob and the ones of the operation using it are
+shared with the asynchronous transfers, that do not use the Nuxeo client.
+"""
+import time
+from logging import getLogger
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, Union
+from urllib.parse import quote
+
+from nuxeo.models import Batch, Blob
+from nuxeo.uploads import API
+
+from ..constants import TX_TIMEOUT
+
+__all__ = (
+    "ChunkedUploadsAPI",
+    "UploadsAPI",
+    "blob_headers",
+    "execution_headers",
+    "upload_blob",
+)
+
+log = getLogger(__name__)
+
+
+class UploadsAPI(API):
+    """ Uploads endpoint used for a single upload. """
+
+    def __init__(self, client: Any) -> None:
+        super().__init__(client, headers={})
+
+
+class ChunkedUploadsAPI(UploadsAPI):
+    """
+    Uploads endpoint used for a single upload by chunks of *chunk_size* bytes,
+    resumed after the chunks already *uploaded*.
+    *callback* is called with the index and the size of each chunk sent.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        chunk_size: int,
+        uploaded: Iterable[int] = (),
+        callback: Callable[[int, int], None] = None,
+    ) -> None:
+        super().__init__(client)
+        self.chunk_size = chunk_size
+        self.uploaded = set(uploaded)
+        self.callback = callback
+
+    def state(self, path: str, blob: Blob) -> Tuple[int, int, int, Optional[Blob]]:
+        # The chunks received by the server are known by the caller, the
+        # upload goes on from the first missing one, the last one is always
+        # sent to get the details of the blob
+        count = -(-blob.size // self.chunk_size)
+        index = 0
+        while index in self.uploaded and index < count - 1:
+            index += 1
+        return self.chunk_size, count, index, None
+
+    def send_data(
+        self,
+        name: str,
+        data: Union[str, bytes],
+        path: str,
+        chunked: bool,
+        index: int,
+        headers: Dict[str, str],
+    ) -> Blob:
+        response = super().send_data(name, data, path, chunked, index, headers)
+        if self.callback:
+            self.callback(index, len(data))
+        return response
+
+
+def upload_blob(client: Any, blob: Blob, batch_id: str = None, index: int = 0) -> Blob:
+    """ Upload *blob* at *index* in the batch *batch_id*, or in a new batch. """
+    service = UploadsAPI(client)
+    if batch_id:
+        batch = Batch(service=service, batchId=batch_id)
+    else:
+        batch = service.batch()
+    # Batch.upload() sends a blob after the ones it sent, this one may
+    # follow blobs sent by other uploads
+    batch._upload_idx = index
+    return batch.upload(blob)
+
+
+def blob_headers(name: str, size: int, mime_type: str = None) -> Dict[str, str]:
+    """ Headers of a blob sent in one request, as Batch.upload() sends them. """
+    return {
+        "Cache-Control": "no-cache",
+        "Content-Type": "application/octet-stream",
+        "Content-Length": str(size),
+        "X-File-Name": quote(name),
+        "X-File-Size": str(size),
+        "X-File-Type": mime_type or "application/octet-stream",
+    }
+
+
+def execution_headers(tick: float, action: Any = None) -> Dict[str, str]:
+    """
+    Headers of the operation taking as input a blob uploaded since *tick*.
+    The duration of the upload is saved in its *action*.
+    """
+    upload_duration = int(time.time() - tick)
+    if action:
+        action.transfer_duration = upload_duration
+    # Use upload duration * 2 as Nuxeo transaction timeout
+    tx_timeout = max(TX_TIMEOUT, upload_duration * 2)
+    log.trace(
+        "Using %d seconds [max(%d, 2 * upload time=%d)] as "
+        "Nuxeo transaction timeout",
+        tx_timeout,
+        TX_TIMEOUT,
+        upload_duration,
+    )
+    return {"Nuxeo-Transaction-Timeout": str(tx_timeout)}
@@ -121,6 +121,11 @@ class CliHandler:
 
         common_parser.add_argument("--proxy-server", help="Define proxy server")
 
+        common_parser.add_argument(
+            "--ca-bundle",
+            help="Define the file of the certificates used to verify the server",
+        )
+
         common_parser.add_argument(
             "--consider-ssl-errors",
             default=Options.consider_ssl_errors,
@@ -11,11 +11,14 @@ APP_NAME = "Nuxeo Drive"
 TIMEOUT = 20
 STARTUP_PAGE_CONNECTION_TIMEOUT = 30
 TX_TIMEOUT = 300
+DOCS_CACHE_TTL = 10
 FILE_BUFFER_SIZE = 1024 ** 2
 MAX_LOG_DISPLAYED = 50000
 
 DOWNLOAD_TMP_FILE_PREFIX = "."
 DOWNLOAD_TMP_FILE_SUFFIX = ".nxpart"
+# Seconds after which a partial download is not resumed but removed
+DOWNLOAD_RESUME_TTL = 7 * 24 * 3600
 
 UNACCESSIBLE_HASH = "TO_COMPUTE"
 
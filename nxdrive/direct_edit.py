@@ -239,7 +239,7 @@ class DirectEdit(Worker):
                 info.digest,
                 existing_file_path,
             )
-            shutil.copy(existing_file_path, file_out)
+            engine.local.copy_file(pair.local_path, file_out)
             if pair.is_readonly():
                 log.debug("Unsetting readonly flag on copied file %r", file_out)
                 unset_path_readonly(file_out)
@@ -4,11 +4,12 @@ Query formatting in this file is based on http://www.sqlstyle.guide/
 """
 import os
 import sqlite3
-from contextlib import suppress
+from contextlib import contextmanager, suppress
 from datetime import datetime
 from logging import getLogger
 from threading import RLock, current_thread, local
-from typing import Any, List, Optional, Tuple
+from time import time
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
 
 from PyQt5.QtCore import QObject, pyqtSignal
 
@@ -270,6 +271,32 @@ class ConfigurationDAO(QObject):
 
         return self._conns._conn
 
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Group the writes of the calling thread in a single transaction.
+        Other threads wait for its end before reading or writing.
+        Writes are committed when leaving the block, even on error, as they
+        would have been without the transaction.
+        """
+        with self._tx_lock, self._lock:
+            if self.in_tx is not None:
+                # Nested transaction
+                yield
+                return
+
+            self.in_tx = current_thread().ident
+            con = self._get_write_connection()
+            con.cursor().execute("BEGIN")
+            try:
+                yield
+            finally:
+                try:
+                    if con.in_transaction:
+                        con.cursor().execute("COMMIT")
+                finally:
+                    self.in_tx = None
+
     def _delete_config(self, cursor: sqlite3.Cursor, name: str) -> None:
         cursor.execute("DELETE FROM Configuration WHERE name = ?", (name,))
 
@@ -517,9 +544,18 @@ class EngineDAO(ConfigurationDAO):
         self._items_count = self.get_syncing_count()
         self._filters = self.get_filters()
         self.reinit_processors()
+        self._create_state_indexes(self._conn.cursor())
 
     def get_schema_version(self) -> int:
-        return 4
+        return 7
+
+    @staticmethod
+    def _ref_suffix(ref: Optional[str]) -> Optional[str]:
+        """
+        The document ID ending a remote reference.
+        Some events come with partial references sharing only this suffix.
+        """
+        return ref.rsplit("#", 1)[-1] if ref is not None else None
 
     def _migrate_state(self, cursor: sqlite3.Cursor) -> None:
         try:
@@ -560,12 +596,30 @@ class EngineDAO(ConfigurationDAO):
             self._migrate_state(cursor)
             cursor.execute("UPDATE States SET creation_date = last_remote_updated")
             self.update_config(SCHEMA_VERSION, 4)
+        if version < 5:
+            self._migrate_state(cursor)
+            rows = cursor.execute(
+                "SELECT id, remote_ref FROM States WHERE remote_ref IS NOT NULL"
+            ).fetchall()
+            cursor.executemany(
+                "UPDATE States SET remote_ref_suffix = ? WHERE id = ?",
+                [(self._ref_suffix(row.remote_ref), row.id) for row in rows],
+            )
+            self.update_config(SCHEMA_VERSION, 5)
+        if version < 6:
+            self._migrate_table(cursor, "Downloads")
+            self.update_config(SCHEMA_VERSION, 6)
+        if version < 7:
+            self._migrate_table(cursor, "Downloads")
+            self.update_config(SCHEMA_VERSION, 7)
 
     def _create_table(
         self, cursor: sqlite3.Cursor, name: str, force: bool = False
     ) -> None:
         if name == "States":
             self._create_state_table(cursor, force)
+        elif name == "Downloads":
+            self._create_downloads_table(cursor, force)
         else:
             super()._create_table(cursor, name, force)
 
@@ -608,11 +662,37 @@ class EngineDAO(ConfigurationDAO):
             "    processor               INTEGER    DEFAULT (0),"
             "    last_transfer           VARCHAR,"
             "    creation_date           TIMESTAMP,"
+            "    remote_ref_suffix       VARCHAR,"
             "    PRIMARY KEY (id),"
             "    UNIQUE(remote_ref, remote_parent_ref),"
             "    UNIQUE(remote_ref, local_path))".format(statement)
         )
 
+    @staticmethod
+    def _create_downloads_table(cursor: sqlite3.Cursor, force: bool = False) -> None:
+        statement = "" if force else "if not exists"
+        # A partial download is linked to its pair, if any, and dated by
+        # its last try, so that it can be purged.
+        # Ranges written by a download in parallel ranges: "start-end,..."
+        cursor.execute(
+            "CREATE TABLE {} Downloads ("
+            "    path        VARCHAR    NOT NULL,"
+            "    digest      VARCHAR    NOT NULL,"
+            "    etag        VARCHAR,"
+            "    doc_pair    INTEGER,"
+            "    started     INTEGER    DEFAULT (0),"
+            "    ranges      VARCHAR    DEFAULT(''),"
+            "    PRIMARY KEY (path))".format(statement)
+        )
+
+    @staticmethod
+    def _create_state_indexes(cursor: sqlite3.Cursor) -> None:
+        # Created once migrations are done, as they recreate the States table
+        cursor.execute(
+            "CREATE INDEX if not exists StatesRemoteRefSuffix"
+            "    ON States (remote_ref_suffix)"
+        )
+
     def _init_db(self, cursor: sqlite3.Cursor) -> None:
         super()._init_db(cursor)
         for table in {"Filters", "RemoteScan", "ToRemoteScan"}:
@@ -623,6 +703,30 @@ class EngineDAO(ConfigurationDAO):
                 ")".format(table)
             )
         self._create_state_table(cursor)
+        cursor.execute(
+            "CREATE TABLE if not exists Scrolled ("
+            "    remote_ref  VARCHAR    NOT NULL,"
+            "    PRIMARY KEY (remote_ref)"
+            ")"
+        )
+        cursor.execute(
+            "CREATE TABLE if not exists LocalScan ("
+            "    path        VARCHAR    NOT NULL,"
+            "    mtime       REAL,"
+            "    PRIMARY KEY (path)"
+            ")"
+        )
+        self._create_downloads_table(cursor)
+        cursor.execute(
+            "CREATE TABLE if not exists Uploads ("
+            "    doc_pair    INTEGER    NOT NULL,"
+            "    digest      VARCHAR    NOT NULL,"
+            "    batch_id    VARCHAR    NOT NULL,"
+            "    chunk_size  INTEGER    NOT NULL,"
+            "    chunks      VARCHAR    DEFAULT(''),"
+            "    PRIMARY KEY (doc_pair)"
+            ")"
+        )
 
     def acquire_state(self, thread_id: int, row_id: int) -> Optional[DocPair]:
         if self.acquire_processor(thread_id, row_id):
@@ -677,6 +781,7 @@ class EngineDAO(ConfigurationDAO):
             con = self._get_write_connection()
             c = con.cursor()
             self._reinit_states(c)
+            self._create_state_indexes(c)
             con.execute("VACUUM")
 
     def reinit_processors(self) -> None:
@@ -711,7 +816,7 @@ class EngineDAO(ConfigurationDAO):
                     ("parent_remotely_deleted",),
                 )
             # Only queue parent
-            self._queue_pair_state(doc_pair.id, doc_pair.folderish, "remotely_deleted")
+            self._queue_subtree(doc_pair, "remotely_deleted")
 
     def delete_local_state(self, doc_pair: RemoteFileInfo) -> None:
         try:
@@ -737,7 +842,7 @@ class EngineDAO(ConfigurationDAO):
             )
 
             # Only queue parent
-            self._queue_pair_state(doc_pair.id, doc_pair.folderish, "locally_deleted")
+            self._queue_subtree(doc_pair, "locally_deleted")
 
     def insert_local_state(self, info: NuxeoDocumentInfo, parent_path: str) -> int:
         pair_state = PAIR_STATES.get(("created", "unknown"))
@@ -851,7 +956,16 @@ class EngineDAO(ConfigurationDAO):
                 # Add all the folders
                 if pair.folderish:
                     folders[pair.local_path] = True
-                if pair.local_parent_path not in folders:
+                if pair.local_parent_path in folders:
+                    continue
+                if (
+                    pair.folderish
+                    and pair.pair_state in self._queue_manager.SUBTREE_STATES
+                ):
+                    self._queue_manager.push_subtree(
+                        pair.id, pair.local_path, pair.pair_state
+                    )
+                else:
                     self._queue_manager.push_ref(
                         pair.id, pair.folderish, pair.pair_state
                     )
@@ -875,6 +989,26 @@ class EngineDAO(ConfigurationDAO):
         else:
             log.trace("Will not push pair: %s, pair=%r", pair_state, pair)
 
+    def _queue_subtree(self, doc_pair: RemoteFileInfo, pair_state: str) -> None:
+        """
+        Queue a deletion as a single operation on the whole subtree.
+        Nothing is queued when an ancestor deletion already covers the pair.
+        """
+        if not self._queue_manager:
+            return
+        if doc_pair.pair_state == "parent_remotely_deleted" or (
+            self._queue_manager.in_subtree(doc_pair.local_path)
+        ):
+            log.trace("Deletion covered by an ancestor: %r", doc_pair)
+            return
+        if doc_pair.folderish:
+            log.trace("Push subtree to queue: %s, pair=%r", pair_state, doc_pair)
+            self._queue_manager.push_subtree(
+                doc_pair.id, doc_pair.local_path, pair_state
+            )
+        else:
+            self._queue_pair_state(doc_pair.id, False, pair_state)
+
     def _get_pair_state(self, row):
         return PAIR_STATES.get((row.local_state, row.remote_state))
 
@@ -980,20 +1114,31 @@ class EngineDAO(ConfigurationDAO):
             (digest,),
         ).fetchone()
 
-    def get_remote_descendants(self, path: str) -> DocPairs:
+    def get_remote_descendants(self, path: str, not_scrolled: bool = False) -> DocPairs:
+        """ If *not_scrolled*, only descendants not handled by the scroll. """
         c = self._get_read_connection().cursor()
         return c.execute(
-            "SELECT * FROM States WHERE remote_parent_path LIKE ?",
+            "SELECT * FROM States WHERE remote_parent_path LIKE ?"
+            + self._not_scrolled(not_scrolled),
             ("{}%".format(path),),
         ).fetchall()
 
-    def get_remote_descendants_from_ref(self, ref: str) -> DocPairs:
+    def get_remote_descendants_from_ref(
+        self, ref: str, not_scrolled: bool = False
+    ) -> DocPairs:
         c = self._get_read_connection().cursor()
         return c.execute(
-            "SELECT * FROM States WHERE remote_parent_path LIKE ?",
+            "SELECT * FROM States WHERE remote_parent_path LIKE ?"
+            + self._not_scrolled(not_scrolled),
             ("%{}%".format(ref),),
         ).fetchall()
 
+    @staticmethod
+    def _not_scrolled(not_scrolled: bool) -> str:
+        if not not_scrolled:
+            return ""
+        return " AND remote_ref NOT IN (SELECT remote_ref FROM Scrolled)"
+
     def get_remote_children(self, ref: str) -> DocPairs:
         c = self._get_read_connection().cursor()
         return c.execute(
@@ -1099,10 +1244,11 @@ class EngineDAO(ConfigurationDAO):
         return c.execute(
             "SELECT *"
             "  FROM States"
-            " WHERE remote_ref LIKE ? "
+            " WHERE remote_ref_suffix = ?"
+            "   AND remote_ref LIKE ?"
             " ORDER BY last_remote_updated ASC"
             " LIMIT 1",
-            ("%{}".format(ref),),
+            (self._ref_suffix(ref), "%{}".format(ref)),
         ).fetchone()
 
     def get_normal_state_from_remote(self, ref: str) -> Optional[RemoteFileInfo]:
@@ -1126,6 +1272,70 @@ class EngineDAO(ConfigurationDAO):
         c = self._get_read_connection().cursor()
         return c.execute("SELECT * FROM States WHERE remote_ref = ?", (ref,)).fetchall()
 
+    def get_states_from_remotes(
+        self, refs: List[str], partial: bool = True
+    ) -> Dict[str, DocPairs]:
+        """
+        Pairs of several remote references at once.
+        As get_first_state_from_partial_remote(), a reference matching no pair
+        is matched against the end of references, giving at most one pair,
+        unless *partial* is False.
+        """
+        states: Dict[str, DocPairs] = {}
+        c = self._get_read_connection().cursor()
+        refs = list(set(refs))
+        # Stay below the maximum number of SQLite query parameters
+        for idx in range(0, len(refs), 500):
+            chunk = refs[idx : idx + 500]
+            marks = ",".join("?" * len(chunk))
+            for row in c.execute(
+                f"SELECT * FROM States WHERE remote_ref IN ({marks})", chunk
+            ).fetchall():
+                states.setdefault(row.remote_ref, []).append(row)
+
+        partials: Dict[str, List[str]] = {}
+        for ref in refs:
+            if partial and ref not in states:
+                partials.setdefault(self._ref_suffix(ref), []).append(ref)
+        suffixes = list(partials)
+        for idx in range(0, len(suffixes), 500):
+            chunk = suffixes[idx : idx + 500]
+            marks = ",".join("?" * len(chunk))
+            for row in c.execute(
+                "SELECT *"
+                "  FROM States"
+                f" WHERE remote_ref_suffix IN ({marks})"
+                " ORDER BY last_remote_updated ASC",
+                chunk,
+            ).fetchall():
+                for ref in partials[row.remote_ref_suffix]:
+                    if ref not in states and row.remote_ref.endswith(ref):
+                        states[ref] = [row]
+        return states
+
+    def get_remote_refs(self, row_ids: List[int]) -> List[str]:
+        """ Remote references of the given pairs, in no particular order. """
+        if not row_ids:
+            return []
+        c = self._get_read_connection().cursor()
+        marks = ",".join("?" * len(row_ids))
+        rows = c.execute(
+            "SELECT remote_ref FROM States"
+            f" WHERE id IN ({marks}) AND remote_ref IS NOT NULL",
+            row_ids,
+        ).fetchall()
+        return [row.remote_ref for row in rows]
+
+    def get_states_from_ids(self, row_ids: List[int]) -> DocPairs:
+        """ Pairs of the given IDs, in no particular order. """
+        if not row_ids:
+            return []
+        c = self._get_read_connection().cursor()
+        marks = ",".join("?" * len(row_ids))
+        return c.execute(
+            f"SELECT * FROM States WHERE id IN ({marks})", row_ids
+        ).fetchall()
+
     def get_state_from_id(
         self, row_id: int, from_write: bool = False
     ) -> Optional[RemoteFileInfo]:
@@ -1242,11 +1452,16 @@ class EngineDAO(ConfigurationDAO):
             con = self._get_write_connection()
             c = con.cursor()
             c.execute("DELETE FROM States WHERE id = ?", (doc_pair.id,))
+            c.execute("DELETE FROM Uploads WHERE doc_pair = ?", (doc_pair.id,))
+            self._purge_downloads(c, "WHERE doc_pair = ?", (doc_pair.id,))
             if doc_pair.folderish:
                 if remote_recursion:
                     condition = self._get_recursive_remote_condition(doc_pair)
                 else:
                     condition = self._get_recursive_condition(doc_pair)
+                self._purge_downloads(
+                    c, "WHERE doc_pair IN (SELECT id FROM States " + condition + ")", ()
+                )
                 c.execute("DELETE FROM States " + condition)
 
     def get_state_from_local(self, path: str) -> Optional[DocPair]:
@@ -1274,9 +1489,10 @@ class EngineDAO(ConfigurationDAO):
                 "remote_can_create_child, last_remote_modifier, "
                 "remote_digest, folderish, last_remote_modifier, "
                 "local_path, local_parent_path, remote_state, "
-                "local_state, pair_state, local_name, creation_date) "
+                "local_state, pair_state, local_name, creation_date, "
+                "remote_ref_suffix) "
                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, "
-                "'created', 'unknown', ?, ?, ?)",
+                "'created', 'unknown', ?, ?, ?, ?)",
                 (
                     info.uid,
                     info.parent_uid,
@@ -1296,6 +1512,7 @@ class EngineDAO(ConfigurationDAO):
                     pair_state,
                     info.name,
                     info.creation_time,
+                    self._ref_suffix(info.uid),
                 ),
             )
             row_id = c.lastrowid
@@ -1619,6 +1836,7 @@ class EngineDAO(ConfigurationDAO):
             query = (
                 "UPDATE States"
                 "   SET remote_ref = ?,"
+                "       remote_ref_suffix = ?,"
                 "       remote_parent_ref = ?,"
                 "       remote_parent_path = ?,"
                 "       remote_name = ?,"
@@ -1645,6 +1863,7 @@ class EngineDAO(ConfigurationDAO):
                 query,
                 (
                     info.uid,
+                    self._ref_suffix(info.uid),
                     info.parent_uid,
                     remote_parent_path,
                     info.name,
@@ -1708,6 +1927,7 @@ class EngineDAO(ConfigurationDAO):
             con = self._get_write_connection()
             c = con.cursor()
             c.execute("DELETE FROM RemoteScan")
+            c.execute("DELETE FROM Scrolled")
 
     def is_path_scanned(self, path: str) -> bool:
         path = self._clean_filter_path(path)
@@ -1717,6 +1937,148 @@ class EngineDAO(ConfigurationDAO):
         ).fetchone()
         return row[0] > 0
 
+    def add_scrolled(self, refs: List[str]) -> None:
+        """ Record remote references handled by the current scroll. """
+        with self._lock:
+            con = self._get_write_connection()
+            c = con.cursor()
+            c.executemany(
+                "INSERT OR IGNORE INTO Scrolled (remote_ref) VALUES (?)",
+                [(ref,) for ref in refs],
+            )
+
+    def get_scrolled(self, refs: List[str]) -> Set[str]:
+        """ Those of *refs* already handled by the current scroll. """
+        scrolled: Set[str] = set()
+        c = self._get_read_connection().cursor()
+        for idx in range(0, len(refs), 500):
+            chunk = refs[idx : idx + 500]
+            marks = ",".join("?" * len(chunk))
+            rows = c.execute(
+                f"SELECT remote_ref FROM Scrolled WHERE remote_ref IN ({marks})", chunk
+            ).fetchall()
+            scrolled.update(row.remote_ref for row in rows)
+        return scrolled
+
+    def clean_scrolled(self) -> None:
+        with self._lock:
+            con = self._get_write_connection()
+            c = con.cursor()
+            c.execute("DELETE FROM Scrolled")
+
+    def add_local_scanned(self, path: str, mtime: float) -> None:
+        """ Record a local folder whose subtree was fully scanned. """
+        with self._lock:
+            con = self._get_write_connection()
+            c = con.cursor()
+            c.execute(
+                "INSERT OR REPLACE INTO LocalScan (path, mtime) VALUES (?, ?)",
+                (path, mtime),
+            )
+
+    def get_local_scanned(self) -> Dict[str, float]:
+        c = self._get_read_connection().cursor()
+        rows = c.execute("SELECT path, mtime FROM LocalScan").fetchall()
+        return {row.path: row.mtime for row in rows}
+
+    def clean_local_scanned(self) -> None:
+        with self._lock:
+            con = self._get_write_connection()
+            c = con.cursor()
+            c.execute("DELETE FROM LocalScan")
+
+    def get_download(self, path: str) -> Optional[Any]:
+        """ Return the partial download saved into *path*, if any. """
+        c = self._get_read_connection().cursor()
+        return c.execute("SELECT * FROM Downloads WHERE path = ?", (path,)).fetchone()
+
+    def save_download(
+        self, path: str, digest: str, etag: Optional[str], doc_pair: int = None
+    ) -> None:
+        with self._lock:
+            con = self._get_write_connection()
+            c = con.cursor()
+            c.execute(
+                "INSERT OR REPLACE INTO Downloads "
+                "(path, digest, etag, doc_pair, started) VALUES (?, ?, ?, ?, ?)",
+                (path, digest, etag, doc_pair, int(time())),
+            )
+
+    def add_download_range(self, path: str, start: int, end: int) -> None:
+        with self._lock:
+            con = self._get_write_connection()
+            c = con.cursor()
+            c.execute(
+                "UPDATE Downloads SET ranges = ranges || ? || ',' WHERE path = ?",
+                ("{}-{}".format(start, end), path),
+            )
+
+    def remove_download(self, path: str) -> None:
+        with self._lock:
+            con = self._get_write_connection()
+            c = con.cursor()
+            c.execute("DELETE FROM Downloads WHERE path = ?", (path,))
+
+    def purge_downloads(self, ttl: int) -> None:
+        """ Remove the partial downloads not tried for *ttl* seconds. """
+        with self._lock:
+            con = self._get_write_connection()
+            c = con.cursor()
+            self._purge_downloads(c, "WHERE started < ?", (int(time()) - ttl,))
+
+    @staticmethod
+    def _purge_downloads(
+        cursor: sqlite3.Cursor, condition: str, params: Tuple[Any, ...]
+    ) -> None:
+        """ Remove the partial downloads matching *condition*, and their file. """
+        rows = cursor.execute("SELECT path FROM Downloads " + condition, params)
+        paths = [row.path for row in rows.fetchall()]
+        if not paths:
+            return
+
+        cursor.execute("DELETE FROM Downloads " + condition, params)
+        for path in paths:
+            log.debug("Removing the partial download %r", path)
+            with suppress(OSError):
+                os.remove(path)
+
+    def get_upload(self, doc_pair: int, digest: str) -> Optional[Any]:
+        """ Return the chunked upload of a given content, if any. """
+        c = self._get_read_connection().cursor()
+        return c.execute(
+            "SELECT * FROM Uploads WHERE doc_pair = ? AND digest = ?",
+            (doc_pair, digest),
+        ).fetchone()
+
+    def save_upload(
+        self, doc_pair: int, digest: str, batch_id: str, chunk_size: int
+    ) -> None:
+        """ Start a chunked upload, replacing any previous one of the pair. """
+        with self._lock:
+            con = self._get_write_connection()
+            c = con.cursor()
+            c.execute(
+                "INSERT OR REPLACE INTO Uploads"
+                " (doc_pair, digest, batch_id, chunk_size, chunks)"
+                " VALUES (?, ?, ?, ?, '')",
+                (doc_pair, digest, batch_id, chunk_size),
+            )
+
+    def add_upload_chunk(self, doc_pair: int, index: int) -> None:
+        with self._lock:
+            con = self._get_write_connection()
+            c = con.cursor()
+            c.execute(
+                "UPDATE Uploads SET chunks = chunks || ? || ',' WHERE doc_pair = ?",
+                (str(index), doc_pair),
+            )
+
+    def remove_upload(self, doc_pair: int) -> None:
+        with self._lock:
+            con = self._get_write_connection()
+            c = con.cursor()
+            c.execute("DELETE FROM Uploads WHERE doc_pair = ?", (doc_pair,))
+
     @staticmethod
     def get_batch_sync_ignore() -> str:
         return (
@@ -1,9 +1,9 @@
 # coding: utf-8
 import datetime
 import os
+from functools import partial
 from logging import getLogger
 from threading import Thread, current_thread
-from time import sleep
 from typing import Any, Callable, List, Optional, Type
 from urllib.parse import urlsplit
 
@@ -12,14 +12,16 @@ from nuxeo.exceptions import HTTPError
 
 from .activity import Action, FileAction
 from .dao.sqlite import EngineDAO
+from .prefetch import Prefetcher
 from .processor import Processor
 from .queue_manager import QueueManager
+from .subtree_lock import SubtreeLockManager
 from .watcher.local_watcher import LocalWatcher
 from .watcher.remote_watcher import RemoteWatcher
 from .workers import Worker
 from ..client.local_client import LocalClient
 from ..client.remote_client import FilteredRemote, Remote
-from ..constants import MAC, WINDOWS
+from ..constants import DOCS_CACHE_TTL, DOWNLOAD_RESUME_TTL, MAC, WINDOWS
 from ..exceptions import (
     InvalidDriveException,
     PairInterrupt,
@@ -97,15 +99,19 @@ class Engine(QObject):
 
         # Stop if invalid credentials
         self.invalidAuthentication.connect(self.stop)
-        # Folder locker - LocalFolder processor can prevent
+        # Subtree locks - a processor or a watcher can prevent
         # others processors to operate on a folder
-        self._folder_lock = None
+        self.subtree_locks = SubtreeLockManager()
+        self.prefetcher = Prefetcher(self)
         self.timeout = 30
         self._handshake_timeout = 60
         self.manager = manager
 
         self.local_folder = definition.local_folder
-        self.local = self.local_cls(self.local_folder)
+        self.local = self.local_cls(
+            self.local_folder,
+            digest_slot=partial(manager.scheduler.hashing, definition.uid),
+        )
         # Keep folder path with backslash to find the right engine when
         # FinderSync is asking for the status of a file
         self.local_folder_bs = self._normalize_url(self.local_folder)
@@ -123,6 +129,7 @@ class Engine(QObject):
         if binder:
             self.bind(binder)
         self._load_configuration()
+        self.manager.scheduler.register(self.uid, weight=self.get_scheduler_weight())
 
         if not self.remote:
             self.init_remote()
@@ -137,6 +144,10 @@ class Engine(QObject):
         self._local_watcher.rootMoved.connect(self.rootMoved)
         self._local_watcher.localScanFinished.connect(self._remote_watcher.run)
         self._queue_manager = self._create_queue_manager(processors)
+        # Connections for the processors, the remote scans and Direct Edit
+        self.remote.set_pool_size(
+            self._queue_manager.get_max_processors() + Options.max_remote_scans + 1
+        )
 
         # Launch queue processors after first remote_watcher pass
         self._remote_watcher.initiate.connect(self._queue_manager.init_processors)
@@ -207,14 +218,15 @@ class Engine(QObject):
         self._create_local_watcher()
         self.manager.update_engine_path(self.uid, path)
 
-    def set_local_folder_lock(self, path: str) -> None:
-        self._folder_lock = path
-        # Check for each processor
+    def local_folder_lock(self, path: str, interact: Callable = None) -> Any:
+        """
+        Context manager to lock the local folder *path* and its subtree.
+        Processors working inside the folder are interrupted by
+        suspend_client(), others are not impacted.
+        *interact* is called while waiting, it may raise to give up.
+        """
         log.debug("Local Folder locking on %r", path)
-        while self.get_queue_manager().has_file_processors_on(path):
-            log.trace("Local folder locking wait for file processor to finish")
-            sleep(1)
-        log.debug("Local Folder lock setup completed on %r", path)
+        return self.subtree_locks.lock(path, exclusive=True, interact=interact)
 
     def set_ui(self, value: str, overwrite: bool = True) -> None:
         name = ("wui", "force_ui")[overwrite]
@@ -225,10 +237,6 @@ class Engine(QObject):
         setattr(self, name, value)
         log.debug("{} preferences set to {}".format(name, value))
 
-    def release_folder_lock(self) -> None:
-        log.debug("Local Folder unlocking")
-        self._folder_lock = None
-
     def get_last_files(
         self, number: int, direction: str = "", duration: int = None
     ) -> DocPairs:
@@ -428,6 +436,18 @@ class Engine(QObject):
                 reason="found no password nor token in engine configuration"
             )
 
+    def get_scheduler_weight(self) -> int:
+        """ Share of the global transfers and hashing slots given to the engine. """
+        return int(self._dao.get_config("scheduler_weight", "1"))
+
+    def set_scheduler_weight(self, weight: int) -> None:
+        self._dao.update_config("scheduler_weight", weight)
+        self.manager.scheduler.register(self.uid, weight=weight)
+
+    def transfer_slot(self, interact: Callable = None) -> Any:
+        """ Context manager to wait for a global network transfer slot. """
+        return self.manager.scheduler.transfer(self.uid, interact=interact)
+
     def get_remote_token(self) -> Optional[str]:
         return self._dao.get_config("remote_token")
 
@@ -599,6 +619,7 @@ class Engine(QObject):
 
         self._stopped = False
         Processor.soft_locks = dict()
+        self._dao.purge_downloads(DOWNLOAD_RESUME_TTL)
         log.debug("Engine %s is starting", self.uid)
         for thread in self._threads:
             thread.start()
@@ -626,6 +647,10 @@ class Engine(QObject):
             "sync_folders": self._dao.get_sync_count(filetype="folder"),
             "syncing": self._dao.get_syncing_count(),
             "unsynchronized_files": self._dao.get_unsynchronized_count(),
+            "scheduler": self.manager.scheduler.get_engine_metrics(self.uid),
+            "subtree_locks": self.subtree_locks.get_metrics(),
+            "prefetch": self.prefetcher.get_metrics(),
+            "docs_cache": self.remote.docs_cache.get_metrics(),
         }
 
     def get_conflicts(self) -> DocPairs:
@@ -698,6 +723,9 @@ class Engine(QObject):
             self._local_watcher.get_thread().wait(5000)
         # Soft locks needs to be reinit in case of threads termination
         Processor.soft_locks = dict()
+        self.prefetcher.shutdown()
+        if self.remote:
+            self.remote.sent_blobs.shutdown()
         log.trace("Engine %s stopped", self.uid)
 
     @staticmethod
@@ -734,6 +762,9 @@ class Engine(QObject):
             "check_suspended": self.suspend_client,
             "dao": self._dao,
             "proxy": self.manager.proxy,
+            "transfers": self.manager.transfers,
+            "blob_cache": self.manager.blob_cache,
+            "docs_cache_ttl": DOCS_CACHE_TTL,
         }
         self.remote = self.filtered_remote_cls(*args, **kwargs)
 
@@ -885,14 +916,8 @@ class Engine(QObject):
         action = Action.get_current_action()
         if isinstance(action, FileAction):
             current_file = self.local.get_path(action.filepath)
-        if (
-            current_file is not None
-            and self._folder_lock is not None
-            and current_file.startswith(self._folder_lock)
-        ):
-            log.debug(
-                "PairInterrupt %r because lock on %r", current_file, self._folder_lock
-            )
+        if current_file is not None and self.subtree_locks.is_claimed(current_file):
+            log.debug("PairInterrupt %r because of a lock on its subtree", current_file)
             raise PairInterrupt()
 
     def create_processor(self, item_getter: Callable, **kwargs: Any) -> Processor:
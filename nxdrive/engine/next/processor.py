@@ -1,8 +1,7 @@
 # coding: utf-8
 import os
-import shutil
 from logging import getLogger
-from typing import Callable
+from typing import Callable, Tuple
 
 from ..processor import Processor as OldProcessor
 from ...constants import DOWNLOAD_TMP_FILE_PREFIX, DOWNLOAD_TMP_FILE_SUFFIX
@@ -25,7 +24,9 @@ class Processor(OldProcessor):
             local.make_folder("/", ".partials")
         return local.abspath("/.partials")
 
-    def _download_content(self, doc_pair: NuxeoDocumentInfo, file_path: str) -> None:
+    def _download_content(
+        self, doc_pair: NuxeoDocumentInfo, file_path: str
+    ) -> Tuple[str, str]:
 
         # TODO Should share between threads
         file_out = os.path.join(
@@ -40,16 +41,19 @@ class Processor(OldProcessor):
         # Check if the file is already on the HD
         pair = self._dao.get_valid_duplicate_file(doc_pair.remote_digest)
         if pair:
-            shutil.copy(self.local.abspath(pair.local_path), file_out)
-            return file_out
+            self.local.copy_file(pair.local_path, file_out)
+            return file_out, pair.local_digest
+        fs_item_info = self.remote.get_fs_info(
+            doc_pair.remote_ref, parent_fs_item_id=doc_pair.remote_parent_ref
+        )
         tmp_file = self.remote.stream_content(
             doc_pair.remote_ref,
             file_path,
-            parent_fs_item_id=doc_pair.remote_parent_ref,
+            fs_item_info=fs_item_info,
             file_out=file_out,
         )
         self._update_speed_metrics()
-        return tmp_file
+        return tmp_file, fs_item_info.digest
 
     def _update_remotely(self, doc_pair: NuxeoDocumentInfo, is_renaming: bool) -> None:
         log.warning("_update_remotely")
@@ -60,7 +64,7 @@ class Processor(OldProcessor):
         else:
             new_os_path = os_path
         log.debug("Updating content of local file '%s'.", os_path)
-        tmp_file = self._download_content(doc_pair, new_os_path)
+        tmp_file, digest = self._download_content(doc_pair, new_os_path)
         # Delete original file and rename tmp file
         self.local.delete_final(doc_pair.local_path)
         rel_path = self.local.get_path(tmp_file)
@@ -69,6 +73,7 @@ class Processor(OldProcessor):
         updated_info = self.local.move(
             rel_path, doc_pair.local_parent_path, doc_pair.remote_name
         )
+        updated_info.set_digest(digest)
         doc_pair.local_digest = updated_info.get_digest()
         self._dao.update_last_transfer(doc_pair.id, "download")
         self._refresh_local_state(doc_pair, updated_info)
@@ -92,7 +97,7 @@ class Processor(OldProcessor):
 
             else:
                 path, os_path, name = self.local.get_new_file(local_parent_path, name)
-                tmp_file = self._download_content(doc_pair, os_path)
+                tmp_file, _ = self._download_content(doc_pair, os_path)
                 log.debug(
                     "Creating local file '%s' in '%s'",
                     name,
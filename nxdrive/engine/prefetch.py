@@ -0,0 +1,163 @@
+# coding: utf-8
+"""
+Prefetch of the remote infos needed by queued local changes.
+
+Before handling a local change on a document known by the server, a
+processor checks the remote state of the document, which is a round trip
+to the server per document. When many local changes are queued, processors
+were waiting for these round trips one after the other.
+
+The first processor needing an info now fetches, in one go, the infos of
+the next local changes in the queues. The requests are sent concurrently
+over the shared connection pool, the server not providing a batch
+operation returning file system items. Results are kept for a short time
+and given once: the processor handling the change consumes it.
+An info forgotten while it is fetched is not kept, it may predate the change.
+"""
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from logging import getLogger
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from ..exceptions import NotFound
+from ..objects import Metrics, RemoteFileInfo
+
+__all__ = ("Prefetcher",)
+
+log = getLogger(__name__)
+
+
+class Prefetcher:
+    """ Fetch remote infos of the queued local changes of an engine. """
+
+    def __init__(
+        self, engine: "Engine", batch_size: int = 50, workers: int = 4, ttl: int = 30
+    ) -> None:
+        self.engine = engine
+        self.batch_size = batch_size
+        self.ttl = ttl
+        self._workers = workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = Lock()
+        # remote_ref -> (expiration time, info or None if the item is gone)
+        self._infos: Dict[str, Tuple[float, Optional[RemoteFileInfo]]] = {}
+        # remote_ref -> info being fetched
+        self._pending: Dict[str, Future] = {}
+        # remote_ref -> number of times it was forgotten while being fetched
+        self._generations: Dict[str, int] = {}
+        self._metrics = {"hits": 0, "misses": 0, "fetched": 0}
+
+    def get_fs_info(self, ref: str) -> RemoteFileInfo:
+        """
+        Return the remote info of *ref*, raise NotFound if the item is gone.
+        Infos of the next queued local changes are fetched at the same time.
+        """
+        with self._lock:
+            expiration, info = self._infos.pop(ref, (0, None))
+            if expiration > time.time():
+                self._metrics["hits"] += 1
+                return self._result(ref, info)
+
+            self._metrics["misses"] += 1
+            future = self._pending.get(ref)
+
+        if future is None:
+            future = self._prefetch(ref)
+
+        future.result()
+        with self._lock:
+            entry = self._infos.pop(ref, None)
+        if entry is None:
+            # Forgotten while it was fetched, or taken by another processor
+            info = self.engine.remote.get_fs_info(ref, raise_if_missing=False)
+            return self._result(ref, info)
+        return self._result(ref, entry[1])
+
+    @staticmethod
+    def _result(ref: str, info: Optional[RemoteFileInfo]) -> RemoteFileInfo:
+        if info is None:
+            raise NotFound("Could not find %r on the server" % ref)
+        return info
+
+    def _queued_refs(self) -> List[str]:
+        """ Remote references of the next local changes in the queues. """
+        items = self.engine.get_queue_manager().peek_local_items(self.batch_size)
+        return self.engine.get_dao().get_remote_refs([item.id for item in items])
+
+    def _prefetch(self, ref: str) -> Future:
+        """ Fetch *ref* and the next queued ones, return the future of *ref*. """
+        try:
+            refs = self._queued_refs()
+        except Exception:
+            log.exception("Cannot look ahead in the queues")
+            refs = []
+
+        now = time.time()
+        with self._lock:
+            # Forget expired infos of changes handled without using them
+            for expired in [r for r, (exp, _) in self._infos.items() if exp <= now]:
+                del self._infos[expired]
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._workers, thread_name_prefix="Prefetcher"
+                )
+
+            future = self._pending.get(ref)
+            if future is None:
+                future = self._pending[ref] = self._submit(ref)
+
+            for other in refs[: self.batch_size]:
+                if other in self._pending or other in self._infos:
+                    continue
+                self._pending[other] = self._submit(other)
+
+        log.trace("Prefetching %d remote infos", len(refs))
+        return future
+
+    def _submit(self, ref: str) -> Future:
+        generation = self._generations.get(ref, 0)
+        return self._executor.submit(self._fetch, ref, generation)
+
+    def _fetch(self, ref: str, generation: int) -> None:
+        try:
+            info = self.engine.remote.get_fs_info(ref, raise_if_missing=False)
+        except Exception:
+            with self._lock:
+                if self._generations.get(ref, 0) == generation:
+                    self._pending.pop(ref, None)
+            raise
+
+        # Stored before the future is done, so that waiters find it
+        with self._lock:
+            if self._generations.get(ref, 0) != generation:
+                log.trace("Dropping the outdated info of %r", ref)
+                return
+            self._pending.pop(ref, None)
+            self._infos[ref] = (time.time() + self.ttl, info)
+            self._metrics["fetched"] += 1
+
+    def forget(self, ref: str) -> None:
+        """ Drop the info of *ref*, the remote document changed. """
+        with self._lock:
+            self._infos.pop(ref, None)
+            if self._pending.pop(ref, None):
+                self._generations[ref] = self._generations.get(ref, 0) + 1
+
+    def shutdown(self) -> None:
+        """ Stop fetching and drop the infos, the engine is stopped. """
+        with self._lock:
+            executor, self._executor = self._executor, None
+            pending, self._pending = self._pending, {}
+            for ref in pending:
+                self._generations[ref] = self._generations.get(ref, 0) + 1
+            self._infos.clear()
+        if executor:
+            executor.shutdown(wait=False)
+        for future in pending.values():
+            future.cancel()
+
+    def get_metrics(self) -> Metrics:
+        with self._lock:
+            return {**self._metrics, "cached": len(self._infos)}
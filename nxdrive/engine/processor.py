@@ -1,9 +1,8 @@
 # coding: utf-8
 import os
-import shutil
 import socket
 import sqlite3
-from contextlib import suppress
+from contextlib import ExitStack, suppress
 from logging import getLogger
 from threading import Lock
 from time import sleep
@@ -15,6 +14,7 @@ from requests import ConnectionError
 
 from .activity import Action
 from .workers import EngineWorker
+from ..client.upload_batch import SMALL_FILE_SIZE
 from ..constants import (
     DOWNLOAD_TMP_FILE_PREFIX,
     DOWNLOAD_TMP_FILE_SUFFIX,
@@ -167,7 +167,10 @@ class Processor(EngineWorker):
                 log.trace("Did not acquire state, dropping %r", item)
                 continue
 
+            queue_manager = self.engine.get_queue_manager()
             soft_lock = None
+            claimed = False
+            subtree = None
             try:
                 # In case of duplicate we remove the local_path as it
                 # has conflict
@@ -182,6 +185,13 @@ class Processor(EngineWorker):
                 if not self.check_pair_state(doc_pair):
                     continue
 
+                if doc_pair.pair_state in queue_manager.SUBTREE_STATES and (
+                    queue_manager.in_subtree(doc_pair.local_path)
+                ):
+                    # Handled by the deletion of an ancestor
+                    log.trace("Skip pair covered by a subtree deletion: %r", doc_pair)
+                    continue
+
                 # Ensure we are using the good clients
                 if self.remote is not self.engine.remote:
                     self.remote = self.engine.remote
@@ -210,7 +220,9 @@ class Processor(EngineWorker):
                     and doc_pair.remote_ref is not None
                 ):
                     try:
-                        remote_info = self.remote.get_fs_info(doc_pair.remote_ref)
+                        remote_info = self.engine.prefetcher.get_fs_info(
+                            doc_pair.remote_ref
+                        )
                         if (
                             remote_info.digest != doc_pair.remote_digest
                             and doc_pair.remote_digest is not None
@@ -256,6 +268,24 @@ class Processor(EngineWorker):
                     # in the current synchronization
                     doc_pair.local_parent_path = parent_pair.local_path
 
+                if doc_pair.folderish:
+                    # Do not work on a subtree handled by another processor
+                    claimed = self.engine.get_queue_manager().claim_folder(doc_pair)
+                    if not claimed:
+                        continue
+
+                # Wait for exclusive operations on the subtree to be done
+                path = doc_pair.local_path or doc_pair.local_parent_path or "/"
+                immediate = self.engine.subtree_locks.acquire(
+                    path, interact=self._interact
+                )
+                subtree = path
+                if not immediate:
+                    # The pair may have been moved meanwhile, start over
+                    log.debug("Subtree was locked, requeuing %r", doc_pair)
+                    self.engine.get_queue_manager().push(doc_pair)
+                    continue
+
                 handler_name = f"_synchronize_{doc_pair.pair_state}"
                 sync_handler = getattr(self, handler_name, None)
                 if not sync_handler:
@@ -304,11 +334,15 @@ class Processor(EngineWorker):
                         error = f"{handler_name}_http_error_{exc.status}"
                         self._handle_pair_handler_exception(doc_pair, error, exc)
                     continue
+                except ParentNotSynced:
+                    # Wait for the parent to be committed, it will release us
+                    log.debug("Parent of %r is not synchronized yet", doc_pair)
+                    self.engine.get_queue_manager().park(doc_pair)
+                    continue
                 except (
                     ConnectionError,
                     socket.error,  # SSLError
                     PairInterrupt,
-                    ParentNotSynced,
                 ) as exc:
                     log.error(
                         "%s on %r, wait 1s and requeue", type(exc).__name__, doc_pair
@@ -407,7 +441,13 @@ class Processor(EngineWorker):
             finally:
                 if soft_lock:
                     self._unlock_soft_path(soft_lock)
+                if subtree:
+                    self.engine.subtree_locks.release(subtree)
                 self._dao.release_state(self._thread_id)
+                if claimed:
+                    # Children can be processed now that the folder is committed
+                    queue_manager.release(doc_pair)
+                queue_manager.release_subtree(doc_pair)
             self._interact()
 
     def _handle_pair_handler_exception(
@@ -506,13 +546,15 @@ class Processor(EngineWorker):
                     self._postpone_pair(doc_pair, "Unaccessible hash")
                     return
                 log.debug("Updating remote document %r", doc_pair.local_name)
-                fs_item_info = self.remote.stream_update(
-                    doc_pair.remote_ref,
-                    self.local.abspath(doc_pair.local_path),
-                    parent_fs_item_id=doc_pair.remote_parent_ref,
-                    # Use remote name to avoid rename in case of duplicate
-                    filename=doc_pair.remote_name,
-                )
+                with self.engine.transfer_slot(self._interact):
+                    fs_item_info = self.remote.stream_update(
+                        doc_pair.remote_ref,
+                        self.local.abspath(doc_pair.local_path),
+                        parent_fs_item_id=doc_pair.remote_parent_ref,
+                        # Use remote name to avoid rename in case of duplicate
+                        filename=doc_pair.remote_name,
+                        doc_pair=doc_pair,
+                    )
                 self._dao.update_last_transfer(doc_pair.id, "upload")
                 self._update_speed_metrics()
                 self._dao.update_remote_state(doc_pair, fs_item_info, versioned=False)
@@ -749,15 +791,23 @@ class Processor(EngineWorker):
                     if doc_pair.local_digest == UNACCESSIBLE_HASH:
                         self._postpone_pair(doc_pair, "Unaccessible hash")
                         return
-                fs_item_info = self.remote.stream_file(
-                    parent_ref,
-                    self.local.abspath(doc_pair.local_path),
-                    filename=name,
-                    overwrite=overwrite,
-                )
+                fs_item_info = None
+                if not overwrite:
+                    fs_item_info = self._copy_remotely(doc_pair, parent_ref, name)
+                if not fs_item_info:
+                    if doc_pair.size <= SMALL_FILE_SIZE:
+                        self._send_ahead(doc_pair, parent_ref)
+                    with self.engine.transfer_slot(self._interact):
+                        fs_item_info = self.remote.stream_file(
+                            parent_ref,
+                            self.local.abspath(doc_pair.local_path),
+                            filename=name,
+                            overwrite=overwrite,
+                            doc_pair=doc_pair,
+                        )
+                    self._update_speed_metrics()
                 remote_ref = fs_item_info.uid
                 self._dao.update_last_transfer(doc_pair.id, "upload")
-                self._update_speed_metrics()
 
             with self._dao._lock:
                 remote_id_done = False
@@ -807,6 +857,64 @@ class Processor(EngineWorker):
                 )
                 self._handle_unsynchronized(doc_pair)
 
+    def _send_ahead(self, doc_pair: NuxeoDocumentInfo, parent_ref: str) -> None:
+        """
+        Start sending the blobs of the small new files of the folder queued
+        after *doc_pair*, while its document is created.
+        """
+        items = self.engine.get_queue_manager().peek_local_items(50)
+        files = []
+        for pair in self._dao.get_states_from_ids([item.id for item in items]):
+            name = os.path.basename(pair.local_path)
+            if (
+                pair.id != doc_pair.id
+                and pair.local_parent_path == doc_pair.local_parent_path
+                and pair.pair_state == "locally_created"
+                and not pair.folderish
+                and (pair.size or 0) <= SMALL_FILE_SIZE
+                and not is_generated_tmp_file(name)[0]
+            ):
+                files.append((self.local.abspath(pair.local_path), name))
+        if files:
+            log.trace("Sending ahead %d files of %r", len(files), parent_ref)
+            self.remote.send_ahead(parent_ref, files)
+
+    def _copy_remotely(
+        self, doc_pair: NuxeoDocumentInfo, parent_ref: str, name: str
+    ) -> Optional[RemoteFileInfo]:
+        """
+        Create the document by copying on the server a synchronized document
+        with the same content, like a local copy-paste, instead of uploading.
+        Return None if the content has to be uploaded.
+        """
+        source = self._dao.get_valid_duplicate_file(doc_pair.local_digest)
+        if not source or not source.remote_ref or source.folderish:
+            return None
+
+        log.debug(
+            "Copying remote document %r instead of uploading %r",
+            source.remote_ref,
+            doc_pair.local_path,
+        )
+        try:
+            fs_item_info = self.remote.copy_file(source.remote_ref, parent_ref, name)
+        except (HTTPError, NotFound):
+            log.warning(
+                "Cannot copy remote document %r, uploading %r",
+                source.remote_ref,
+                doc_pair.local_path,
+                exc_info=True,
+            )
+            return None
+
+        if fs_item_info.digest != doc_pair.local_digest:
+            # The source has been modified on the server meanwhile
+            log.debug("Copied remote document is outdated: %r", fs_item_info)
+            with suppress(HTTPError, NotFound):
+                self.remote.delete(fs_item_info.uid, parent_fs_item_id=parent_ref)
+            return None
+        return fs_item_info
+
     def _synchronize_locally_deleted(self, doc_pair: NuxeoDocumentInfo) -> None:
         if not doc_pair.remote_ref:
             self._dao.remove_state(doc_pair)
@@ -955,23 +1063,37 @@ class Processor(EngineWorker):
             ),
         )
 
-    def _download_content(self, doc_pair: NuxeoDocumentInfo, file_path: str) -> str:
+    def _download_content(
+        self, doc_pair: NuxeoDocumentInfo, file_path: str
+    ) -> Tuple[str, str]:
+        """
+        Download the content of *doc_pair* into a temporary file.
+        Return the file and the digest its content was checked against,
+        so that it does not have to be computed again.
+        """
         # Check if the file is already on the HD
         pair = self._dao.get_valid_duplicate_file(doc_pair.remote_digest)
         if pair:
             file_out = self._get_temporary_file(file_path)
             locker = unlock_path(file_out)
             try:
-                shutil.copy(self.local.abspath(pair.local_path), file_out)
+                self.local.copy_file(pair.local_path, file_out)
             finally:
                 lock_path(file_out, locker)
-            return file_out
+            return file_out, pair.local_digest
 
-        tmp_file = self.remote.stream_content(
-            doc_pair.remote_ref, file_path, parent_fs_item_id=doc_pair.remote_parent_ref
+        fs_item_info = self.remote.get_fs_info(
+            doc_pair.remote_ref, parent_fs_item_id=doc_pair.remote_parent_ref
         )
+        with self.engine.transfer_slot(self._interact):
+            tmp_file = self.remote.stream_content(
+                doc_pair.remote_ref,
+                file_path,
+                fs_item_info=fs_item_info,
+                doc_pair=doc_pair,
+            )
         self._update_speed_metrics()
-        return tmp_file
+        return tmp_file, fs_item_info.digest
 
     def _update_remotely(self, doc_pair: NuxeoDocumentInfo, is_renaming: bool) -> None:
         os_path = self.local.abspath(doc_pair.local_path)
@@ -983,7 +1105,7 @@ class Processor(EngineWorker):
         else:
             new_os_path = os_path
         log.debug("Updating content of local file %r", os_path)
-        self.tmp_file = self._download_content(doc_pair, new_os_path)
+        self.tmp_file, digest = self._download_content(doc_pair, new_os_path)
 
         # Delete original file and rename tmp file
         remote_id = self.local.get_remote_id(doc_pair.local_path)
@@ -998,6 +1120,8 @@ class Processor(EngineWorker):
             updated_info.filepath, mtime=doc_pair.last_remote_updated
         )
 
+        # The content was checked while downloaded, no need to read it again
+        updated_info.set_digest(digest)
         doc_pair.local_digest = updated_info.get_digest()
         self._dao.update_last_transfer(doc_pair.id, "download")
         self._refresh_local_state(doc_pair, updated_info)
@@ -1017,34 +1141,32 @@ class Processor(EngineWorker):
     def _synchronize_remotely_modified(self, doc_pair: RemoteFileInfo) -> None:
         self.tmp_file = None
         is_renaming = safe_filename(doc_pair.remote_name) != doc_pair.local_name
-        try:
-            if doc_pair.local_digest is not None and not self.local.is_equal_digests(
-                doc_pair.local_digest, doc_pair.remote_digest, doc_pair.local_path
-            ):
-                self._update_remotely(doc_pair, is_renaming)
-            else:
-                # Digest agree so this might be a renaming and/or a move,
-                # and no need to transfer additional bytes over the network
-                is_move, new_parent_pair = self._is_remote_move(doc_pair)
-                if self.remote.is_filtered(doc_pair.remote_parent_path):
-                    # A move to a filtered parent (treat it as deletion)
-                    self._synchronize_remotely_deleted(doc_pair)
-                    return
+        if doc_pair.local_digest is not None and not self.local.is_equal_digests(
+            doc_pair.local_digest, doc_pair.remote_digest, doc_pair.local_path
+        ):
+            self._update_remotely(doc_pair, is_renaming)
+        else:
+            # Digest agree so this might be a renaming and/or a move,
+            # and no need to transfer additional bytes over the network
+            is_move, new_parent_pair = self._is_remote_move(doc_pair)
+            if self.remote.is_filtered(doc_pair.remote_parent_path):
+                # A move to a filtered parent (treat it as deletion)
+                self._synchronize_remotely_deleted(doc_pair)
+                return
 
-                if not new_parent_pair:
-                    # A move to a folder that has not yet been processed
-                    self._postpone_pair(doc_pair, reason="PARENT_UNSYNC")
-                    return
+            if not new_parent_pair:
+                # A move to a folder that has not yet been processed
+                self._postpone_pair(doc_pair, reason="PARENT_UNSYNC")
+                return
 
-                if not is_move and not is_renaming:
-                    log.debug(
-                        "No local impact of metadata update on document %r",
-                        doc_pair.remote_name,
-                    )
-                else:
-                    file_or_folder = "folder" if doc_pair.folderish else "file"
-                    if doc_pair.folderish:
-                        self.engine.set_local_folder_lock(doc_pair.local_path)
+            if not is_move and not is_renaming:
+                log.debug(
+                    "No local impact of metadata update on document %r",
+                    doc_pair.remote_name,
+                )
+            else:
+                file_or_folder = "folder" if doc_pair.folderish else "file"
+                with self._lock_folder(doc_pair):
                     if is_move:
                         # Move and potential rename
                         moved_name = (
@@ -1110,12 +1232,8 @@ class Processor(EngineWorker):
                         )
                         self._search_for_dedup(doc_pair)
                         self._refresh_local_state(doc_pair, updated_info)
-            self._handle_readonly(doc_pair)
-            self._dao.synchronize_state(doc_pair)
-        finally:
-            if doc_pair.folderish:
-                # Release folder lock in any case
-                self.engine.release_folder_lock()
+        self._handle_readonly(doc_pair)
+        self._dao.synchronize_state(doc_pair)
 
         if not self.tmp_file:
             return
@@ -1229,7 +1347,7 @@ class Processor(EngineWorker):
                 name,
                 self.local.abspath(local_parent_path),
             )
-            tmp_file = self._download_content(doc_pair, os_path)
+            tmp_file, digest = self._download_content(doc_pair, os_path)
             tmp_path = self.local.get_path(tmp_file)
 
             # Set remote id on TMP file already
@@ -1245,6 +1363,9 @@ class Processor(EngineWorker):
             ctime = doc_pair.creation_date
             self.local.change_file_date(info.filepath, mtime=mtime, ctime=ctime)
 
+            # The content was checked while downloaded, no need to read it again
+            info.set_digest(digest)
+            doc_pair.local_digest = info.get_digest()
             self._dao.update_last_transfer(doc_pair.id, "download")
 
             # Clean-up the TMP file
@@ -1255,32 +1376,34 @@ class Processor(EngineWorker):
         finally:
             self._lock_readonly(local_parent_path)
 
+    def _lock_folder(self, doc_pair: NuxeoDocumentInfo) -> Any:
+        """ Lock the subtree of a folder pair while it is changed locally. """
+        if not doc_pair.folderish:
+            # Nothing to lock
+            return ExitStack()
+        return self.engine.local_folder_lock(
+            doc_pair.local_path, interact=self._interact
+        )
+
     def _synchronize_remotely_deleted(self, doc_pair: NuxeoDocumentInfo) -> None:
-        try:
-            if doc_pair.local_state != "deleted":
-                log.debug(
-                    "Deleting locally %r", self.local.abspath(doc_pair.local_path)
+        if doc_pair.local_state != "deleted":
+            log.debug("Deleting locally %r", self.local.abspath(doc_pair.local_path))
+            if not doc_pair.folderish:
+                # Check for nxpart to clean up
+                file_out = self._get_temporary_file(
+                    self.local.abspath(doc_pair.local_path)
                 )
-                if doc_pair.folderish:
-                    self.engine.set_local_folder_lock(doc_pair.local_path)
-                else:
-                    # Check for nxpart to clean up
-                    file_out = self._get_temporary_file(
-                        self.local.abspath(doc_pair.local_path)
-                    )
-                    if os.path.exists(file_out):
-                        os.remove(file_out)
+                if os.path.exists(file_out):
+                    os.remove(file_out)
 
+            with self._lock_folder(doc_pair):
                 if not self.engine.use_trash():
                     # Force the complete file deletion
                     self.local.delete_final(doc_pair.local_path)
                 else:
                     self.local.delete(doc_pair.local_path)
-            self._dao.remove_state(doc_pair)
-            self._search_for_dedup(doc_pair)
-        finally:
-            if doc_pair.folderish:
-                self.engine.release_folder_lock()
+        self._dao.remove_state(doc_pair)
+        self._search_for_dedup(doc_pair)
 
     def _synchronize_unknown_deleted(self, doc_pair: NuxeoDocumentInfo) -> None:
         # Somehow a pair can get to an inconsistent state:
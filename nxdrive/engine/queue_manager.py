@@ -2,10 +2,11 @@
 import time
 from contextlib import suppress
 from copy import deepcopy
+from itertools import islice
 from logging import getLogger
 from queue import Empty, Queue
 from threading import Lock
-from typing import Any, Callable, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal, pyqtSlot
 
@@ -44,8 +45,15 @@ class QueueManager(QObject):
     # Only used by Unit Test
     _disable = False
 
+    # States of descendants covered by the deletion of a whole subtree
+    SUBTREE_STATES = {"locally_deleted", "remotely_deleted", "parent_remotely_deleted"}
+
     def __init__(
-        self, engine: "Engine", dao: "EngineDAO", max_file_processors: int = 5
+        self,
+        engine: "Engine",
+        dao: "EngineDAO",
+        max_file_processors: int = 5,
+        max_folder_processors: int = 2,
     ) -> None:
         super().__init__()
         self._dao = dao
@@ -58,15 +66,26 @@ class QueueManager(QObject):
         self._local_file_enable = True
         self._remote_folder_enable = True
         self._remote_file_enable = True
-        self._local_folder_thread = None
+        self._local_folder_threads = list()
         self._local_file_thread = None
-        self._remote_folder_thread = None
+        self._remote_folder_threads = list()
         self._remote_file_thread = None
         self._error_threshold = 3
         self._error_interval = 60
         self.set_max_processors(max_file_processors)
+        self._max_folder_processors = max(1, max_folder_processors)
         self._processors_pool = list()
         self._get_file_lock = Lock()
+
+        # DEPENDENCIES HANDLING
+        # Items waiting for another pair to be processed, indexed by the
+        # local path or the remote reference of that pair
+        self._parked_lock = Lock()
+        self._parked: Dict[str, Dict[int, NuxeoDocumentInfo]] = dict()
+        # Folders being processed, to keep workers on independent subtrees
+        self._active_folders: Dict[int, str] = dict()
+        # Deletions of whole subtrees, indexed by the local path of their root
+        self._subtrees: Dict[str, int] = dict()
         # Should not operate on thread while we are inspecting them
         """
         This error required to add a lock for inspecting threads,
@@ -116,6 +135,12 @@ class QueueManager(QObject):
             max_file_processors = 2
         self._max_processors = max_file_processors - 2
 
+    def get_max_processors(self) -> int:
+        """ Maximum number of processors running at the same time. """
+        # Additional processors, the local and remote file threads,
+        # and the local and remote folder threads
+        return self._max_processors + 2 + 2 * self._max_folder_processors
+
     def resume(self) -> None:
         log.debug("Resuming queue")
         self.enable_local_file_queue(True, False)
@@ -150,8 +175,9 @@ class QueueManager(QObject):
 
     def enable_local_folder_queue(self, value: bool = True, emit: bool = True) -> None:
         self._local_folder_enable = value
-        if self._local_folder_thread is not None and not value:
-            self._local_folder_thread.quit()
+        if not value:
+            for thread in self._local_folder_threads:
+                thread.quit()
         if value and emit:
             self.queueProcessing.emit()
 
@@ -164,11 +190,22 @@ class QueueManager(QObject):
 
     def enable_remote_folder_queue(self, value: bool = True, emit: bool = True) -> None:
         self._remote_folder_enable = value
-        if self._remote_folder_thread is not None and not value:
-            self._remote_folder_thread.quit()
+        if not value:
+            for thread in self._remote_folder_threads:
+                thread.quit()
         if value and emit:
             self.queueProcessing.emit()
 
+    def peek_local_items(self, limit: int) -> List[QueueItem]:
+        """ Local changes next in the queues, without dequeuing them. """
+        items: List[QueueItem] = []
+        for queue in (self._local_folder_queue, self._local_file_queue):
+            with queue.mutex:
+                items.extend(islice(queue.queue, limit - len(items)))
+            if len(items) >= limit:
+                break
+        return [item for item in items if item.pair_state.startswith("locally")]
+
     def get_local_file_queue(self) -> Queue:
         return self._copy_queue(self._local_file_queue)
 
@@ -228,6 +265,41 @@ class QueueManager(QObject):
             # deleted and conflicted
             log.debug("Not processable state: %r", state)
 
+    def push_subtree(self, row_id: int, path: str, pair_state: str) -> None:
+        """
+        Push a folder deletion as a single operation for the whole subtree.
+        Until it is done, the deletion of its descendants is not queued.
+        """
+        with self._parked_lock:
+            self._subtrees[path] = row_id
+        self.push(QueueItem(row_id, True, pair_state))
+
+    def in_subtree(self, path: str) -> bool:
+        """ Check if *path* is inside a subtree pending for deletion. """
+        if not path:
+            return False
+        with self._parked_lock:
+            return any(
+                path.startswith(root.rstrip("/") + "/") for root in self._subtrees
+            )
+
+    def release_subtree(self, doc_pair: DocPair, force: bool = False) -> None:
+        """
+        Forget about the subtree rooted at *doc_pair* once it has been handled.
+        It is kept while the pair is still to be deleted, as it will be retried.
+        """
+        with self._parked_lock:
+            if doc_pair.id not in self._subtrees.values():
+                return
+        if not force:
+            pair = self._dao.get_state_from_id(doc_pair.id)
+            if pair and pair.pair_state in self.SUBTREE_STATES:
+                return
+        with self._parked_lock:
+            for path, row_id in list(self._subtrees.items()):
+                if row_id == doc_pair.id:
+                    del self._subtrees[path]
+
     @pyqtSlot()
     def _on_error_timer(self) -> None:
         cur_time = int(time.time())
@@ -277,6 +349,9 @@ class QueueManager(QObject):
         if error_count > self._error_threshold:
             self.newErrorGiveUp.emit(doc_pair.id)
             log.debug("Giving up on pair : %r", doc_pair)
+            # Items waiting for that pair would never be released otherwise
+            self.release(doc_pair)
+            self.release_subtree(doc_pair, force=True)
             return
         if interval is None:
             interval = self._error_interval * error_count
@@ -295,6 +370,89 @@ class QueueManager(QObject):
             for doc_pair in self._on_error_queue.values():
                 doc_pair.error_next_try = 0
 
+    @staticmethod
+    def _parent_key(doc_pair: NuxeoDocumentInfo) -> Optional[str]:
+        """ The key of the pair *doc_pair* depends on. """
+        if doc_pair.pair_state.startswith("locally"):
+            return doc_pair.local_parent_path or "/"
+        return doc_pair.remote_parent_ref
+
+    def _is_pending(self, key: str) -> bool:
+        """
+        Check if the pair identified by *key* still has to be processed,
+        meaning that it will release its dependencies at some point.
+        """
+        if key.startswith("/"):
+            pair = self._dao.get_state_from_local(key)
+        else:
+            pair = self._dao.get_normal_state_from_remote(key)
+        if pair is None:
+            return False
+        return pair.processor > 0 or pair.pair_state.startswith(("locally", "remotely"))
+
+    def park(self, doc_pair: NuxeoDocumentInfo) -> None:
+        """
+        Hold *doc_pair* until its parent has been processed.
+        The pair is pushed back by release() as soon as the parent pair
+        is committed, instead of being requeued blindly.
+        """
+        key = self._parent_key(doc_pair)
+        with self._parked_lock:
+            # The parent may have been committed between the moment the
+            # processor checked it and now, so check it under the lock
+            if key and self._is_pending(key):
+                log.trace("Parking %r until %r is processed", doc_pair, key)
+                self._parked.setdefault(key, {})[doc_pair.id] = doc_pair
+                return
+
+        # The parent is synchronized or in a state it will not leave by itself
+        self.push_error(doc_pair, interval=1)
+
+    def claim_folder(self, doc_pair: NuxeoDocumentInfo) -> bool:
+        """
+        Reserve the subtree of the folder *doc_pair* for the current worker.
+        If another worker is already on an ancestor or a descendant,
+        the pair is parked until that one is done and False is returned.
+        """
+        path = doc_pair.local_path or ""
+        with self._parked_lock:
+            for other in self._active_folders.values():
+                if (
+                    path == other
+                    or path.startswith(other.rstrip("/") + "/")
+                    or other.startswith(path.rstrip("/") + "/")
+                ):
+                    log.trace("Parking %r while %r is processed", doc_pair, other)
+                    self._parked.setdefault(other, {})[doc_pair.id] = doc_pair
+                    return False
+            self._active_folders[doc_pair.id] = path
+        return True
+
+    def release(self, doc_pair: NuxeoDocumentInfo) -> None:
+        """ Push back items that were waiting for *doc_pair*. """
+        keys = {doc_pair.local_path, doc_pair.remote_ref}
+        pair = self._dao.get_state_from_id(doc_pair.id)
+        if pair:
+            # The local path and the remote reference may have changed
+            keys.update({pair.local_path, pair.remote_ref})
+
+        items: List[NuxeoDocumentInfo] = []
+        with self._parked_lock:
+            claimed = self._active_folders.pop(doc_pair.id, None)
+            if claimed is not None:
+                keys.add(claimed)
+            for key in keys:
+                if key:
+                    items.extend(self._parked.pop(key, {}).values())
+
+        for item in items:
+            log.trace("Releasing %r, %r has been processed", item, doc_pair)
+            self.push(item)
+
+    def get_parked_count(self) -> int:
+        with self._parked_lock:
+            return sum(len(items) for items in self._parked.values())
+
     def _get_local_folder(self) -> Optional[str]:
         if self._local_folder_queue.empty():
             return None
@@ -354,24 +512,19 @@ class QueueManager(QObject):
     @pyqtSlot()
     def _thread_finished(self) -> None:
         with self._thread_inspection:
-            for thread in self._processors_pool:
-                if thread.isFinished():
-                    self._processors_pool.remove(thread)
-            if (
-                self._local_folder_thread is not None
-                and self._local_folder_thread.isFinished()
+            for pool in (
+                self._processors_pool,
+                self._local_folder_threads,
+                self._remote_folder_threads,
             ):
-                self._local_folder_thread = None
+                for thread in pool[:]:
+                    if thread.isFinished():
+                        pool.remove(thread)
             if (
                 self._local_file_thread is not None
                 and self._local_file_thread.isFinished()
             ):
                 self._local_file_thread = None
-            if (
-                self._remote_folder_thread is not None
-                and self._remote_folder_thread.isFinished()
-            ):
-                self._remote_folder_thread = None
             if (
                 self._remote_file_thread is not None
                 and self._remote_file_thread.isFinished()
@@ -388,10 +541,10 @@ class QueueManager(QObject):
     def is_active(self) -> bool:
         return any(
             {
-                self._local_folder_thread is not None,
+                len(self._local_folder_threads) > 0,
                 self._local_file_thread is not None,
                 self._remote_file_thread is not None,
-                self._remote_folder_thread is not None,
+                len(self._remote_folder_threads) > 0,
                 len(self._processors_pool) > 0,
             }
         )
@@ -410,10 +563,14 @@ class QueueManager(QObject):
             "remote_folder_queue": self._remote_folder_queue.qsize(),
             "remote_file_queue": self._remote_file_queue.qsize(),
             "remote_file_thread": self._remote_file_thread is not None,
-            "remote_folder_thread": self._remote_folder_thread is not None,
+            "remote_folder_thread": len(self._remote_folder_threads) > 0,
             "local_file_thread": self._local_file_thread is not None,
-            "local_folder_thread": self._local_folder_thread is not None,
+            "local_folder_thread": len(self._local_folder_threads) > 0,
+            "local_folder_processors": len(self._local_folder_threads),
+            "remote_folder_processors": len(self._remote_folder_threads),
             "error_queue": self.get_errors_count(),
+            "parked_queue": self.get_parked_count(),
+            "subtree_operations": len(self._subtrees),
             "additional_processors": len(self._processors_pool),
         }
         metrics["total_queue"] = (
@@ -460,15 +617,10 @@ class QueueManager(QObject):
     def get_processors_on(self, path: str, exact_match: bool = True) -> List[Processor]:
         with self._thread_inspection:
             res = []
+            for thread in self._local_folder_threads + self._remote_folder_threads:
+                if self.is_processing_file(thread, path, exact_match=exact_match):
+                    res.append(thread.worker)
             if self.is_processing_file(
-                self._local_folder_thread, path, exact_match=exact_match
-            ):
-                res.append(self._local_folder_thread.worker)
-            elif self.is_processing_file(
-                self._remote_folder_thread, path, exact_match=exact_match
-            ):
-                res.append(self._remote_folder_thread.worker)
-            elif self.is_processing_file(
                 self._local_file_thread, path, exact_match=exact_match
             ):
                 res.append(self._local_file_thread.worker)
@@ -482,18 +634,6 @@ class QueueManager(QObject):
                         res.append(thread.worker)
         return res
 
-    def has_file_processors_on(self, path: str) -> bool:
-        with self._thread_inspection:
-            # First check local and remote file
-            if self.is_processing_file(
-                self._local_file_thread or self._remote_file_thread, path
-            ):
-                return True
-            for thread in self._processors_pool:
-                if self.is_processing_file(thread, path):
-                    return True
-            return False
-
     @pyqtSlot()
     def launch_processors(self) -> None:
         if (
@@ -510,13 +650,15 @@ class QueueManager(QObject):
                 self.queueFinishedProcessing.emit()
             return
 
-        if (
-            self._local_folder_thread is None
-            and not self._local_folder_queue.empty()
+        # Folders are handled by several workers, claim_folder() ensures
+        # they are working on independent subtrees
+        while (
+            len(self._local_folder_threads) < self._max_folder_processors
+            and len(self._local_folder_threads) < self._local_folder_queue.qsize()
             and self._local_folder_enable
         ):
-            self._local_folder_thread = self._create_thread(
-                self._get_local_folder, name="LocalFolderProcessor"
+            self._local_folder_threads.append(
+                self._create_thread(self._get_local_folder, name="LocalFolderProcessor")
             )
 
         if (
@@ -528,13 +670,15 @@ class QueueManager(QObject):
                 self._get_local_file, name="LocalFileProcessor"
             )
 
-        if (
-            self._remote_folder_thread is None
-            and not self._remote_folder_queue.empty()
+        while (
+            len(self._remote_folder_threads) < self._max_folder_processors
+            and len(self._remote_folder_threads) < self._remote_folder_queue.qsize()
             and self._remote_folder_enable
         ):
-            self._remote_folder_thread = self._create_thread(
-                self._get_remote_folder, name="RemoteFolderProcessor"
+            self._remote_folder_threads.append(
+                self._create_thread(
+                    self._get_remote_folder, name="RemoteFolderProcessor"
+                )
             )
 
         if (
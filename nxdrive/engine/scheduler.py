@@ -0,0 +1,165 @@
+# coding: utf-8
+"""
+Share resources between engines.
+
+Each engine has its own processors, but network transfers and digest
+computations are all competing for the same uplink and disk. The `Scheduler`
+is owned by the `Manager` and hands out a limited number of slots for each
+kind of work. When several engines are waiting for a slot, it is given to
+the engine having the lowest number of running tasks relatively to its
+weight, then to the least recently served one, so that a huge initial
+synchronization cannot starve the others.
+"""
+from contextlib import contextmanager
+from logging import getLogger
+from threading import Condition
+from time import monotonic
+from typing import Callable, Dict, Iterator
+
+from ..objects import Metrics
+
+__all__ = ("Scheduler",)
+
+log = getLogger(__name__)
+
+
+class Scheduler:
+    """ Global and fair slots allocation for all engines. """
+
+    # Kinds of work to schedule
+    HASHING = "hashing"
+    TRANSFER = "transfer"
+
+    def __init__(self, max_transfers: int = 4, max_hashing: int = 2) -> None:
+        self._condition = Condition()
+        self._weights: Dict[str, int] = dict()
+        self._caps = {self.TRANSFER: max_transfers, self.HASHING: max_hashing}
+        self._running = {kind: dict() for kind in self._caps}
+        self._waiting = {kind: dict() for kind in self._caps}
+        self._last_grant = {kind: dict() for kind in self._caps}
+        self._metrics: Dict[str, Metrics] = dict()
+
+    def register(self, uid: str, weight: int = 1) -> None:
+        """ Add an engine, or update its weight. """
+        with self._condition:
+            self._weights[uid] = max(1, weight)
+            for kind in self._caps:
+                self._running[kind].setdefault(uid, 0)
+                self._waiting[kind].setdefault(uid, 0)
+                self._last_grant[kind].setdefault(uid, 0.0)
+            self._metrics.setdefault(
+                uid,
+                {
+                    kind + suffix: 0
+                    for kind in self._caps
+                    for suffix in ("_count", "_wait_time")
+                },
+            )
+            self._condition.notify_all()
+        log.debug("Registered engine %s with weight %d", uid, weight)
+
+    def unregister(self, uid: str) -> None:
+        with self._condition:
+            self._weights.pop(uid, None)
+            self._metrics.pop(uid, None)
+            for kind in self._caps:
+                self._running[kind].pop(uid, None)
+                self._waiting[kind].pop(uid, None)
+                self._last_grant[kind].pop(uid, None)
+            self._condition.notify_all()
+
+    def set_limit(self, kind: str, value: int) -> None:
+        """ Change the global number of slots for a given kind of work. """
+        with self._condition:
+            self._caps[kind] = max(1, value)
+            self._condition.notify_all()
+
+    def _is_next(self, kind: str, uid: str) -> bool:
+        """ Check if *uid* is the engine that deserves the next slot. """
+        if uid not in self._weights:
+            # Unregistered while waiting
+            return True
+
+        running = self._running[kind]
+        if sum(running.values()) >= self._caps[kind]:
+            return False
+
+        last_grant = self._last_grant[kind]
+        candidates = [u for u, count in self._waiting[kind].items() if count > 0]
+        best = min(
+            candidates, key=lambda u: (running[u] / self._weights[u], last_grant[u])
+        )
+        return best == uid
+
+    @contextmanager
+    def _slot(
+        self, kind: str, uid: str, interact: Callable[[], None] = None
+    ) -> Iterator[None]:
+        if uid not in self._weights:
+            # Not registered: not subject to scheduling
+            yield
+            return
+
+        start = monotonic()
+        with self._condition:
+            self._waiting[kind][uid] += 1
+        granted = False
+        try:
+            while "Waiting for a slot":
+                with self._condition:
+                    if self._is_next(kind, uid):
+                        granted = True
+                        if uid in self._weights:
+                            self._waiting[kind][uid] -= 1
+                            self._running[kind][uid] += 1
+                            self._last_grant[kind][uid] = monotonic()
+                            metrics = self._metrics[uid]
+                            metrics[kind + "_count"] += 1
+                            metrics[kind + "_wait_time"] += int(
+                                (monotonic() - start) * 1000
+                            )
+                        break
+                    self._condition.wait(1)
+                if interact:
+                    # Allow the thread to be stopped while waiting
+                    interact()
+        finally:
+            if not granted:
+                with self._condition:
+                    if uid in self._waiting[kind]:
+                        self._waiting[kind][uid] -= 1
+                    self._condition.notify_all()
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                if uid in self._running[kind]:
+                    self._running[kind][uid] -= 1
+                self._condition.notify_all()
+
+    def transfer(self, uid: str, interact: Callable[[], None] = None) -> Iterator:
+        """ Context manager to hold a network transfer slot. """
+        return self._slot(self.TRANSFER, uid, interact=interact)
+
+    def hashing(self, uid: str, interact: Callable[[], None] = None) -> Iterator:
+        """ Context manager to hold a digest computation slot. """
+        return self._slot(self.HASHING, uid, interact=interact)
+
+    def get_engine_metrics(self, uid: str) -> Metrics:
+        with self._condition:
+            metrics = dict(self._metrics.get(uid, {}))
+            metrics["weight"] = self._weights.get(uid, 0)
+            for kind in self._caps:
+                metrics[kind + "_running"] = self._running[kind].get(uid, 0)
+        return metrics
+
+    def get_metrics(self) -> Metrics:
+        with self._condition:
+            metrics = {}
+            for kind, cap in self._caps.items():
+                metrics["max_" + kind] = cap
+                metrics[kind + "_running"] = sum(self._running[kind].values())
+                metrics[kind + "_waiting"] = sum(self._waiting[kind].values())
+            metrics["engines"] = len(self._weights)
+        return metrics
@@ -0,0 +1,205 @@
+# coding: utf-8
+"""
+Hierarchical locks on the local tree.
+
+A processor working on a document holds an intention lock on the document
+path and all its ancestors. An operation needing a whole subtree for itself
+(a folder rename, move or deletion, a targeted scan) takes an exclusive lock
+on the folder path, plus intention locks on its ancestors.
+
+An exclusive lock only conflicts with locks held on the same path, on its
+descendants (through their intention lock on the folder) or with an
+exclusive lock on an ancestor. Work happening outside of the subtree keeps
+flowing.
+
+While an exclusive lock is pending, new owners cannot enter the subtree so
+that the requester is not starved. Owners already holding locks can still
+acquire more of them, which prevents deadlocks on lock upgrades.
+
+A frozen subtree is also closed to new owners, but the current ones are
+neither waited for nor asked to step back. It suits short operations, like
+the comparison of a folder with the database during a full scan.
+"""
+from contextlib import contextmanager
+from logging import getLogger
+from threading import Condition, current_thread
+from typing import Callable, Dict, Iterator, List
+
+from ..objects import Metrics
+
+__all__ = ("SubtreeLockManager",)
+
+log = getLogger(__name__)
+
+
+def _ancestors(path: str) -> List[str]:
+    """ Return the given path and all its ancestors, up to the root. """
+    path = "/" + path.strip("/")
+    paths = [path]
+    while path != "/":
+        path = path.rsplit("/", 1)[0] or "/"
+        paths.append(path)
+    return paths
+
+
+class SubtreeLockManager:
+    """ Intention and exclusive locks on local paths, owned by threads. """
+
+    def __init__(self) -> None:
+        self._condition = Condition()
+        # path -> owner -> count
+        self._intents: Dict[str, Dict[int, int]] = dict()
+        self._exclusives: Dict[str, Dict[int, int]] = dict()
+        self._pending: Dict[str, Dict[int, int]] = dict()
+        self._frozen: Dict[str, Dict[int, int]] = dict()
+        # owner -> number of locks held
+        self._owned: Dict[int, int] = dict()
+        self._metrics = {"exclusive_locks": 0, "intention_waits": 0}
+
+    @staticmethod
+    def _others(locks: Dict[str, Dict[int, int]], path: str, owner: int) -> bool:
+        """ Check if another owner than *owner* has a lock on *path*. """
+        return any(o != owner for o in locks.get(path, {}))
+
+    @staticmethod
+    def _add(locks: Dict[str, Dict[int, int]], path: str, owner: int, n: int) -> None:
+        owners = locks.setdefault(path, {})
+        owners[owner] = owners.get(owner, 0) + n
+        if owners[owner] <= 0:
+            del owners[owner]
+            if not owners:
+                del locks[path]
+
+    def _can_enter(self, paths: List[str], owner: int) -> bool:
+        """ Check if intention locks can be taken on *paths*. """
+        for path in paths:
+            if self._others(self._exclusives, path, owner):
+                return False
+            if not self._owned.get(owner) and (
+                self._others(self._pending, path, owner)
+                or self._others(self._frozen, path, owner)
+            ):
+                return False
+        return True
+
+    def _can_lock(self, path: str, owner: int) -> bool:
+        """ Check if the exclusive lock on *path* can be taken. """
+        paths = _ancestors(path)
+        if not self._can_enter(paths[1:], owner):
+            return False
+        return not (
+            self._others(self._exclusives, path, owner)
+            or self._others(self._intents, path, owner)
+        )
+
+    def acquire(
+        self,
+        path: str,
+        exclusive: bool = False,
+        interact: Callable = None,
+        freeze: bool = False,
+    ) -> bool:
+        """
+        Lock *path* for the current thread.
+        *interact* is called regularly while waiting, it may raise to abort.
+        With *freeze*, new owners are kept out of the subtree but the current
+        ones keep working.
+        Return True if the lock was acquired without waiting.
+        """
+        owner = current_thread().ident
+        paths = _ancestors(path)
+        path = paths[0]
+        immediate = True
+
+        def check() -> bool:
+            if exclusive:
+                return self._can_lock(path, owner)
+            return self._can_enter(paths, owner)
+
+        with self._condition:
+            if exclusive:
+                self._add(self._pending, path, owner, 1)
+
+        try:
+            while "Waiting for the lock":
+                with self._condition:
+                    if check():
+                        if exclusive:
+                            self._add(self._pending, path, owner, -1)
+                            self._add(self._exclusives, path, owner, 1)
+                            self._metrics["exclusive_locks"] += 1
+                            paths = paths[1:]
+                        elif not immediate:
+                            self._metrics["intention_waits"] += 1
+                        if freeze:
+                            self._add(self._frozen, path, owner, 1)
+                        for p in paths:
+                            self._add(self._intents, p, owner, 1)
+                        self._owned[owner] = self._owned.get(owner, 0) + 1
+                        return immediate
+
+                    immediate = False
+                    self._condition.wait(1)
+
+                if interact:
+                    interact()
+        except Exception:
+            if exclusive:
+                with self._condition:
+                    self._add(self._pending, path, owner, -1)
+                    self._condition.notify_all()
+            raise
+
+    def release(self, path: str, exclusive: bool = False, freeze: bool = False) -> None:
+        owner = current_thread().ident
+        paths = _ancestors(path)
+        with self._condition:
+            if freeze:
+                self._add(self._frozen, paths[0], owner, -1)
+            if exclusive:
+                self._add(self._exclusives, paths[0], owner, -1)
+                paths = paths[1:]
+            for p in paths:
+                self._add(self._intents, p, owner, -1)
+            self._owned[owner] = self._owned.get(owner, 0) - 1
+            if self._owned[owner] <= 0:
+                del self._owned[owner]
+            self._condition.notify_all()
+
+    @contextmanager
+    def lock(
+        self,
+        path: str,
+        exclusive: bool = False,
+        interact: Callable = None,
+        freeze: bool = False,
+    ) -> Iterator[None]:
+        self.acquire(path, exclusive=exclusive, interact=interact, freeze=freeze)
+        try:
+            yield
+        finally:
+            self.release(path, exclusive=exclusive, freeze=freeze)
+
+    def is_claimed(self, path: str) -> bool:
+        """
+        Check if another thread holds or waits for an exclusive lock
+        on *path* or one of its ancestors.
+        Used by long running operations to know they should step back.
+        """
+        owner = current_thread().ident
+        with self._condition:
+            return any(
+                self._others(self._exclusives, p, owner)
+                or self._others(self._pending, p, owner)
+                for p in _ancestors(path)
+            )
+
+    def get_metrics(self) -> Metrics:
+        with self._condition:
+            return {
+                **self._metrics,
+                "exclusive_held": len(self._exclusives),
+                "exclusive_pending": len(self._pending),
+                "frozen": len(self._frozen),
+                "owners": len(self._owned),
+            }
@@ -0,0 +1,256 @@
+# coding: utf-8
+"""
+Asynchronous network transfers.
+
+Downloads and uploads are run as coroutines on a single event loop thread,
+using aiohttp. Files are read and written by the default executor of the
+loop, so that the disk does not hold the other transfers.
+Processors submit a transfer job and wait for its result while processing
+their Qt events and keeping an eye on their own state, so that a suspended or
+stopped engine cancels its running transfers. All database updates are still
+done by the processors, the service only moves bytes.
+
+aiohttp is an optional dependency: when it is not installed, transfers are
+done synchronously by the `Remote` client as before.
+"""
+import asyncio
+import hashlib
+import ssl
+import time
+from logging import getLogger
+from threading import Event, Thread
+from typing import Any, Callable, Coroutine, Dict, Optional, Union
+
+from PyQt5.QtCore import QCoreApplication
+from nuxeo.exceptions import CorruptedFile, HTTPError
+
+from .activity import FileAction
+from ..client.uploader import blob_headers, execution_headers
+from ..constants import FILE_BUFFER_SIZE, TIMEOUT, TX_TIMEOUT
+from ..objects import Metrics
+from ..options import Options
+from ..utils import guess_digest_algorithm
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+__all__ = ("TransferService",)
+
+log = getLogger(__name__)
+
+
+class TransferService:
+    """ Run transfers of all engines on one event loop thread. """
+
+    def __init__(self, timeout: int = TIMEOUT) -> None:
+        self.timeout = timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[Thread] = None
+        self._session = None
+        self._metrics = {
+            "downloads": 0,
+            "uploads": 0,
+            "running": 0,
+            "bytes_downloaded": 0,
+            "bytes_uploaded": 0,
+        }
+
+    @staticmethod
+    def is_available() -> bool:
+        return aiohttp is not None
+
+    def is_started(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.is_started():
+            return
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._run, name="TransferService", daemon=True)
+        self._thread.start()
+        log.debug("Transfer service started")
+
+    def stop(self) -> None:
+        if not self.is_started():
+            return
+        future = asyncio.run_coroutine_threadsafe(self._close(), self._loop)
+        try:
+            future.result(timeout=5)
+        except Exception:
+            log.exception("Cannot close the transfer session")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._thread = self._loop = None
+        log.debug("Transfer service stopped")
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _close(self) -> None:
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    @staticmethod
+    def _get_ssl() -> Union[bool, ssl.SSLContext, None]:
+        """ Certificates check, as done by the synchronous client. """
+        if not Options.consider_ssl_errors:
+            return False
+        if Options.ca_bundle:
+            return ssl.create_default_context(cafile=Options.ca_bundle)
+        return None
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        # The session must be created from within the event loop
+        if self._session is None:
+            timeout = aiohttp.ClientTimeout(
+                total=None, sock_connect=self.timeout, sock_read=TX_TIMEOUT
+            )
+            connector = aiohttp.TCPConnector(ssl=self._get_ssl())
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    def run(self, job: Coroutine, interact: Callable[[], None] = None) -> Any:
+        """
+        Submit a transfer job and wait for its result.
+        The Qt events of the calling thread are processed meanwhile, and
+        *interact* is called regularly, it may raise to cancel the transfer.
+        """
+        if not self.is_started():
+            job.close()
+            raise RuntimeError("The transfer service is not started")
+
+        done = Event()
+        future = asyncio.run_coroutine_threadsafe(job, self._loop)
+        future.add_done_callback(lambda _: done.set())
+        try:
+            while not done.wait(0.1):
+                QCoreApplication.processEvents()
+                if interact:
+                    interact()
+            return future.result()
+        except Exception:
+            future.cancel()
+            raise
+
+    @staticmethod
+    async def _check(resp: "aiohttp.ClientResponse") -> None:
+        if resp.status >= 400:
+            raise HTTPError(status=resp.status, message=await resp.text())
+
+    async def download(
+        self,
+        url: str,
+        file_out: str,
+        headers: Dict[str, str],
+        digest: str = None,
+        action: FileAction = None,
+        proxy: str = None,
+    ) -> str:
+        """ Stream the content of *url* into *file_out*. """
+        hasher = None
+        if digest:
+            try:
+                hasher = hashlib.new(guess_digest_algorithm(digest))
+            except ValueError:
+                log.debug("Cannot check the digest %r of %r", digest, url)
+
+        loop = asyncio.get_event_loop()
+        self._metrics["running"] += 1
+        try:
+            async with self._get_session().get(
+                url, headers=headers, proxy=proxy
+            ) as resp:
+                await self._check(resp)
+                if action:
+                    action.size = int(resp.headers.get("Content-Length", 0))
+                output = await loop.run_in_executor(None, open, file_out, "wb")
+                try:
+                    async for chunk in resp.content.iter_chunked(FILE_BUFFER_SIZE):
+                        await loop.run_in_executor(None, output.write, chunk)
+                        if hasher:
+                            hasher.update(chunk)
+                        if action:
+                            action.progress += len(chunk)
+                        self._metrics["bytes_downloaded"] += len(chunk)
+                finally:
+                    output.close()
+        finally:
+            self._metrics["running"] -= 1
+
+        if hasher and hasher.hexdigest() != digest:
+            raise CorruptedFile(file_out, digest, hasher.hexdigest())
+        self._metrics["downloads"] += 1
+        return file_out
+
+    async def _read(self, file_path: str, action: FileAction = None) -> Any:
+        loop = asyncio.get_event_loop()
+        data = await loop.run_in_executor(None, open, file_path, "rb")
+        try:
+            while "Reading the file":
+                chunk = await loop.run_in_executor(None, data.read, FILE_BUFFER_SIZE)
+                if not chunk:
+                    break
+                if action:
+                    action.progress += len(chunk)
+                self._metrics["bytes_uploaded"] += len(chunk)
+                yield chunk
+        finally:
+            data.close()
+
+    async def upload(
+        self,
+        api_url: str,
+        file_path: str,
+        filename: str,
+        size: int,
+        mime_type: str,
+        command: str,
+        params: Dict[str, Any],
+        headers: Dict[str, str],
+        action: FileAction = None,
+        proxy: str = None,
+    ) -> Any:
+        """
+        Upload a file into a new batch then execute *command*
+        with the batch as input. Return the operation JSON result.
+        """
+        session = self._get_session()
+        self._metrics["running"] += 1
+        try:
+            tick = time.time()
+            url = api_url + "upload/"
+            async with session.post(url, headers=headers, proxy=proxy) as resp:
+                await self._check(resp)
+                batch_id = (await resp.json(content_type=None))["batchId"]
+
+            url += batch_id + "/0"
+            async with session.post(
+                url,
+                data=self._read(file_path, action=action),
+                headers={**headers, **blob_headers(filename, size, mime_type)},
+                proxy=proxy,
+            ) as resp:
+                await self._check(resp)
+
+            exec_headers = {**headers, **execution_headers(tick, action=action)}
+            async with session.post(
+                url + "/execute/" + command,
+                json={"params": params},
+                headers=exec_headers,
+                proxy=proxy,
+            ) as resp:
+                await self._check(resp)
+                result = await resp.json(content_type=None)
+        finally:
+            self._metrics["running"] -= 1
+
+        self._metrics["uploads"] += 1
+        return result
+
+    def get_metrics(self) -> Metrics:
+        return {**self._metrics, "started": self.is_started()}
@@ -7,7 +7,7 @@ from os.path import basename, dirname, getctime
 from queue import Queue
 from threading import Lock
 from time import mktime, sleep, time
-from typing import Any
+from typing import Any, Dict, List, Optional, Tuple
 
 from PyQt5.QtCore import pyqtSignal
 from watchdog.events import FileSystemEvent, PatternMatchingEventHandler
@@ -36,6 +36,11 @@ WIN_MOVE_RESOLUTION_PERIOD = 2000
 
 TEXT_EDIT_TMP_FILE_PATTERN = r".*\.rtf\.sb\-(\w)+\-(\w)+$"
 
+# Seconds during which an interrupted full scan is resumed rather than
+# restarted. Files changed while the application was stopped, in folders
+# scanned before the interruption, are not seen before the next full scan.
+SCAN_CHECKPOINT_TTL = 3600
+
 
 def is_text_edit_tmp_file(name: str) -> bool:
     return re.match(TEXT_EDIT_TMP_FILE_PATTERN, name)
@@ -77,6 +82,11 @@ class LocalWatcher(EngineWorker):
         self._root_observer = None
         self._delete_events = dict()
         self._folder_scan_events = dict()
+        # Folders scanned by an interrupted full scan, with their mtime
+        self._scanned: Optional[Dict[str, float]] = None
+        # Deletions and errors found while scanning, that make a folder
+        # incomplete: it is scanned again if the full scan is resumed
+        self._scan_incomplete = 0
 
     def _execute(self) -> None:
         try:
@@ -230,26 +240,45 @@ class LocalWatcher(EngineWorker):
     def _scan(self) -> None:
         log.debug("Full scan started")
         start_ms = current_milli_time()
-        to_pause = not self.engine.get_queue_manager().is_paused()
-        if to_pause:
-            self._suspend_queue()
         self._delete_files = dict()
         self._protected_files = dict()
 
-        info = self.local.get_info("/")
-        self._scan_recursive(info)
-        self._scan_handle_deleted_files()
+        # Each folder is locked while it is scanned, not the whole tree
+        self._scanned = self._get_scan_checkpoint()
+        try:
+            info = self.local.get_info("/")
+            self._scan_recursive(info)
+            self._scan_handle_deleted_files()
+        finally:
+            self._scanned = None
+        self._dao.delete_config("local_scan_checkpoint")
+        self._dao.clean_local_scanned()
         self._metrics["last_local_scan_time"] = current_milli_time() - start_ms
         log.debug("Full scan finished in %dms", self._metrics["last_local_scan_time"])
-        if to_pause:
-            self.engine.get_queue_manager().resume()
         self.localScanFinished.emit()
 
+    def _get_scan_checkpoint(self) -> Dict[str, float]:
+        """
+        Folders already scanned by an interrupted full scan, if it started
+        recently enough. Otherwise, start a new checkpoint.
+        """
+        started = float(self._dao.get_config("local_scan_checkpoint", 0))
+        if time() - started < SCAN_CHECKPOINT_TTL:
+            scanned = self._dao.get_local_scanned()
+            log.debug("Resuming the local scan, %d folders done", len(scanned))
+            return scanned
+
+        self._dao.clean_local_scanned()
+        self._dao.update_config("local_scan_checkpoint", time())
+        return {}
+
     def _scan_handle_deleted_files(self) -> None:
         for deleted in self._delete_files:
             if deleted in self._protected_files:
                 continue
-            self._dao.delete_local_state(self._delete_files[deleted])
+            doc_pair = self._delete_files[deleted]
+            with self.engine.subtree_locks.lock(doc_pair.local_path, exclusive=True):
+                self._dao.delete_local_state(doc_pair)
         self._delete_files = dict()
 
     def get_metrics(self) -> Metrics:
@@ -258,23 +287,12 @@ class LocalWatcher(EngineWorker):
             metrics["fs_events"] = self._event_handler.counter
         return {**metrics, **self._metrics}
 
-    def _suspend_queue(self) -> None:
-        queue = self.engine.get_queue_manager()
-        queue.suspend()
-        for processor in queue.get_processors_on("/", exact_match=False):
-            processor.stop()
-
     def scan_pair(self, local_path: str) -> None:
-        to_pause = not self.engine.get_queue_manager().is_paused()
-        if to_pause:
-            self._suspend_queue()
-
-        info = self.local.get_info(local_path)
-        self._scan_recursive(info, recursive=False)
-        self._scan_handle_deleted_files()
-
-        if to_pause:
-            self.engine.get_queue_manager().resume()
+        # Only processors working inside that folder have to wait
+        with self.engine.subtree_locks.lock(local_path, exclusive=True):
+            info = self.local.get_info(local_path)
+            self._scan_recursive(info, recursive=False)
+            self._scan_handle_deleted_files()
 
     def empty_events(self) -> bool:
         ret = self.watchdog_queue.empty()
@@ -300,6 +318,84 @@ class LocalWatcher(EngineWorker):
             # Don't interact if only one level
             self._interact()
 
+        # Folders unchanged since they were scanned only have their files
+        # checked, their subfolders are still scanned
+        checkpoint = recursive and self._scanned is not None
+        children = None
+        if checkpoint:
+            mtime = info.last_modification_time.timestamp()
+            incomplete = self._scan_incomplete
+            if self._scanned.get(info.path) == mtime:
+                subfolders = self._get_unchanged_subfolders(info)
+                if subfolders is not None:
+                    log.trace("Skip already scanned folder %r", info.path)
+                    children = subfolders, []
+
+        if children is None:
+            # New processors are only kept out of the folder while its
+            # children are compared, running ones are not interrupted
+            with self.engine.subtree_locks.lock(
+                info.path, interact=self._interact, freeze=True
+            ):
+                children = self._scan_folder(info)
+            if children is None:
+                return
+        to_scan, to_scan_new = children
+
+        for child_info in to_scan_new:
+            self._scan_recursive(child_info)
+
+        if not recursive:
+            return
+
+        for child_info in to_scan:
+            self._scan_recursive(child_info)
+
+        if checkpoint and self._scan_incomplete == incomplete:
+            self._dao.add_local_scanned(info.path, mtime)
+
+    def _get_unchanged_subfolders(
+        self, info: NuxeoDocumentInfo
+    ) -> Optional[List[NuxeoDocumentInfo]]:
+        """
+        Subfolders of a folder with the same entries as when it was scanned.
+        Return None if one of its files is unknown or was modified since,
+        its children have to be compared with the database then.
+        """
+        try:
+            fs_children_info = self.local.get_children_info(info.path)
+        except OSError:
+            return None
+
+        children = {
+            child.local_name: child for child in self._dao.get_local_children(info.path)
+        }
+        subfolders = []
+        for child_info in fs_children_info:
+            child_pair = children.get(basename(child_info.path))
+            if not child_pair:
+                return None
+            if child_info.folderish:
+                subfolders.append(child_info)
+                continue
+            if child_pair.last_local_updated is None:
+                continue
+            last_mtime = child_info.last_modification_time.strftime("%Y-%m-%d %H:%M:%S")
+            if (
+                last_mtime != child_pair.last_local_updated.split(".")[0]
+                or child_info.size != child_pair.size
+            ):
+                return None
+        return subfolders
+
+    def _scan_folder(
+        self, info: NuxeoDocumentInfo
+    ) -> Optional[Tuple[List[NuxeoDocumentInfo], List[NuxeoDocumentInfo]]]:
+        """
+        Compare the children of a folder with the database.
+        Return its subfolders to scan, the known and the new ones, or None if
+        the folder is gone.
+        """
         dao, client = self._dao, self.local
         # Load all children from DB
         log.trace("Fetching DB local children of %r", info.path)
@@ -317,7 +413,8 @@ class LocalWatcher(EngineWorker):
             fs_children_info = client.get_children_info(info.path)
         except OSError:
             # The folder has been deleted in the mean time
-            return
+            self._scan_incomplete += 1
+            return None
 
         # Get remote children to be able to check if a local child found
         # during the scan is really a new item or if it is just the result
@@ -474,6 +571,7 @@ class LocalWatcher(EngineWorker):
                         " ignoring until next full scan",
                         child_info.path,
                     )
+                    self._scan_incomplete += 1
                     continue
             else:
                 child_pair = children.pop(child_name)
@@ -559,6 +657,7 @@ class LocalWatcher(EngineWorker):
                                 dao.update_local_state(old_pair, child_info)
                                 self._protected_files[old_pair.remote_ref] = True
                             self._delete_files[child_pair.remote_ref] = child_pair
+                            self._scan_incomplete += 1
                         if not child_info.folderish:
                             digest = child_info.get_digest()
                             if child_pair.local_digest != digest:
@@ -571,6 +670,7 @@ class LocalWatcher(EngineWorker):
                 except Exception as e:
                     log.exception("Error with pair %r, increasing error", child_pair)
                     self.increase_error(child_pair, "SCAN RECURSIVE", exception=e)
+                    self._scan_incomplete += 1
                     continue
 
         for deleted in children.values():
@@ -586,15 +686,9 @@ class LocalWatcher(EngineWorker):
                 dao.remove_state(deleted)
             else:
                 self._delete_files[deleted.remote_ref] = deleted
+                self._scan_incomplete += 1
 
-        for child_info in to_scan_new:
-            self._scan_recursive(child_info)
-
-        if not recursive:
-            return
-
-        for child_info in to_scan:
-            self._scan_recursive(child_info)
+        return to_scan, to_scan_new
 
     @tooltip("Setup watchdog")
     def _setup_watchdog(self) -> None:
@@ -763,6 +857,10 @@ class LocalWatcher(EngineWorker):
                     old_local_path = doc_pair.local_path
                     versioned = True
 
+            if doc_pair.folderish and doc_pair.local_path != rel_path:
+                # Move the whole subtree at once, events on descendants are no-ops
+                dao.update_local_parent_path(doc_pair, local_info.name, rel_parent_path)
+
             dao.update_local_state(doc_pair, local_info, versioned=versioned)
 
             if (
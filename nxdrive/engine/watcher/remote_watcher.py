@@ -1,10 +1,14 @@
 # coding: utf-8
+import json
 import os
+import random
 import socket
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
 from logging import getLogger
-from time import sleep
-from typing import Any, Dict, Optional, Tuple
+from time import monotonic, sleep, time
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
 
 from PyQt5.QtCore import pyqtSignal, pyqtSlot
 from nuxeo.exceptions import BadQuery, HTTPError
@@ -15,12 +19,83 @@ from ..workers import EngineWorker
 from ...constants import WINDOWS
 from ...exceptions import NotFound, ThreadInterrupt
 from ...objects import Metrics, NuxeoDocumentInfo, RemoteFileInfo
+from ...options import Options
 from ...utils import current_milli_time, path_join, safe_filename
 
-__all__ = ("RemoteWatcher",)
+__all__ = ("PollingInterval", "RemoteWatcher", "ScrollBatchSize")
 
 log = getLogger(__name__)
 COLLECTION_SYNC_ROOT_FACTORY_NAME = "collectionSyncRootFolderItemFactory"
+# Seconds subtracted from the last sync date when catching up, to cover
+# clock differences between the server nodes and the database
+CATCH_UP_MARGIN = 600
+# Audit events of documents moved, deleted or not accessible anymore, which
+# keep their modification date
+CATCH_UP_EVENTS = (
+    "documentMoved",
+    "documentRemoved",
+    "documentSecurityUpdated",
+    "documentTrashed",
+    "lifecycle_transition_event",
+)
+# Seconds during which an interrupted full scan is resumed rather than
+# restarted, changes done meanwhile being then replayed from its start
+SCAN_CHECKPOINT_TTL = 24 * 3600
+
+
+class ScrollBatchSize:
+    """
+    Size of the batches of a scroll, adapted to the server response time.
+    Batches grow while they come quicker than the target duration, and
+    shrink when they are slower, within the given bounds.
+    """
+
+    # Seconds a batch should take to come
+    target = 1.0
+
+    def __init__(self, min_size: int, max_size: int) -> None:
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.size = self.min_size
+
+    def update(self, count: int, size: int, elapsed: float) -> None:
+        """ Adapt the size after *count* items came in *elapsed* seconds. """
+        if count < size and elapsed < self.target:
+            # A partial batch, nothing to learn
+            return
+        ratio = min(2.0, max(0.5, self.target / max(elapsed, 0.001)))
+        self.size = int(min(self.max_size, max(self.min_size, size * ratio)))
+
+
+class PollingInterval:
+    """
+    Seconds between two polls of the server for changes.
+    The interval halves, down to *floor*, while there are changes, remote or
+    local. Without any, it comes back to *delay*, then doubles on each
+    consecutive empty poll, up to *ceiling*. Some jitter is added so that
+    clients started at the same time do not poll at the same time.
+    """
+
+    # Maximum part of the interval added or removed at random
+    jitter = 0.1
+
+    def __init__(self, delay: int, floor: int, ceiling: int) -> None:
+        self.delay = max(1, delay)
+        self.floor = max(1, min(floor, self.delay))
+        self.ceiling = max(ceiling, self.delay)
+        self.interval = float(self.delay)
+
+    def update(self, changes: bool, empty_polls: int) -> None:
+        """ Adapt the interval after a poll. """
+        if changes:
+            self.interval = max(self.floor, self.interval / 2)
+        elif empty_polls > 0:
+            backoff = self.delay * 2 ** min(empty_polls - 1, 16)
+            self.interval = float(min(self.ceiling, backoff))
+
+    def next(self) -> float:
+        """ Seconds to wait before the next poll. """
+        return self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
 
 
 class RemoteWatcher(EngineWorker):
@@ -34,6 +109,7 @@ class RemoteWatcher(EngineWorker):
     def __init__(self, engine: "Engine", dao: "EngineDAO", delay: int) -> None:
         super().__init__(engine, dao)
         self.server_interval = delay
+        self.polling = PollingInterval(delay, Options.min_delay, Options.max_delay)
 
         self._next_check = 0
         self._last_sync_date = int(self._dao.get_config("remote_last_sync_date", 0))
@@ -44,6 +120,8 @@ class RemoteWatcher(EngineWorker):
             "remote_last_root_definitions", ""
         )
         self._last_remote_full_scan = self._dao.get_config("remote_last_full_scan")
+        # Set while a full scan records its progress
+        self._checkpointing = False
         self._metrics = {
             "last_remote_scan_time": -1,
             "last_remote_update_time": -1,
@@ -57,6 +135,7 @@ class RemoteWatcher(EngineWorker):
         metrics["last_root_definitions"] = self._last_root_definitions
         metrics["last_remote_full_scan"] = self._last_remote_full_scan
         metrics["next_polling"] = self._next_check
+        metrics["polling_interval"] = self.polling.interval
         return {**metrics, **self._metrics}
 
     def _execute(self) -> None:
@@ -66,14 +145,29 @@ class RemoteWatcher(EngineWorker):
                 self._interact()
                 now = current_milli_time()
                 if self._next_check < now:
-                    self._next_check = now + self.server_interval * 1000
+                    next_check = now + int(self.polling.next() * 1000)
+                    self._next_check = next_check
                     if self._handle_changes(first_pass):
                         first_pass = False
+                        empty_polls = self._metrics["empty_polls"]
+                        self.polling.update(
+                            not empty_polls or self._is_busy(), empty_polls
+                        )
+                        # Unless a scan asked for an immediate poll meanwhile
+                        if self._next_check == next_check:
+                            self._next_check = now + int(self.polling.next() * 1000)
                 sleep(0.01)
         except ThreadInterrupt:
             self.remoteWatcherStopped.emit()
             raise
 
+    def _is_busy(self) -> bool:
+        """ Check if there are local changes to handle. """
+        metrics = self.engine.get_queue_manager().get_metrics()
+        if metrics["local_file_queue"] or metrics["local_folder_queue"]:
+            return True
+        return not self.engine.get_local_watcher().empty_events()
+
     @tooltip("Remote scanning")
     def _scan_remote(self, from_state: NuxeoDocumentInfo = None):
         """Recursively scan the bound remote folder looking for updates"""
@@ -82,6 +176,7 @@ class RemoteWatcher(EngineWorker):
         try:
             if from_state is None:
                 from_state = self._dao.get_state_from_local("/")
+            checkpoint = self._get_scan_checkpoint(from_state.remote_ref)
             remote_info = self.engine.remote.get_fs_info(from_state.remote_ref)
             self._dao.update_remote_state(
                 from_state,
@@ -95,11 +190,28 @@ class RemoteWatcher(EngineWorker):
             self._metrics["last_remote_scan_time"] = current_milli_time() - start_ms
             return
 
-        self._get_changes()
-        # recursive update
-        self._do_scan_remote(from_state, remote_info)
+        if checkpoint:
+            log.debug("Resuming the remote scan started at %s", checkpoint["started"])
+        else:
+            # Changes done while scanning are replayed from the scan start
+            self._dao.clean_scanned()
+            self._get_changes()
+            checkpoint = {
+                "ref": from_state.remote_ref,
+                "sync_date": self._last_sync_date,
+                "started": int(time()),
+            }
+            self._dao.update_config("remote_scan_checkpoint", json.dumps(checkpoint))
+
+        # recursive update, completed subtrees are recorded as scanned
+        self._checkpointing = True
+        try:
+            self._do_scan_remote(from_state, remote_info)
+        finally:
+            self._checkpointing = False
         self._last_remote_full_scan = datetime.utcnow()
         self._dao.update_config("remote_last_full_scan", self._last_remote_full_scan)
+        self._dao.delete_config("remote_scan_checkpoint")
         self._dao.clean_scanned()
         self._metrics["last_remote_scan_time"] = current_milli_time() - start_ms
         log.debug(
@@ -107,6 +219,27 @@ class RemoteWatcher(EngineWorker):
         )
         self.remoteScanFinished.emit()
 
+    def _get_scan_checkpoint(self, remote_ref: str) -> Optional[Dict[str, Any]]:
+        """
+        The checkpoint of an interrupted full scan of *remote_ref*, if it can
+        be trusted: no change summary was handled since, and it is recent
+        enough for the server to still know the changes done in between.
+        """
+        try:
+            checkpoint = json.loads(self._dao.get_config("remote_scan_checkpoint"))
+        except (TypeError, ValueError):
+            return None
+
+        if (
+            checkpoint.get("ref") != remote_ref
+            or checkpoint.get("sync_date") != self._last_sync_date
+            or not self._last_sync_date
+            or time() - checkpoint.get("started", 0) > SCAN_CHECKPOINT_TTL
+        ):
+            log.debug("Discarding the remote scan checkpoint %r", checkpoint)
+            return None
+        return checkpoint
+
     @pyqtSlot(str)
     def scan_pair(self, remote_path: str) -> None:
         self._dao.add_path_to_scan(str(remote_path))
@@ -215,102 +348,98 @@ class RemoteWatcher(EngineWorker):
         if remote_parent_path is None:
             return
 
-        # Detect recently deleted children
-        if moved:
-            db_descendants = self._dao.get_remote_descendants_from_ref(
-                doc_pair.remote_ref
-            )
-        else:
-            db_descendants = self._dao.get_remote_descendants(remote_parent_path)
-        descendants = {desc.remote_ref: desc for desc in db_descendants}
+        # Descendants are not loaded at once: each batch is joined with the
+        # pairs of its documents, the handled ones are recorded as scrolled
+        # and the remaining ones are deleted at the end.
+        # During a full scan, the ones handled by an interrupted scan are kept.
+        if not self._checkpointing:
+            self._dao.clean_scrolled()
 
-        to_process = []
-        scroll_id = None
-        batch_size = 100
-        t1 = None
+        def in_scope(pair: NuxeoDocumentInfo) -> bool:
+            # As the descendants queried from the database
+            path = pair.remote_parent_path or ""
+            if moved:
+                return doc_pair.remote_ref in path
+            return path.startswith(remote_parent_path)
 
-        while "Scrolling":
-            t0 = datetime.now()
-            if t1 is not None:
-                log.trace(
-                    "Local processing of descendants of %r (%s) took %s ms",
-                    remote_info.name,
-                    remote_info.uid,
-                    self._get_elapsed_time_milliseconds(t1, t0),
-                )
+        to_process = []
+        batch_size = ScrollBatchSize(
+            Options.min_scroll_batch_size, Options.max_scroll_batch_size
+        )
+        # Durations in ms: spent by the server, waited for and spent locally
+        scroll_metrics = {
+            "pages": 0,
+            "scroll_time": 0,
+            "wait_time": 0,
+            "processing_time": 0,
+        }
+        self._metrics["last_scroll"] = scroll_metrics
 
+        def scroll(scroll_id: Optional[str], size: int) -> Tuple[Any, int, float]:
             # Scroll through a batch of descendants
             log.trace(
                 "Scrolling through at most [%d] descendants of %r (%s)",
-                batch_size,
+                size,
                 remote_info.name,
                 remote_info.uid,
             )
-            scroll_res = self.engine.remote.scroll_descendants(
-                remote_info.uid, scroll_id, batch_size=batch_size
+            start = monotonic()
+            res = self.engine.remote.scroll_descendants(
+                remote_info.uid, scroll_id, batch_size=size
             )
-            t1 = datetime.now()
-            elapsed = self._get_elapsed_time_milliseconds(t0, t1)
-            descendants_info = scroll_res["descendants"]
-            if not descendants_info:
+            return res, size, monotonic() - start
+
+        # The next batch is fetched while the current one is handled
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Scroll")
+        future = executor.submit(scroll, None, batch_size.size)
+        try:
+            while "Scrolling":
+                t0 = monotonic()
+                scroll_res, size, elapsed = future.result()
+                scroll_metrics["wait_time"] += int((monotonic() - t0) * 1000)
+                scroll_metrics["scroll_time"] += int(elapsed * 1000)
+                descendants_info = scroll_res["descendants"]
+                if not descendants_info:
+                    log.trace(
+                        "Remote scroll request retrieved no descendants of %r"
+                        " (%s), took %d ms",
+                        remote_info.name,
+                        remote_info.uid,
+                        elapsed * 1000,
+                    )
+                    break
+
                 log.trace(
-                    "Remote scroll request retrieved no descendants of %r"
-                    " (%s), took %s ms",
+                    "Remote scroll request retrieved %d descendants of %r"
+                    " (%s), took %d ms",
+                    len(descendants_info),
                     remote_info.name,
                     remote_info.uid,
-                    elapsed,
+                    elapsed * 1000,
                 )
-                break
-
-            log.trace(
-                "Remote scroll request retrieved %d descendants of %r"
-                " (%s), took %s ms",
-                len(descendants_info),
-                remote_info.name,
-                remote_info.uid,
-                elapsed,
-            )
-            scroll_id = scroll_res["scroll_id"]
-
-            # Results are not necessarily sorted
-            descendants_info = sorted(descendants_info, key=lambda x: x.path)
-
-            # Handle descendants
-            for descendant_info in descendants_info:
-                if self.filtered(descendant_info):
-                    log.debug("Ignoring banned document %s", descendant_info)
-                    descendants.pop(descendant_info.uid, None)
-                    continue
-
-                if self._dao.is_filter(descendant_info.path):
-                    # Skip filtered document
-                    descendants.pop(descendant_info.uid, None)
-                    continue
-
-                log.trace("Handling remote descendant %r", descendant_info)
-                if descendant_info.uid in descendants:
-                    descendant_pair = descendants.pop(descendant_info.uid)
-                    if self._check_modified(descendant_pair, descendant_info):
-                        descendant_pair.remote_state = "modified"
-                    self._dao.update_remote_state(descendant_pair, descendant_info)
-                    continue
-
-                parent_pair = self._dao.get_normal_state_from_remote(
-                    descendant_info.parent_uid
+                scroll_metrics["pages"] += 1
+                batch_size.update(len(descendants_info), size, elapsed)
+                future = executor.submit(
+                    scroll, scroll_res["scroll_id"], batch_size.size
                 )
-                if not parent_pair:
-                    log.trace(
-                        "Cannot find parent pair of remote descendant,"
-                        " postponing processing of %s",
-                        descendant_info,
-                    )
-                    to_process.append(descendant_info)
-                    continue
 
-                self._find_remote_child_match_or_create(parent_pair, descendant_info)
+                t1 = monotonic()
+                self._handle_scrolled(descendants_info, in_scope, to_process)
+                processing = int((monotonic() - t1) * 1000)
+                scroll_metrics["processing_time"] += processing
+                log.trace(
+                    "Local processing of descendants of %r (%s) took %d ms",
+                    remote_info.name,
+                    remote_info.uid,
+                    processing,
+                )
 
-            # Check if synchronization thread was suspended
-            self._interact()
+                # Check if synchronization thread was suspended
+                self._interact()
+        finally:
+            future.cancel()
+            executor.shutdown(wait=False)
+        scroll_metrics["batch_size"] = batch_size.size
 
         if to_process:
             t0 = datetime.now()
@@ -321,6 +450,7 @@ class RemoteWatcher(EngineWorker):
                 remote_info.name,
                 remote_info.uid,
             )
+            handled = []
             for descendant_info in to_process:
                 parent_pair = self._dao.get_normal_state_from_remote(
                     descendant_info.parent_uid
@@ -334,6 +464,8 @@ class RemoteWatcher(EngineWorker):
                     continue
 
                 self._find_remote_child_match_or_create(parent_pair, descendant_info)
+                handled.append(descendant_info.uid)
+            self._dao.add_scrolled(handled)
 
             t1 = datetime.now()
             log.trace(
@@ -341,9 +473,88 @@ class RemoteWatcher(EngineWorker):
                 self._get_elapsed_time_milliseconds(t0, t1),
             )
 
-        # Delete remaining
-        for deleted in descendants.values():
+        # Delete remaining, parents first so that their subtree covers children
+        if moved:
+            deleted_pairs = self._dao.get_remote_descendants_from_ref(
+                doc_pair.remote_ref, not_scrolled=True
+            )
+        else:
+            deleted_pairs = self._dao.get_remote_descendants(
+                remote_parent_path, not_scrolled=True
+            )
+        for deleted in sorted(deleted_pairs, key=lambda p: p.local_path or ""):
             self._dao.delete_remote_state(deleted)
+        if self._checkpointing:
+            self._dao.add_path_scanned(remote_parent_path)
+        else:
+            self._dao.clean_scrolled()
+
+    def _handle_scrolled(
+        self,
+        descendants_info: List[RemoteFileInfo],
+        in_scope: Callable[[NuxeoDocumentInfo], bool],
+        to_process: List[RemoteFileInfo],
+    ) -> None:
+        """
+        Update the pairs of a batch of scrolled descendants, the ones
+        *in_scope* of the scroll, and record them as scrolled.
+        During a full scan, the ones already scrolled are skipped.
+        """
+        # Results are not necessarily sorted
+        descendants_info = sorted(descendants_info, key=lambda x: x.path)
+        if self._checkpointing:
+            scrolled = self._dao.get_scrolled([info.uid for info in descendants_info])
+            descendants_info = [
+                info for info in descendants_info if info.uid not in scrolled
+            ]
+
+        # Pairs of the batch documents and of their parents, in one query.
+        # Folders created by the batch are added to the parents.
+        refs = {info.uid for info in descendants_info}
+        refs.update(info.parent_uid for info in descendants_info)
+        states = self._dao.get_states_from_remotes(list(refs), partial=False)
+        parents = {ref: pairs[0] for ref, pairs in states.items()}
+        handled = []
+
+        for descendant_info in descendants_info:
+            if self.filtered(descendant_info):
+                log.debug("Ignoring banned document %s", descendant_info)
+                handled.append(descendant_info.uid)
+                continue
+
+            if self._dao.is_filter(descendant_info.path):
+                # Skip filtered document
+                handled.append(descendant_info.uid)
+                continue
+
+            log.trace("Handling remote descendant %r", descendant_info)
+            pairs = states.get(descendant_info.uid, [])
+            descendant_pair = next((pair for pair in pairs if in_scope(pair)), None)
+            if descendant_pair:
+                if self._check_modified(descendant_pair, descendant_info):
+                    descendant_pair.remote_state = "modified"
+                self._dao.update_remote_state(descendant_pair, descendant_info)
+                handled.append(descendant_info.uid)
+                continue
+
+            parent_pair = parents.get(descendant_info.parent_uid)
+            if not parent_pair:
+                log.trace(
+                    "Cannot find parent pair of remote descendant,"
+                    " postponing processing of %s",
+                    descendant_info,
+                )
+                to_process.append(descendant_info)
+                continue
+
+            descendant_pair, _ = self._find_remote_child_match_or_create(
+                parent_pair, descendant_info
+            )
+            if descendant_pair and descendant_pair.folderish:
+                parents[descendant_info.uid] = descendant_pair
+            handled.append(descendant_info.uid)
+
+        self._dao.add_scrolled(handled)
 
     @staticmethod
     def _get_elapsed_time_milliseconds(t0: datetime, t1: datetime) -> float:
@@ -361,19 +572,96 @@ class RemoteWatcher(EngineWorker):
 
         If force_recursion is True, recursion is done even on
         non newly created children.
+
+        Children of several folders are fetched at the same time, at most
+        Options.max_remote_scans, while this thread alone updates the database.
+        Fetched listings wait in memory to be handled, so no more than twice
+        that number of folders are submitted at a time.
+        A folder is marked as scanned once its whole subtree has been scanned.
         """
 
         remote_parent_path = self._init_scan_remote(doc_pair, remote_info)
         if remote_parent_path is None:
             return
 
-        # Check if synchronization thread was suspended
-        self._interact()
+        workers = max(1, Options.max_remote_scans)
+        executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="RemoteScan"
+        )
+        # Folders to fetch: (pair, info, remote_parent_path)
+        queued: Deque[Tuple[NuxeoDocumentInfo, Any, str]] = deque()
+        # Folders being fetched: future -> (pair, info, remote_parent_path)
+        running: Dict[Future, Tuple[NuxeoDocumentInfo, Any, str]] = {}
+        # Number of subfolders of a folder not yet fully scanned
+        pending: Dict[str, int] = {}
+        parents: Dict[str, Optional[str]] = {}
+
+        def fetch() -> None:
+            # The whole listing is received by the worker, not by this thread
+            while queued and len(running) < 2 * workers:
+                pair, info, path = queued.popleft()
+                future = executor.submit(self.engine.remote.get_fs_children, info.uid)
+                running[future] = (pair, info, path)
+
+        def scanned(path: Optional[str]) -> None:
+            # Mark the folder, then its ancestors whose subtree is complete
+            while path is not None and not pending[path]:
+                del pending[path]
+                self._dao.add_path_scanned(path)
+                path = parents.pop(path)
+                if path is not None:
+                    pending[path] -= 1
+
+        queued.append((doc_pair, remote_info, remote_parent_path))
+        parents[remote_parent_path] = None
+        try:
+            while queued or running:
+                fetch()
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pair, info, path = running.pop(future)
+
+                    # Check if synchronization thread was suspended
+                    self._interact()
+
+                    to_scan = self._handle_children(
+                        pair, path, future.result(), force_recursion
+                    )
+                    pending[path] = 0
+                    for child_pair, child_info in to_scan:
+                        if child_info.can_scroll_descendants:
+                            # Scrolled here while other folders are fetched
+                            self._do_scan_remote(
+                                child_pair, child_info, force_recursion=force_recursion
+                            )
+                            continue
+                        child_path = self._init_scan_remote(child_pair, child_info)
+                        if child_path is None:
+                            continue
+                        pending[path] += 1
+                        parents[child_path] = path
+                        queued.append((child_pair, child_info, child_path))
+                    scanned(path)
+        finally:
+            for future in running:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _handle_children(
+        self,
+        doc_pair: NuxeoDocumentInfo,
+        remote_parent_path: str,
+        children_info: Iterable[RemoteFileInfo],
+        force_recursion: bool,
+    ) -> List[Tuple[NuxeoDocumentInfo, RemoteFileInfo]]:
+        """
+        Update the pairs of the children of a folder.
+        Return the children folders to scan.
+        """
 
         # Detect recently deleted children
         db_children = self._dao.get_remote_children(doc_pair.remote_ref)
         children = {child.remote_ref: child for child in db_children}
-        children_info = self.engine.remote.get_fs_children(remote_info.uid)
 
         to_scan = []
         for child_info in children_info:
@@ -395,17 +683,18 @@ class RemoteWatcher(EngineWorker):
                     doc_pair, child_info
                 )
 
-            if (new_pair or force_recursion) and child_info.folderish:
+            if (
+                child_pair is not None
+                and (new_pair or force_recursion)
+                and child_info.folderish
+            ):
                 to_scan.append((child_pair, child_info))
 
-        # Delete remaining
-        for deleted in children.values():
+        # Delete remaining, parents first so that their subtree covers children
+        for deleted in sorted(children.values(), key=lambda p: p.local_path or ""):
             self._dao.delete_remote_state(deleted)
 
-        for folder in to_scan:
-            # TODO Optimize by multithreading this too ?
-            self._do_scan_remote(folder[0], folder[1], force_recursion=force_recursion)
-        self._dao.add_path_scanned(remote_parent_path)
+        return to_scan
 
     def _init_scan_remote(
         self, doc_pair: NuxeoDocumentInfo, remote_info: NuxeoDocumentInfo
@@ -674,12 +963,19 @@ class RemoteWatcher(EngineWorker):
     @tooltip("Handle remote changes")
     def _update_remote_states(self) -> None:
         """Incrementally update the state of documents from a change summary"""
+        root_definitions = self._last_root_definitions
+        last_event_log_id = self._last_event_log_id
+        last_sync_date = self._last_sync_date
         summary = self._get_changes()
         if summary["hasTooManyChanges"]:
             log.debug("Forced full scan by server")
             remote_path = "/"
+            # Kept until the catch up is done, to resume if it is interrupted
             self._dao.add_path_to_scan(remote_path)
             self._dao.update_config("remote_need_full_scan", remote_path)
+            if self._catch_up(root_definitions, last_sync_date, last_event_log_id):
+                self._dao.delete_path_to_scan(remote_path)
+                self._dao.delete_config("remote_need_full_scan")
             return
 
         if not summary["fileSystemChanges"]:
@@ -697,256 +993,60 @@ class RemoteWatcher(EngineWorker):
         self._metrics["empty_polls"] = 0
         self.changesFound.emit(n_changes)
 
-        # Scan events and update the related pair states
-        refreshed = set()
-        delete_queue = []
+        # Changes grouped by document, the most recent first
+        changes_by_ref: Dict[str, List[Dict[str, Any]]] = {}
         for change in sorted_changes:
-            # Check if synchronization thread was suspended
-            # TODO In case of pause or stop: save the last event id
-            self._interact()
-
-            log.trace("Processing event: %r", change)
+            changes_by_ref.setdefault(change["fileSystemItemId"], []).append(change)
 
-            event_id = change.get("eventId")
-            remote_ref = change["fileSystemItemId"]
-            processed = False
-            for refreshed_ref in refreshed:
-                if refreshed_ref.endswith(remote_ref):
-                    processed = True
-                    break
-
-            if processed:
-                # A more recent version was already processed
-                continue
-            fs_item = change.get("fileSystemItem")
-            new_info = RemoteFileInfo.from_dict(fs_item) if fs_item else None
+        # Possibly fetch multiple doc pairs as the same doc
+        # can be synchronized in 2 places,
+        # typically if under a sync root and locally edited.
+        # See https://jira.nuxeo.com/browse/NXDRIVE-125
+        # Pairs of all documents are fetched at once.
+        states = self._dao.get_states_from_remotes(list(changes_by_ref))
 
-            if self.filtered(new_info):
-                log.debug("Ignoring banned file: %r", new_info)
-                continue
+        # Check if synchronization thread was suspended
+        # TODO In case of pause or stop: save the last event id
+        self._interact()
 
-            # Possibly fetch multiple doc pairs as the same doc
-            # can be synchronized in 2 places,
-            # typically if under a sync root and locally edited.
-            # See https://jira.nuxeo.com/browse/NXDRIVE-125
-            doc_pairs = self._dao.get_states_from_remote(remote_ref)
-            if not doc_pairs:
-                # Relax constraint on factory name in FileSystemItem id to
-                # match 'deleted' or 'securityUpdated' events.
-                # See https://jira.nuxeo.com/browse/NXDRIVE-167
-                doc_pair = self._dao.get_first_state_from_partial_remote(remote_ref)
-                if doc_pair is not None:
-                    doc_pairs = [doc_pair]
-
-            updated = False
-            doc_pairs = doc_pairs or []
-            for doc_pair in doc_pairs:
-                doc_pair_repr = (
-                    doc_pair.local_path
-                    if doc_pair.local_path is not None
-                    else doc_pair.remote_name
-                )
-                if event_id == "deleted":
-                    if fs_item is None:
-                        if doc_pair.local_path == "":
-                            log.debug("Delete pair from duplicate: %r", doc_pair)
-                            self._dao.remove_state(doc_pair, remote_recursion=True)
-                            continue
-                        log.debug("Push doc_pair %r in delete queue", doc_pair_repr)
-                        delete_queue.append(doc_pair)
-                    else:
-                        log.debug(
-                            "Ignore delete on doc_pair %r as a fsItem is attached",
-                            doc_pair_repr,
-                        )
-                        # To ignore completely put updated to true
-                        updated = True
-                        break
-                elif fs_item is None:
-                    if event_id == "securityUpdated":
-                        log.debug(
-                            "Security has been updated for"
-                            " doc_pair %r denying Read access,"
-                            " marking it as deleted",
-                            doc_pair_repr,
-                        )
-                        self._dao.delete_remote_state(doc_pair)
-                    else:
-                        log.warning("Unknown event: %r", event_id)
-                else:
-                    remote_parent_factory = doc_pair.remote_parent_ref.split("#", 1)[0]
-                    new_info_parent_factory = new_info.parent_uid.split("#", 1)[0]
-                    # Specific cases of a move on a locally edited doc
-                    if (
-                        remote_parent_factory == COLLECTION_SYNC_ROOT_FACTORY_NAME
-                        and event_id == "documentMoved"
+        # Scan events and update the related pair states.
+        # Refreshed references, by document ID, as partial references of
+        # 'deleted' or 'securityUpdated' events only end like the full ones.
+        # See https://jira.nuxeo.com/browse/NXDRIVE-167
+        refreshed: Dict[str, Set[str]] = {}
+        delete_queue = []
+        # Scans of moved folders, done once the updates are committed
+        to_scan: List[Tuple[Any, ...]] = []
+        # Set when other pairs than the ones of a change may have been modified
+        stale = False
+        with self._dao.transaction():
+            for remote_ref, changes in changes_by_ref.items():
+                # Prefetched and cached infos of the document are outdated
+                self.engine.prefetcher.forget(remote_ref)
+                self.engine.remote.forget_doc(remote_ref)
+                doc_id = remote_ref.rsplit("#", 1)[-1]
+                for change in changes:
+                    log.trace("Processing event: %r", change)
+                    if any(
+                        ref.endswith(remote_ref) for ref in refreshed.get(doc_id, ())
                     ):
-                        # If moved from a non sync root to a sync root,
-                        # break to creation case (updated is False).
-                        # If moved from a sync root to a non sync root,
-                        # break to noop (updated is True).
+                        # A more recent version was already processed
                         break
-                    elif (
-                        new_info_parent_factory == COLLECTION_SYNC_ROOT_FACTORY_NAME
-                        and event_id == "documentMoved"
-                    ):
-                        # If moved from a sync root to a non sync root,
-                        # delete from local sync root
-                        log.debug("Marking doc_pair %r as deleted", doc_pair_repr)
-                        self._dao.delete_remote_state(doc_pair)
-                    else:
-                        """
-                        Make new_info consistent with actual doc pair parent
-                        path for a doc member of a collection (typically the
-                        Locally Edited one) that is also under a sync root.
-                        Indeed, in this case, when adapted as a FileSystemItem,
-                        its parent path will be the one of the sync root because
-                        it takes precedence over the collection, see
-                        AbstractDocumentBackedFileSystemItem constructor.
-                        """
-                        consistent_new_info = new_info
-                        if remote_parent_factory == COLLECTION_SYNC_ROOT_FACTORY_NAME:
-                            consistent_new_info = RemoteFileInfo(
-                                name=new_info.name,
-                                uid=new_info.uid,
-                                parent_uid=doc_pair.remote_parent_ref,
-                                path=doc_pair.remote_parent_path + "/" + remote_ref,
-                                folderish=new_info.folderish,
-                                last_modification_time=new_info.last_modification_time,
-                                creation_time=new_info.creation_time,
-                                last_contributor=new_info.last_contributor,
-                                digest=new_info.digest,
-                                digest_algorithm=new_info.digest_algorithm,
-                                download_url=new_info.download_url,
-                                can_rename=new_info.can_rename,
-                                can_delete=new_info.can_delete,
-                                can_update=new_info.can_update,
-                                can_create_child=new_info.can_create_child,
-                                lock_owner=new_info.lock_owner,
-                                lock_created=new_info.lock_created,
-                                can_scroll_descendants=new_info.can_scroll_descendants,
-                            )
-                        # Perform a regular document update on a document
-                        # that has been updated, renamed or moved
-                        log.debug(
-                            "Refreshing remote state info for "
-                            "doc_pair=%r, event_id=%r, new_info=%r "
-                            "(force_recursion=%d)",
-                            doc_pair_repr,
-                            event_id,
-                            new_info,
-                            event_id == "securityUpdated",
-                        )
-
-                        # Force remote state update in case of a
-                        # locked / unlocked event since lock info is not
-                        # persisted, so not part of the dirty check
-                        lock_update = event_id in {"documentLocked", "documentUnlocked"}
-
-                        # Perform a regular document update on a document
-                        # that has been updated, renamed or moved
-
-                        if doc_pair.remote_state != "created" and any(
-                            (
-                                new_info.digest != doc_pair.remote_digest,
-                                safe_filename(new_info.name) != doc_pair.remote_name,
-                                new_info.parent_uid != doc_pair.remote_parent_ref,
-                                event_id == "securityUpdated",
-                                lock_update,
-                            )
-                        ):
-                            doc_pair.remote_state = "modified"
 
-                        log.debug(
-                            "Refreshing remote state info for doc_pair=%r,"
-                            " event_id=%r, new_info=%r (force_recursion=%d)",
-                            doc_pair,
-                            event_id,
-                            new_info,
-                            event_id == "securityUpdated",
-                        )
-
-                        remote_parent_path = os.path.dirname(new_info.path)
-                        # TODO Add modify local_path and local_parent_path
-                        # if needed
-                        self._dao.update_remote_state(
-                            doc_pair,
-                            new_info,
-                            remote_parent_path=remote_parent_path,
-                            force_update=lock_update,
-                        )
+                    doc_pairs = states.get(remote_ref, [])
+                    if stale:
+                        doc_pairs = [
+                            self._dao.get_state_from_id(doc_pair.id)
+                            for doc_pair in doc_pairs
+                        ]
+                        doc_pairs = [doc_pair for doc_pair in doc_pairs if doc_pair]
 
-                        if doc_pair.folderish:
-                            if (
-                                event_id == "securityUpdated"
-                                and not doc_pair.remote_can_create_child
-                                and new_info.can_create_child
-                            ):
-                                log.debug("Force local scan after permissions change")
-                                self._dao.unset_unsychronised(doc_pair)
-
-                            log.trace(
-                                "Force scan recursive on %r, permissions change=%r",
-                                doc_pair,
-                                event_id == "securityUpdated",
-                            )
-                            self._force_remote_scan(
-                                doc_pair,
-                                consistent_new_info,
-                                remote_path=new_info.path,
-                                force_recursion=event_id == "securityUpdated",
-                                moved=event_id == "documentMoved",
-                            )
-
-                        if lock_update:
-                            doc_pair = self._dao.get_state_from_id(doc_pair.id)
-                            try:
-                                self._handle_readonly(doc_pair)
-                            except OSError as exc:
-                                log.trace(
-                                    "Cannot handle readonly for %r (%r)", doc_pair, exc
-                                )
-
-                pair = self._dao.get_state_from_id(doc_pair.id)
-                self.engine.manager.osi.send_sync_status(
-                    pair, self.engine.local.abspath(pair.local_path)
-                )
-
-                updated = True
-                refreshed.add(remote_ref)
-
-            if new_info and not updated:
-                # Handle new document creations
-                created = False
-                parent_pairs = self._dao.get_states_from_remote(new_info.parent_uid)
-                for parent_pair in parent_pairs:
-                    child_pair, new_pair = self._find_remote_child_match_or_create(
-                        parent_pair, new_info
+                    stale |= self._apply_change(
+                        change, remote_ref, doc_pairs, refreshed, delete_queue, to_scan
                     )
-                    if new_pair:
-                        log.debug(
-                            "Marked doc_pair %r as remote creation",
-                            child_pair.remote_name,
-                        )
 
-                    if child_pair and child_pair.folderish and new_pair:
-                        log.debug(
-                            "Remote recursive scan of the content of %r",
-                            child_pair.remote_name,
-                        )
-                        remote_path = child_pair.remote_parent_path + "/" + new_info.uid
-                        self._force_remote_scan(child_pair, new_info, remote_path)
-
-                    created = True
-                    refreshed.add(remote_ref)
-                    break
-
-                if not created:
-                    log.debug(
-                        "Could not match changed document to a bound "
-                        "local folder: %r",
-                        new_info,
-                    )
+        for args in to_scan:
+            self._force_remote_scan(*args)
 
         # Sort by path the deletion to only mark parent
         sorted_deleted = sorted(delete_queue, key=lambda x: x.local_path)
@@ -972,8 +1072,366 @@ class RemoteWatcher(EngineWorker):
                 continue
 
             delete_processed.append(delete_pair)
-            log.debug("Marking doc_pair %r as deleted", delete_pair)
-            self._dao.delete_remote_state(delete_pair)
+
+        with self._dao.transaction():
+            for delete_pair in delete_processed:
+                log.debug("Marking doc_pair %r as deleted", delete_pair)
+                self._dao.delete_remote_state(delete_pair)
+
+    def _catch_up(
+        self, root_definitions: str, last_sync_date: int, last_event_log_id: int
+    ) -> bool:
+        """
+        Catch up with the server without scanning everything when the change
+        summary is incomplete. Added and removed synchronization roots are
+        scanned, and in the other ones only the folders of documents modified
+        since the last synchronization, or moved, deleted or hidden since.
+        Return False when a full scan is still needed.
+        """
+        if not (last_sync_date and last_event_log_id and self._last_event_log_id):
+            return False
+
+        before = set(filter(None, root_definitions.split(",")))
+        after = set(filter(None, self._last_root_definitions.split(",")))
+        repository = self.engine.remote.client.repository
+        roots = []
+        for definition in before & after:
+            root_repository, _, uid = definition.partition(":")
+            if root_repository != repository:
+                # Documents are queried in the current repository only
+                return False
+            roots.append(uid)
+
+        start_ms = current_milli_time()
+        if before != after:
+            # New roots are created and scanned, removed ones deleted
+            log.debug("Synchronization roots changed, scanning the top level")
+            top_pair = self._dao.get_state_from_local("/")
+            top_info = self.engine.remote.get_fs_info(top_pair.remote_ref)
+            self._scan_remote_recursive(top_pair, top_info, force_recursion=False)
+
+        if roots:
+            since = max(0, last_sync_date // 1000 - CATCH_UP_MARGIN)
+            parents: Set[str] = set()
+            try:
+                for doc in self.engine.remote.get_modified_documents(roots, since):
+                    parents.add("{}#{}".format(doc["repository"], doc["parentRef"]))
+                    self._interact()
+                parents.update(
+                    "{}#{}".format(repository, uid)
+                    for uid in self._get_moved_or_deleted(roots, last_event_log_id)
+                )
+            except (BadQuery, HTTPError, NotFound):
+                log.warning("Cannot query modified documents", exc_info=True)
+                return False
+
+            log.debug("Catching up with %d modified folders", len(parents))
+            states = self._dao.get_states_from_remotes(list(parents))
+            folders = [pairs[0] for pairs in states.values() if pairs[0].folderish]
+            for doc_pair in sorted(folders, key=lambda p: p.local_path or ""):
+                try:
+                    remote_info = self.engine.remote.get_fs_info(doc_pair.remote_ref)
+                except NotFound:
+                    # Removed since, its parent is rescanned too
+                    continue
+                self._scan_remote_recursive(
+                    doc_pair, remote_info, force_recursion=False
+                )
+
+        self._dao.clean_scanned()
+        self._metrics["last_catch_up_time"] = current_milli_time() - start_ms
+        return True
+
+    def _get_moved_or_deleted(
+        self, roots: List[str], last_event_log_id: int
+    ) -> Set[str]:
+        """
+        Documents moved, deleted, or not accessible anymore, keep their
+        modification date. They are found in the audit since the
+        *last_event_log_id*: return the UIDs of the folders they were removed
+        from or added to under the *roots*.
+        """
+        remote = self.engine.remote
+        repository = remote.client.repository
+        root_paths = tuple(remote.fetch(uid)["path"].rstrip("/") + "/" for uid in roots)
+        parents: Set[str] = set()
+        # Paths of the folders documents were moved to
+        moved_to: Set[str] = set()
+        batch: Set[str] = set()
+
+        def add_known_parents() -> None:
+            # Folders of the known documents, and the documents themselves
+            # for their children to be checked too
+            refs = ["{}#{}".format(repository, uid) for uid in batch]
+            for pairs in self._dao.get_states_from_remotes(refs).values():
+                for pair in pairs:
+                    parents.add(pair.remote_parent_ref.rsplit("#", 1)[-1])
+                    if pair.folderish:
+                        parents.add(pair.remote_ref.rsplit("#", 1)[-1])
+            batch.clear()
+
+        entries = remote.get_audit_entries(
+            CATCH_UP_EVENTS, last_event_log_id, self._last_event_log_id
+        )
+        for entry in entries:
+            batch.add(entry["docUUID"])
+            path = entry.get("docPath") or ""
+            if entry["eventId"] == "documentMoved" and path.startswith(root_paths):
+                moved_to.add(path.rsplit("/", 1)[0])
+            if len(batch) >= 500:
+                add_known_parents()
+            self._interact()
+        add_known_parents()
+
+        for path in moved_to:
+            try:
+                parents.add(remote.fetch(path)["uid"])
+            except NotFound:
+                # Moved or deleted again since, it has a later entry
+                continue
+        parents.discard("")
+        return parents
+
+    def _apply_change(
+        self,
+        change: Dict[str, Any],
+        remote_ref: str,
+        doc_pairs: List[NuxeoDocumentInfo],
+        refreshed: Dict[str, Set[str]],
+        delete_queue: List[NuxeoDocumentInfo],
+        to_scan: List[Tuple[Any, ...]],
+    ) -> bool:
+        """
+        Update the pairs of a document from one of its changes.
+        Return True if other pairs may have been modified.
+        """
+        event_id = change.get("eventId")
+        fs_item = change.get("fileSystemItem")
+        new_info = RemoteFileInfo.from_dict(fs_item) if fs_item else None
+
+        if self.filtered(new_info):
+            log.debug("Ignoring banned file: %r", new_info)
+            return False
+
+        doc_id = remote_ref.rsplit("#", 1)[-1]
+        stale = False
+        updated = False
+        for doc_pair in doc_pairs:
+            doc_pair_repr = (
+                doc_pair.local_path
+                if doc_pair.local_path is not None
+                else doc_pair.remote_name
+            )
+            if event_id == "deleted":
+                if fs_item is None:
+                    if doc_pair.local_path == "":
+                        log.debug("Delete pair from duplicate: %r", doc_pair)
+                        self._dao.remove_state(doc_pair, remote_recursion=True)
+                        stale = True
+                        continue
+                    log.debug("Push doc_pair %r in delete queue", doc_pair_repr)
+                    delete_queue.append(doc_pair)
+                else:
+                    log.debug(
+                        "Ignore delete on doc_pair %r as a fsItem is attached",
+                        doc_pair_repr,
+                    )
+                    # To ignore completely put updated to true
+                    updated = True
+                    break
+            elif fs_item is None:
+                if event_id == "securityUpdated":
+                    log.debug(
+                        "Security has been updated for"
+                        " doc_pair %r denying Read access,"
+                        " marking it as deleted",
+                        doc_pair_repr,
+                    )
+                    self._dao.delete_remote_state(doc_pair)
+                    stale = True
+                else:
+                    log.warning("Unknown event: %r", event_id)
+            else:
+                remote_parent_factory = doc_pair.remote_parent_ref.split("#", 1)[0]
+                new_info_parent_factory = new_info.parent_uid.split("#", 1)[0]
+                # Specific cases of a move on a locally edited doc
+                if (
+                    remote_parent_factory == COLLECTION_SYNC_ROOT_FACTORY_NAME
+                    and event_id == "documentMoved"
+                ):
+                    # If moved from a non sync root to a sync root,
+                    # break to creation case (updated is False).
+                    # If moved from a sync root to a non sync root,
+                    # break to noop (updated is True).
+                    break
+                elif (
+                    new_info_parent_factory == COLLECTION_SYNC_ROOT_FACTORY_NAME
+                    and event_id == "documentMoved"
+                ):
+                    # If moved from a sync root to a non sync root,
+                    # delete from local sync root
+                    log.debug("Marking doc_pair %r as deleted", doc_pair_repr)
+                    self._dao.delete_remote_state(doc_pair)
+                    stale = True
+                else:
+                    """
+                    Make new_info consistent with actual doc pair parent
+                    path for a doc member of a collection (typically the
+                    Locally Edited one) that is also under a sync root.
+                    Indeed, in this case, when adapted as a FileSystemItem,
+                    its parent path will be the one of the sync root because
+                    it takes precedence over the collection, see
+                    AbstractDocumentBackedFileSystemItem constructor.
+                    """
+                    consistent_new_info = new_info
+                    if remote_parent_factory == COLLECTION_SYNC_ROOT_FACTORY_NAME:
+                        consistent_new_info = RemoteFileInfo(
+                            name=new_info.name,
+                            uid=new_info.uid,
+                            parent_uid=doc_pair.remote_parent_ref,
+                            path=doc_pair.remote_parent_path + "/" + remote_ref,
+                            folderish=new_info.folderish,
+                            last_modification_time=new_info.last_modification_time,
+                            creation_time=new_info.creation_time,
+                            last_contributor=new_info.last_contributor,
+                            digest=new_info.digest,
+                            digest_algorithm=new_info.digest_algorithm,
+                            download_url=new_info.download_url,
+                            can_rename=new_info.can_rename,
+                            can_delete=new_info.can_delete,
+                            can_update=new_info.can_update,
+                            can_create_child=new_info.can_create_child,
+                            lock_owner=new_info.lock_owner,
+                            lock_created=new_info.lock_created,
+                            can_scroll_descendants=new_info.can_scroll_descendants,
+                        )
+                    # Perform a regular document update on a document
+                    # that has been updated, renamed or moved
+                    log.debug(
+                        "Refreshing remote state info for "
+                        "doc_pair=%r, event_id=%r, new_info=%r "
+                        "(force_recursion=%d)",
+                        doc_pair_repr,
+                        event_id,
+                        new_info,
+                        event_id == "securityUpdated",
+                    )
+
+                    # Force remote state update in case of a
+                    # locked / unlocked event since lock info is not
+                    # persisted, so not part of the dirty check
+                    lock_update = event_id in {"documentLocked", "documentUnlocked"}
+
+                    # Perform a regular document update on a document
+                    # that has been updated, renamed or moved
+
+                    if doc_pair.remote_state != "created" and any(
+                        (
+                            new_info.digest != doc_pair.remote_digest,
+                            safe_filename(new_info.name) != doc_pair.remote_name,
+                            new_info.parent_uid != doc_pair.remote_parent_ref,
+                            event_id == "securityUpdated",
+                            lock_update,
+                        )
+                    ):
+                        doc_pair.remote_state = "modified"
+
+                    log.debug(
+                        "Refreshing remote state info for doc_pair=%r,"
+                        " event_id=%r, new_info=%r (force_recursion=%d)",
+                        doc_pair,
+                        event_id,
+                        new_info,
+                        event_id == "securityUpdated",
+                    )
+
+                    remote_parent_path = os.path.dirname(new_info.path)
+                    # TODO Add modify local_path and local_parent_path
+                    # if needed
+                    self._dao.update_remote_state(
+                        doc_pair,
+                        new_info,
+                        remote_parent_path=remote_parent_path,
+                        force_update=lock_update,
+                    )
+
+                    if doc_pair.folderish:
+                        if (
+                            event_id == "securityUpdated"
+                            and not doc_pair.remote_can_create_child
+                            and new_info.can_create_child
+                        ):
+                            log.debug("Force local scan after permissions change")
+                            self._dao.unset_unsychronised(doc_pair)
+                            stale = True
+
+                        log.trace(
+                            "Force scan recursive on %r, permissions change=%r",
+                            doc_pair,
+                            event_id == "securityUpdated",
+                        )
+                        to_scan.append(
+                            (
+                                doc_pair,
+                                consistent_new_info,
+                                new_info.path,
+                                event_id == "securityUpdated",
+                                event_id == "documentMoved",
+                            )
+                        )
+
+                    if lock_update:
+                        doc_pair = self._dao.get_state_from_id(doc_pair.id)
+                        try:
+                            self._handle_readonly(doc_pair)
+                        except OSError as exc:
+                            log.trace(
+                                "Cannot handle readonly for %r (%r)", doc_pair, exc
+                            )
+
+            pair = self._dao.get_state_from_id(doc_pair.id)
+            self.engine.manager.osi.send_sync_status(
+                pair, self.engine.local.abspath(pair.local_path)
+            )
+
+            updated = True
+            refreshed.setdefault(doc_id, set()).add(remote_ref)
+
+        if new_info and not updated:
+            # Handle new document creations
+            created = False
+            parent_pairs = self._dao.get_states_from_remote(new_info.parent_uid)
+            for parent_pair in parent_pairs:
+                child_pair, new_pair = self._find_remote_child_match_or_create(
+                    parent_pair, new_info
+                )
+                if new_pair:
+                    log.debug(
+                        "Marked doc_pair %r as remote creation", child_pair.remote_name
+                    )
+                elif new_pair is False:
+                    # An existing pair was bound to the document
+                    stale = True
+
+                if child_pair and child_pair.folderish and new_pair:
+                    log.debug(
+                        "Remote recursive scan of the content of %r",
+                        child_pair.remote_name,
+                    )
+                    remote_path = child_pair.remote_parent_path + "/" + new_info.uid
+                    self._force_remote_scan(child_pair, new_info, remote_path)
+
+                created = True
+                refreshed.setdefault(doc_id, set()).add(remote_ref)
+                break
+
+            if not created:
+                log.debug(
+                    "Could not match changed document to a bound local folder: %r",
+                    new_info,
+                )
+
+        return stale
 
     def filtered(self, info: NuxeoDocumentInfo) -> bool:
         """ Check if a remote document is locally ignored. """
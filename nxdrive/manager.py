@@ -13,6 +13,7 @@ from PyQt5.sip import SIP_VERSION_STR
 
 from . import __version__
 from .client.local_client import LocalClient
+from .client.pool import shared_pools
 from .client.proxy import get_proxy, load_proxy, save_proxy, validate_proxy
 from .constants import APP_NAME, MAC, WINDOWS
 from .exceptions import EngineTypeMissing, FolderAlreadyUsed
@@ -87,6 +88,11 @@ class Manager(QObject):
 
         self._engine_types = {"NXDRIVE": Engine, "NXDRIVENEXT": EngineNext}
         self._engines = {}
+
+        # Transfers and digest computations slots shared by all engines
+        self._create_scheduler()
+        self._create_transfer_service()
+        self._create_blob_cache()
         self.updater = None
         self.server_config_updater = None
 
@@ -186,6 +192,10 @@ class Manager(QObject):
             "python_version": platform.python_version(),
             "platform": platform.system(),
             "appname": self.app_name,
+            "scheduler": self.scheduler.get_metrics(),
+            "transfers": self.transfers.get_metrics() if self.transfers else None,
+            "blob_cache": self.blob_cache.get_metrics() if self.blob_cache else None,
+            "connections": shared_pools.get_metrics(),
         }
 
     def open_help(self) -> None:
@@ -229,6 +239,37 @@ class Manager(QObject):
 
         self._dao = ManagerDAO(self._get_db())
 
+    def _create_scheduler(self) -> None:
+        from .engine.scheduler import Scheduler
+
+        self.scheduler = Scheduler(
+            max_transfers=Options.max_transfers, max_hashing=Options.max_hashing
+        )
+
+    def _create_transfer_service(self) -> None:
+        self.transfers = None
+        if not Options.async_transfers:
+            return
+
+        from .engine.transfer import TransferService
+
+        if not TransferService.is_available():
+            log.warning("aiohttp is not installed, transfers will be synchronous")
+            return
+        self.transfers = TransferService()
+
+    def _create_blob_cache(self) -> None:
+        self.blob_cache = None
+        if Options.blob_cache_size <= 0:
+            return
+
+        from .client.blob_cache import BlobCache
+
+        self.blob_cache = BlobCache(
+            os.path.join(normalized_path(self.nxdrive_home), "blobs"),
+            Options.blob_cache_size * 1024 ** 2,
+        )
+
     def _create_server_config_updater(self) -> None:
         if not Options.update_check_delay:
             return
@@ -293,12 +334,16 @@ class Manager(QObject):
             if engine.is_started():
                 log.debug("Stop engine %s", uid)
                 engine.stop()
+        if euid is None and self.transfers:
+            self.transfers.stop()
         if MAC:
             self.osi._cleanup()
         self.stopped.emit()
 
     def start(self, euid: str = None) -> None:
         self._started = True
+        if self.transfers:
+            self.transfers.start()
         for uid, engine in list(self._engines.items()):
             if euid is not None and euid != uid:
                 continue
@@ -601,6 +646,7 @@ class Manager(QObject):
         self.osi.unwatch_folder(self._engines[uid].local_folder)
         self._engines[uid].suspend()
         self._engines[uid].unbind()
+        self.scheduler.unregister(uid)
         self._dao.delete_engine(uid)
         # Refresh the engines definition
         del self._engines[uid]
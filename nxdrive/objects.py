@@ -2,9 +2,9 @@
 import hashlib
 import unicodedata
 from collections import namedtuple
-from datetime import datetime
+from datetime import datetime, timezone
 from sqlite3 import Cursor
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterable, List, Tuple
 
 from dateutil import parser
 
@@ -24,6 +24,38 @@ Filters = List[Tuple[str]]
 Metrics = Dict[str, Any]
 
 
+def parse_date(value: str) -> datetime:
+    """
+    Parse a date sent by the server into a naive UTC datetime.
+    The format used by the server, like "2018-09-12T13:41:12.123Z", is
+    decoded directly, other ones by dateutil.
+    """
+    if (
+        len(value) in {20, 24}
+        and value[-1] == "Z"
+        and value[4] == value[7] == "-"
+        and value[10] == "T"
+        and value[13] == value[16] == ":"
+    ):
+        try:
+            return datetime(
+                int(value[:4]),
+                int(value[5:7]),
+                int(value[8:10]),
+                int(value[11:13]),
+                int(value[14:16]),
+                int(value[17:19]),
+                int(value[20:23]) * 1000 if len(value) == 24 else 0,
+            )
+        except ValueError:
+            pass
+
+    date = parser.parse(value)
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
 class SlotInfo:
     __slots__ = ()
 
@@ -112,26 +144,33 @@ class RemoteFileInfo(SlotInfo):
         if name:
             name = unicodedata.normalize("NFC", name)
 
-        return RemoteFileInfo(
-            name=name,
-            uid=fs_item["id"],
-            parent_uid=fs_item["parentId"],
-            path=fs_item["path"],
-            folderish=folderish,
-            last_modification_time=last_update,
-            creation_time=creation,
-            last_contributor=last_contributor,
-            digest=digest,
-            digest_algorithm=digest_algorithm,
-            download_url=download_url,
-            can_rename=fs_item["canRename"],
-            can_delete=fs_item["canDelete"],
-            can_update=can_update,
-            can_create_child=can_create_child,
-            lock_owner=lock_owner,
-            lock_created=lock_created,
-            can_scroll_descendants=can_scroll_descendants,
-        )
+        # Slots are set directly, decoding is on the path of every remote scan
+        info = RemoteFileInfo.__new__(RemoteFileInfo)
+        info.name = name
+        info.uid = fs_item["id"]
+        info.parent_uid = fs_item["parentId"]
+        info.path = fs_item["path"]
+        info.folderish = folderish
+        info.last_modification_time = last_update
+        info.creation_time = creation
+        info.last_contributor = last_contributor
+        info.digest = digest
+        info.digest_algorithm = digest_algorithm
+        info.download_url = download_url
+        info.can_rename = fs_item["canRename"]
+        info.can_delete = fs_item["canDelete"]
+        info.can_update = can_update
+        info.can_create_child = can_create_child
+        info.lock_owner = lock_owner
+        info.lock_created = lock_created
+        info.can_scroll_descendants = can_scroll_descendants
+        return info
+
+    @staticmethod
+    def from_dicts(fs_items: Iterable[Dict[str, Any]]) -> List["RemoteFileInfo"]:
+        """ Convert a list of file system items, like a scroll page. """
+        from_dict = RemoteFileInfo.from_dict
+        return [from_dict(fs_item) for fs_item in fs_items]
 
 
 # Data Transfer Object for doc info on the Remote Nuxeo repository
@@ -166,13 +205,7 @@ class NuxeoDocumentInfo(SlotInfo):
         name = props["dc:title"]
         filename = None
         folderish = "Folderish" in doc["facets"]
-        try:
-            last_update = datetime.strptime(
-                doc["lastModified"], "%Y-%m-%dT%H:%M:%S.%fZ"
-            )
-        except ValueError:
-            # no millisecond?
-            last_update = datetime.strptime(doc["lastModified"], "%Y-%m-%dT%H:%M:%SZ")
+        last_update = parse_date(doc["lastModified"])
 
         # TODO: support other main files
         has_blob = False
@@ -215,7 +248,7 @@ class NuxeoDocumentInfo(SlotInfo):
         lock_owner = doc.get("lockOwner")
         lock_created = doc.get("lockCreated")
         if lock_created is not None:
-            lock_created = parser.parse(lock_created)
+            lock_created = parse_date(lock_created).replace(tzinfo=timezone.utc)
 
         # Permissions
         permissions = doc.get("contextParameters", {}).get("permissions", None)
@@ -234,25 +267,26 @@ class NuxeoDocumentInfo(SlotInfo):
             version = None
         if name is not None:
             name = unicodedata.normalize("NFC", name)
-        return NuxeoDocumentInfo(
-            root=doc["root"],
-            name=name,
-            uid=doc["uid"],
-            parent_uid=parent_uid,
-            path=doc["path"],
-            folderish=folderish,
-            last_modification_time=last_update,
-            last_contributor=props["dc:lastContributor"],
-            digest_algorithm=digest_algorithm,
-            digest=digest,
-            repository=doc["repository"],
-            doc_type=doc["type"],
-            version=version,
-            state=doc["state"],
-            is_trashed=is_trashed,
-            has_blob=has_blob,
-            filename=filename,
-            lock_owner=lock_owner,
-            lock_created=lock_created,
-            permissions=permissions,
-        )
+
+        info = NuxeoDocumentInfo.__new__(NuxeoDocumentInfo)
+        info.root = doc["root"]
+        info.name = name
+        info.uid = doc["uid"]
+        info.parent_uid = parent_uid
+        info.path = doc["path"]
+        info.folderish = folderish
+        info.last_modification_time = last_update
+        info.last_contributor = props["dc:lastContributor"]
+        info.digest_algorithm = digest_algorithm
+        info.digest = digest
+        info.repository = doc["repository"]
+        info.doc_type = doc["type"]
+        info.version = version
+        info.state = doc["state"]
+        info.is_trashed = is_trashed
+        info.has_blob = has_blob
+        info.filename = filename
+        info.lock_owner = lock_owner
+        info.lock_created = lock_created
+        info.permissions = permissions
+        return info
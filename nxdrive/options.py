@@ -111,15 +111,20 @@ class MetaOptions(type):
 
     # Default options
     options: Dict[str, Tuple[Any, str]] = {
+        "async_transfers": (False, "default"),
         "beta_channel": (False, "default"),
         "beta_update_site_url": (
             "https://community.nuxeo.com/static/drive-updates",
             "default",
         ),
+        "blob_cache_size": (512, "default"),
+        "ca_bundle": (None, "default"),
         "consider_ssl_errors": (True, "default"),
         "debug": (False, "default"),
         "debug_pydev": (False, "default"),
         "delay": (30, "default"),
+        "download_ranges": (4, "default"),
+        "download_split_threshold": (256, "default"),
         "force_locale": (None, "default"),
         "handshake_timeout": (60, "default"),
         "ignored_files": (__files, "default"),
@@ -130,8 +135,16 @@ class MetaOptions(type):
         "log_filename": (None, "default"),
         "log_level_console": ("INFO", "default"),
         "log_level_file": ("DEBUG", "default"),
+        "max_delay": (300, "default"),
         "max_errors": (3, "default"),
+        "max_hashing": (2, "default"),
+        "max_remote_scans": (4, "default"),
+        "max_scroll_batch_size": (1000, "default"),
         "max_sync_step": (10, "default"),
+        "max_transfers": (4, "default"),
+        "max_uploads": (4, "default"),
+        "min_delay": (5, "default"),
+        "min_scroll_batch_size": (100, "default"),
         "nxdrive_home": (
             os.path.join(os.path.expanduser("~"), ".nuxeo-drive"),
             "default",
@@ -152,6 +165,7 @@ class MetaOptions(type):
             "https://community.nuxeo.com/static/drive-updates",
             "default",
         ),
+        "upload_chunk_size": (20, "default"),
     }
 
     default_options = deepcopy(options)
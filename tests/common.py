@@ -199,6 +199,7 @@ class UnitTestCase(TestCase):
         os.mkdir(self.nxdrive_conf_folder_2)
 
         Options.delay = TEST_DEFAULT_DELAY
+        Options.max_delay = TEST_DEFAULT_DELAY
         Options.nxdrive_home = self.nxdrive_conf_folder_1
         self.manager_1 = Manager()
         self.connected = False
@@ -31,6 +31,7 @@ class BindServerTest(unittest.TestCase):
     @Options.mock()
     def test_bind_local_folder_on_config_folder(self):
         Options.delay = TEST_DEFAULT_DELAY
+        Options.max_delay = TEST_DEFAULT_DELAY
         Options.nxdrive_home = self.nxdrive_conf_folder
         self.manager = Manager()
         self.addCleanup(self.manager.unbind_all)
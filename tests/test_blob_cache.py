@@ -0,0 +1,82 @@
+# coding: utf-8
+import hashlib
+import os
+
+from nxdrive.client.blob_cache import BlobCache
+
+
+def make_file(folder, name, content):
+    path = os.path.join(str(folder), name)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path, hashlib.md5(content).hexdigest()
+
+
+def test_get_and_add(tmpdir):
+    cache = BlobCache(str(tmpdir.mkdir("cache")), 1024)
+    path, digest = make_file(tmpdir, "file.txt", b"content")
+    file_out = str(tmpdir.join("out.txt"))
+
+    assert not cache.get(digest, file_out)
+    cache.add(digest, path)
+    assert cache.get(digest, file_out)
+    with open(file_out, "rb") as f:
+        assert f.read() == b"content"
+
+    metrics = cache.get_metrics()
+    assert metrics["hits"] == 1
+    assert metrics["misses"] == 1
+    assert metrics["hit_ratio"] == 0.5
+    assert metrics["bytes_saved"] == 7
+    assert metrics["count"] == 1
+
+
+def test_wrong_digest(tmpdir):
+    cache = BlobCache(str(tmpdir.mkdir("cache")), 1024)
+    path, _ = make_file(tmpdir, "file.txt", b"content")
+
+    cache.add(hashlib.md5(b"other").hexdigest(), path)
+    cache.add("not a digest", path)
+    assert not len(cache)
+
+
+def test_damaged(tmpdir):
+    folder = tmpdir.mkdir("cache")
+    cache = BlobCache(str(folder), 1024)
+    path, digest = make_file(tmpdir, "file.txt", b"content")
+    cache.add(digest, path)
+
+    folder.join(digest).write(b"damaged")
+    file_out = str(tmpdir.join("out.txt"))
+    assert not cache.get(digest, file_out)
+    assert not os.path.exists(file_out)
+    assert not len(cache)
+
+
+def test_lru_eviction(tmpdir):
+    folder = tmpdir.mkdir("cache")
+    cache = BlobCache(str(folder), 10)
+    path1, digest1 = make_file(tmpdir, "1", b"12345")
+    path2, digest2 = make_file(tmpdir, "2", b"abcde")
+    path3, digest3 = make_file(tmpdir, "3", b"ABCDE")
+    file_out = str(tmpdir.join("out"))
+
+    cache.add(digest1, path1)
+    cache.add(digest2, path2)
+    assert cache.get(digest1, file_out)
+
+    # The second content is the least recently used
+    cache.add(digest3, path3)
+    assert not cache.get(digest2, file_out)
+    assert not folder.join(digest2).check()
+    assert cache.get_metrics()["size"] == 10
+
+    # Too big to be cached
+    path4, digest4 = make_file(tmpdir, "4", b"0123456789A")
+    cache.add(digest4, path4)
+    assert len(cache) == 2
+
+    # Contents are kept for the next run
+    cache = BlobCache(str(folder), 10)
+    assert len(cache) == 2
+    assert cache.get(digest3, file_out)
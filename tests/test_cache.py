@@ -0,0 +1,43 @@
+# coding: utf-8
+import time
+
+from nxdrive.client.cache import TTLCache
+
+
+def test_lru():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+
+    # "b" is the least recently used
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.get_metrics() == {"hits": 3, "misses": 1, "size": 2}
+
+
+def test_ttl():
+    cache = TTLCache(ttl=1)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    time.sleep(1.1)
+    assert cache.get("a", "expired") == "expired"
+    assert not len(cache)
+
+
+def test_disabled():
+    cache = TTLCache(ttl=0)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+
+
+def test_discard():
+    cache = TTLCache()
+    cache.set(("uid1", True), {"uid": "uid1"})
+    cache.set(("/path", True), {"uid": "uid1"})
+    cache.set(("uid2", True), {"uid": "uid2"})
+
+    assert cache.discard(lambda key, value: value["uid"] == "uid1") == 2
+    assert cache.get(("uid2", True)) == {"uid": "uid2"}
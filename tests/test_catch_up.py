@@ -0,0 +1,263 @@
+# coding: utf-8
+import re
+
+import pytest
+from nuxeo.exceptions import BadQuery, HTTPError
+
+from nxdrive.client.remote_client import Remote
+from nxdrive.engine.dao.sqlite import EngineDAO
+from nxdrive.exceptions import NotFound
+from nxdrive.engine.watcher.remote_watcher import RemoteWatcher
+from nxdrive.objects import RemoteFileInfo
+
+ROOT_REF = "defaultSyncRootFolderItemFactory#default#root"
+TOP_REF = "org.nuxeo.drive.service.impl.DefaultTopLevelFolderItemFactory#"
+
+
+def ref(uid):
+    return "defaultFileSystemItemFactory#default#" + uid
+
+
+def add_pair(dao, uid, parent_uid, parent_path, local_path, folderish=True):
+    info = RemoteFileInfo.from_dict(
+        {
+            "id": uid,
+            "parentId": parent_uid,
+            "path": "",
+            "name": local_path.rsplit("/", 1)[-1],
+            "folder": folderish,
+            "lastModificationDate": 0,
+            "creationDate": 0,
+            "canCreateChild": True,
+            "digest": None,
+            "digestAlgorithm": None,
+            "downloadURL": None,
+            "canUpdate": True,
+            "canRename": True,
+            "canDelete": True,
+        }
+    )
+    dao.insert_remote_state(
+        info, parent_path, local_path, local_path.rsplit("/", 1)[0] or "/"
+    )
+
+
+class MockClient:
+    repository = "default"
+
+
+class MockRemote:
+    """ Stand-in for the remote client, with the documents of the server. """
+
+    def __init__(self, modified=(), audit=(), error=None):
+        self.client = MockClient()
+        self.modified = modified
+        self.audit = audit
+        self.error = error
+        self.queries = []
+
+    def get_modified_documents(self, roots, since):
+        self.queries.append(("modified", roots, since))
+        if self.error:
+            raise self.error
+        return iter(self.modified)
+
+    def get_audit_entries(self, events, lower, upper):
+        self.queries.append(("audit", lower, upper))
+        return iter(self.audit)
+
+    def fetch(self, ref):
+        uid = {"root": "root", "/ws/Root": "root", "/ws/Root/A": "a"}.get(ref)
+        if not uid:
+            raise NotFound()
+        return {"uid": uid, "path": "/ws/Root"}
+
+    def get_fs_info(self, fs_item_id):
+        return fs_item_id
+
+
+class MockEngine:
+    def __init__(self, remote):
+        self.remote = remote
+
+
+@pytest.fixture()
+def dao(tmpdir):
+    dao = EngineDAO(str(tmpdir.join("engine.db")))
+    add_pair(dao, TOP_REF, "", "", "/")
+    add_pair(dao, ROOT_REF, TOP_REF, "/" + TOP_REF, "/Root")
+    root_path = "/{}/{}".format(TOP_REF, ROOT_REF)
+    add_pair(dao, ref("a"), ROOT_REF, root_path, "/Root/A")
+    add_pair(dao, ref("b"), ROOT_REF, root_path, "/Root/B")
+    add_pair(dao, ref("f"), ref("a"), root_path + "/" + ref("a"), "/Root/A/f", False)
+    add_pair(dao, ref("g"), ref("b"), root_path + "/" + ref("b"), "/Root/B/g", False)
+    yield dao
+    dao.dispose()
+
+
+def get_watcher(dao, remote):
+    watcher = RemoteWatcher(MockEngine(remote), dao, 30)
+    watcher._interact = lambda: None
+    watcher.scanned = []
+
+    def scan(doc_pair, remote_info, force_recursion=True):
+        assert not force_recursion
+        watcher.scanned.append(doc_pair.local_path)
+
+    watcher._scan_remote_recursive = scan
+    watcher._last_root_definitions = "default:root"
+    watcher._last_event_log_id = 20
+    return watcher
+
+
+def doc(uid, parent_uid):
+    return {"uid": uid, "parentRef": parent_uid, "repository": "default"}
+
+
+def entry(uid, event, path):
+    return {"id": 15, "docUUID": uid, "eventId": event, "docPath": path}
+
+
+def test_no_last_sync_date(dao):
+    remote = MockRemote()
+    watcher = get_watcher(dao, remote)
+    assert not watcher._catch_up("default:root", 0, 10)
+    assert not remote.queries
+    assert not watcher.scanned
+
+
+def test_no_last_event_log_id(dao):
+    """ Moves and deletions cannot be found without the audit. """
+    remote = MockRemote()
+    watcher = get_watcher(dao, remote)
+    assert not watcher._catch_up("default:root", 1000000, 0)
+    assert not remote.queries
+
+
+def test_other_repository(dao):
+    remote = MockRemote()
+    watcher = get_watcher(dao, remote)
+    watcher._last_root_definitions = "other:root"
+    assert not watcher._catch_up("other:root", 1000000, 10)
+    assert not remote.queries
+
+
+@pytest.mark.parametrize(
+    "error", [HTTPError(status=500, message="Server error"), BadQuery("Unknown")]
+)
+def test_query_error(dao, error):
+    remote = MockRemote(error=error)
+    watcher = get_watcher(dao, remote)
+    assert not watcher._catch_up("default:root", 1000000, 10)
+    assert not watcher.scanned
+
+
+def test_nothing_changed(dao):
+    remote = MockRemote()
+    watcher = get_watcher(dao, remote)
+    assert watcher._catch_up("default:root", 1000000, 10)
+    assert remote.queries == [("modified", ["root"], 400), ("audit", 10, 20)]
+    assert not watcher.scanned
+
+
+def test_roots_changed(dao):
+    remote = MockRemote()
+    watcher = get_watcher(dao, remote)
+    watcher._last_root_definitions = "default:root,default:new"
+    assert watcher._catch_up("default:old,default:root", 1000000, 10)
+
+    # The top level is scanned, documents are only queried in the kept root
+    assert watcher.scanned == ["/"]
+    assert remote.queries == [("modified", ["root"], 400), ("audit", 10, 20)]
+
+
+def test_modified_folders(dao):
+    remote = MockRemote(modified=[doc("f", "a")])
+    watcher = get_watcher(dao, remote)
+    assert watcher._catch_up("default:root", 1000000, 10)
+    assert watcher.scanned == ["/Root/A"]
+
+
+def test_deleted_document(dao):
+    remote = MockRemote(audit=[entry("g", "documentRemoved", "/ws/Root/B/g")])
+    watcher = get_watcher(dao, remote)
+    assert watcher._catch_up("default:root", 1000000, 10)
+    assert watcher.scanned == ["/Root/B"]
+
+
+def test_deleted_folder(dao):
+    """ The children of a folder are checked too, its ACLs may have changed. """
+    remote = MockRemote(audit=[entry("a", "documentSecurityUpdated", "/ws/Root/A")])
+    watcher = get_watcher(dao, remote)
+    assert watcher._catch_up("default:root", 1000000, 10)
+    assert watcher.scanned == ["/Root", "/Root/A"]
+
+
+def test_moved_document(dao):
+    remote = MockRemote(audit=[entry("g", "documentMoved", "/ws/Root/A/g")])
+    watcher = get_watcher(dao, remote)
+    assert watcher._catch_up("default:root", 1000000, 10)
+    assert watcher.scanned == ["/Root/A", "/Root/B"]
+
+
+def test_moved_in_and_out(dao):
+    remote = MockRemote(
+        audit=[
+            # Moved from another place, then moved out
+            entry("h", "documentMoved", "/ws/Root/A/h"),
+            entry("h", "documentMoved", "/ws/Other/h"),
+            # Moved, then deleted
+            entry("i", "documentMoved", "/ws/Root/C/i"),
+        ]
+    )
+    watcher = get_watcher(dao, remote)
+    assert watcher._catch_up("default:root", 1000000, 10)
+    assert watcher.scanned == ["/Root/A"]
+
+
+def test_paged_query():
+    uids = ["uid{}".format(idx) for idx in range(5)]
+    queries = []
+
+    def stream(command, key, query=None, pageSize=None):
+        assert (command, key) == ("Document.Query", "entries")
+        queries.append(query)
+        last_uid = re.search(r"ecm:uuid > '(\w+)'", query)
+        docs = [uid for uid in uids if not last_uid or uid > last_uid.group(1)]
+        return iter({"uid": uid} for uid in docs[:pageSize])
+
+    remote = Remote.__new__(Remote)
+    remote._stream = stream
+    remote._has_new_trash_service = True
+
+    docs = remote.get_modified_documents(["root"], 0, page_size=2)
+    assert [entry["uid"] for entry in docs] == uids
+    assert len(queries) == 3
+    assert all("ecm:ancestorId IN ('root')" in query for query in queries)
+    date = "dc:modified >= TIMESTAMP '1970-01-01T00:00:00Z'"
+    assert all(date in query for query in queries)
+    assert all(query.endswith(" ORDER BY ecm:uuid") for query in queries)
+
+
+def test_paged_audit_query():
+    queries = []
+
+    def stream(command, key, query=None, pageSize=None):
+        assert (command, key) == ("Audit.QueryWithPageProvider", "entries")
+        queries.append(query)
+        last_id = int(re.search(r"log.id > (\d+)", query).group(1))
+        ids = range(last_id + 1, 16)
+        return iter({"id": log_id} for log_id in list(ids)[:pageSize])
+
+    remote = Remote.__new__(Remote)
+    remote._stream = stream
+    remote.client = MockClient()
+
+    entries = remote.get_audit_entries(["documentMoved"], 10, 15, page_size=5)
+    assert [entry["id"] for entry in entries] == [11, 12, 13, 14, 15]
+    # A full page, the next one is empty
+    assert len(queries) == 2
+    assert all("log.repositoryId = 'default'" in query for query in queries)
+    assert all("log.eventId IN ('documentMoved')" in query for query in queries)
+    assert all("log.id <= 15" in query for query in queries)
+    assert queries[1].endswith(" AND log.id > 15 ORDER BY log.id")
@@ -0,0 +1,226 @@
+# coding: utf-8
+import hashlib
+import os
+import re
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Thread
+from time import sleep
+
+import pytest
+import requests
+
+from nxdrive.client.download import download
+
+CONTENT = bytes(range(256)) * 4096
+ETAG = '"content-v1"'
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    requests = []
+
+
+class Handler(BaseHTTPRequestHandler):
+    """ Serve CONTENT, with support for Range and If-Range headers. """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        start, end = 0, len(CONTENT) - 1
+        status = 200
+
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if match and (if_range is None or if_range == ETAG):
+            start = int(match.group(1))
+            if match.group(2):
+                end = int(match.group(2))
+            if start >= len(CONTENT):
+                self.send_response(416)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        body = CONTENT[start : end + 1]
+        self.send_response(status)
+        self.send_header("ETag", ETAG)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 206:
+            self.send_header(
+                "Content-Range", "bytes {}-{}/{}".format(start, end, len(CONTENT))
+            )
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture()
+def server():
+    httpd = Server(("127.0.0.1", 0), Handler)
+    httpd.requests = []
+    Thread(target=httpd.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/file".format(httpd.server_address[1])
+
+    def get(headers):
+        return requests.get(url, headers=headers, stream=True)
+
+    yield httpd, get
+    httpd.shutdown()
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_download(server, tmpdir):
+    httpd, get = server
+    file_out = str(tmpdir.join("file.nxpart"))
+    validators = []
+
+    download(get, file_out, on_validator=validators.append)
+    assert read(file_out) == CONTENT
+    assert validators == [ETAG]
+    assert "Range" not in httpd.requests[0]
+
+
+def test_digest(server, tmpdir):
+    """ The content is hashed while it is written. """
+    httpd, get = server
+    file_out = str(tmpdir.join("file.nxpart"))
+
+    assert download(get, file_out) is None
+    assert download(get, file_out, digest_func="sha1") == (
+        hashlib.sha1(CONTENT).hexdigest()
+    )
+
+
+def test_resume(server, tmpdir):
+    httpd, get = server
+    file_out = str(tmpdir.join("file.nxpart"))
+    with open(file_out, "wb") as f:
+        f.write(CONTENT[:1000])
+
+    digest = download(get, file_out, validator=ETAG, digest_func="md5")
+    assert read(file_out) == CONTENT
+    assert digest == hashlib.md5(CONTENT).hexdigest()
+    assert httpd.requests[0]["Range"] == "bytes=1000-"
+    assert httpd.requests[0]["If-Range"] == ETAG
+
+
+def test_resume_content_changed(server, tmpdir):
+    """ The validator does not match: the whole content is downloaded. """
+    httpd, get = server
+    file_out = str(tmpdir.join("file.nxpart"))
+    with open(file_out, "wb") as f:
+        f.write(b"x" * 1000)
+
+    download(get, file_out, validator='"content-v0"')
+    assert read(file_out) == CONTENT
+
+
+def test_resume_too_big(server, tmpdir):
+    httpd, get = server
+    file_out = str(tmpdir.join("file.nxpart"))
+    with open(file_out, "wb") as f:
+        f.write(b"x" * (len(CONTENT) + 10))
+
+    download(get, file_out, validator=ETAG)
+    assert read(file_out) == CONTENT
+    assert len(httpd.requests) == 2
+
+
+def test_ranges(server, tmpdir):
+    httpd, get = server
+    file_out = str(tmpdir.join("file.nxpart"))
+    validators, written = [], []
+
+    digest = download(
+        get,
+        file_out,
+        on_validator=validators.append,
+        split_size=1024,
+        ranges=4,
+        on_range=lambda start, end: written.append((start, end)),
+        digest_func="md5",
+    )
+    assert read(file_out) == CONTENT
+    # Ranges are hashed once assembled
+    assert digest == hashlib.md5(CONTENT).hexdigest()
+    assert validators == [ETAG]
+    ranges = sorted(req["Range"] for req in httpd.requests[1:])
+    assert len(ranges) == 4
+    assert ranges[0] == "bytes=0-{}".format(len(CONTENT) // 4 - 1)
+    assert all(req["If-Range"] == ETAG for req in httpd.requests[1:])
+    assert len(written) == 4
+
+
+def download_ranges_failing(get, file_out, failing):
+    """ Download in 4 ranges, the one starting at *failing* fails. """
+    written = []
+
+    def get_failing(headers):
+        if headers.get("Range", "").startswith("bytes={}-".format(failing)):
+            # Let the other ranges be written
+            sleep(0.5)
+            raise ConnectionError("Network down")
+        return get(headers)
+
+    with pytest.raises(ConnectionError):
+        download(
+            get_failing,
+            file_out,
+            split_size=1024,
+            ranges=4,
+            on_range=lambda start, end: written.append((start, end)),
+        )
+    return written
+
+
+def test_resume_ranges(server, tmpdir):
+    httpd, get = server
+    file_out = str(tmpdir.join("file.nxpart"))
+    quarter = len(CONTENT) // 4
+    written = download_ranges_failing(get, file_out, 2 * quarter)
+    assert len(written) == 3
+    assert (2 * quarter, 3 * quarter - 1) not in written
+    assert os.path.getsize(file_out) == len(CONTENT)
+
+    # Only the missing ranges are fetched, and the whole content is hashed
+    del httpd.requests[:]
+    digest = download(
+        get,
+        file_out,
+        validator=ETAG,
+        split_size=1024,
+        ranges=4,
+        done_ranges=written,
+        digest_func="md5",
+    )
+    assert read(file_out) == CONTENT
+    assert digest == hashlib.md5(CONTENT).hexdigest()
+    ranges = [req["Range"] for req in httpd.requests]
+    assert ranges == ["bytes={}-{}".format(2 * quarter, 3 * quarter - 1)]
+
+
+def test_resume_ranges_content_changed(server, tmpdir):
+    """ The validator does not match: the whole content is downloaded. """
+    httpd, get = server
+    file_out = str(tmpdir.join("file.nxpart"))
+    written = download_ranges_failing(get, file_out, len(CONTENT) // 4)
+
+    with open(file_out, "r+b") as f:
+        f.write(b"x" * 1000)
+    download(
+        get,
+        file_out,
+        validator='"content-v0"',
+        split_size=1024,
+        ranges=4,
+        done_ranges=written,
+    )
+    assert read(file_out) == CONTENT
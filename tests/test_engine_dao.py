@@ -4,6 +4,8 @@ import shutil
 import time
 
 from nxdrive.engine.dao.sqlite import EngineDAO
+from nxdrive.engine.queue_manager import QueueManager
+from nxdrive.objects import RemoteFileInfo
 
 
 class MockEngineDao(EngineDAO):
@@ -212,7 +214,7 @@ def test_migration_db_v1():
         c = dao._get_read_connection().cursor()
 
         cols = c.execute("PRAGMA table_info('States')").fetchall()
-        assert len(cols) == 31
+        assert len(cols) == 32
 
         cols = c.execute("SELECT * FROM States").fetchall()
         assert len(cols) == 63
@@ -226,12 +228,287 @@ def test_migration_db_v1_with_duplicates():
         assert not rows
 
         cols = c.execute("PRAGMA table_info('States')").fetchall()
-        assert len(cols) == 31
+        assert len(cols) == 32
         assert dao.get_config("remote_last_event_log_id") is None
         assert dao.get_config("remote_last_full_scan") is None
 
 
+def test_remote_refs():
+    with MockEngineDao("test_engine_migration.db") as dao:
+        ids = [25, 26, 46]
+        refs = dao.get_remote_refs(ids)
+        expected = [dao.get_state_from_id(row_id).remote_ref for row_id in ids]
+        assert sorted(refs) == sorted(expected)
+        assert not dao.get_remote_refs([])
+
+
+def test_scan_checkpoints():
+    with MockEngineDao("test_engine_migration.db") as dao:
+        dao.add_path_scanned("/root/folder")
+        dao.add_scrolled(["ref1", "ref2"])
+        assert dao.get_scrolled(["ref2", "ref3"]) == {"ref2"}
+        dao.clean_scanned()
+        assert not dao.is_path_scanned("/root/folder")
+        assert not dao.get_scrolled(["ref1", "ref2"])
+
+        dao.add_local_scanned("/folder", 1.5)
+        dao.add_local_scanned("/folder", 2.5)
+        assert dao.get_local_scanned() == {"/folder": 2.5}
+        dao.clean_local_scanned()
+        assert not dao.get_local_scanned()
+
+
+def test_remote_descendants_not_scrolled():
+    with MockEngineDao("test_engine_migration.db") as dao:
+        path = "/org.nuxeo.drive.service.impl.DefaultTopLevelFolderItemFactory#"
+        descendants = dao.get_remote_descendants(path)
+        assert descendants
+
+        dao.add_scrolled([descendants[0].remote_ref])
+        remaining = dao.get_remote_descendants(path, not_scrolled=True)
+        assert len(remaining) == len(descendants) - 1
+        dao.clean_scrolled()
+        remaining = dao.get_remote_descendants(path, not_scrolled=True)
+        assert len(remaining) == len(descendants)
+
+
+def test_states_from_remotes():
+    with MockEngineDao("test_engine_migration.db") as dao:
+        full = "defaultFileSystemItemFactory#default#fd38095c-e4ba-468d-97a4-4ac71c6089f6"
+        partial = "default#2ce99a7c-de12-4eea-a4d0-ad7fdffb097d"
+        states = dao.get_states_from_remotes([full, partial, "unknown"])
+        assert len(states) == 2
+        assert [state.id for state in states[full]] == [3]
+        assert [state.id for state in states[partial]] == [5]
+        assert dao.get_first_state_from_partial_remote(partial).id == 5
+        assert not dao.get_states_from_remotes([partial], partial=False)
+
+
+def test_transaction():
+    with MockEngineDao("test_engine_migration.db") as dao:
+        with dao.transaction():
+            dao.update_config("key", "value")
+            with dao.transaction():
+                dao.update_config("other", "value")
+            assert dao.get_config("key") == "value"
+        assert dao.get_config("other") == "value"
+        assert not dao._get_write_connection().in_transaction
+
+
 def test_reinit_processors():
     with MockEngineDao("test_engine_migration.db") as dao:
         state = dao.get_state_from_id(1)
         assert not state.processor
+
+
+def test_uploads():
+    with MockEngineDao("test_engine_migration.db") as dao:
+        assert not dao.get_upload(1, "digest")
+
+        dao.save_upload(1, "digest", "batch", 1024)
+        dao.add_upload_chunk(1, 0)
+        dao.add_upload_chunk(1, 1)
+        upload = dao.get_upload(1, "digest")
+        assert upload.batch_id == "batch"
+        assert upload.chunk_size == 1024
+        assert upload.chunks == "0,1,"
+
+        # The content changed, the upload cannot be resumed
+        assert not dao.get_upload(1, "other digest")
+
+        # A new upload starts from scratch
+        dao.save_upload(1, "other digest", "batch2", 1024)
+        assert not dao.get_upload(1, "other digest").chunks
+
+        dao.remove_upload(1)
+        assert not dao.get_upload(1, "other digest")
+
+
+class MockQueueManager:
+    """ Record what the DAO queues. """
+
+    SUBTREE_STATES = QueueManager.SUBTREE_STATES
+
+    def __init__(self):
+        self.pushed = []
+        self.subtrees = {}
+
+    def push_ref(self, row_id, folderish, pair_state):
+        self.pushed.append((row_id, pair_state))
+
+    def push_subtree(self, row_id, path, pair_state):
+        self.subtrees[path] = row_id
+        self.pushed.append((row_id, pair_state))
+
+    def in_subtree(self, path):
+        return any(path.startswith(root + "/") for root in self.subtrees)
+
+    def interrupt_processors_on(self, path, exact_match=True):
+        pass
+
+
+def add_pair(dao, local_path, folderish=True):
+    """ Add a pair under /tree, its remote path follows its local path. """
+    names = local_path.strip("/").split("/")
+    uids = ["_".join(names[: idx + 1]) for idx in range(len(names))]
+    uid, parent_uid = uids[-1], (uids[-2] if len(uids) > 1 else "root")
+    parent_path = local_path.rsplit("/", 1)[0]
+    remote_parent_path = "/".join(["/root"] + uids[:-1])
+    info = RemoteFileInfo.from_dict(
+        {
+            "id": uid,
+            "parentId": parent_uid,
+            "path": "",
+            "name": local_path.rsplit("/", 1)[1],
+            "folder": folderish,
+            "lastModificationDate": 0,
+            "creationDate": 0,
+            "canCreateChild": True,
+            "digest": None,
+            "digestAlgorithm": None,
+            "downloadURL": None,
+            "canUpdate": True,
+            "canRename": True,
+            "canDelete": True,
+        }
+    )
+    row_id = dao.insert_remote_state(info, remote_parent_path, local_path, parent_path)
+    return dao.get_state_from_id(row_id)
+
+
+def add_tree(dao):
+    paths = ("/tree", "/tree/a", "/tree/a/b", "/tree/a/b/c", "/tree/ab")
+    pairs = {path: add_pair(dao, path) for path in paths}
+    for path in ("/tree/a/file", "/tree/a/b/file", "/tree/ab/file"):
+        pairs[path] = add_pair(dao, path, folderish=False)
+    return pairs
+
+
+def test_move_subtree():
+    with MockEngineDao("test_engine_migration.db") as dao:
+        pairs = add_tree(dao)
+
+        # /tree/a is moved to /tree/ab/moved
+        dao.update_local_parent_path(pairs["/tree/a"], "moved", "/tree/ab")
+        paths = {
+            path: dao.get_state_from_id(pair.id).local_path
+            for path, pair in pairs.items()
+        }
+        assert paths == {
+            "/tree": "/tree",
+            # Refreshed later by the caller
+            "/tree/a": "/tree/a",
+            "/tree/a/b": "/tree/ab/moved/b",
+            "/tree/a/b/c": "/tree/ab/moved/b/c",
+            "/tree/a/file": "/tree/ab/moved/file",
+            "/tree/a/b/file": "/tree/ab/moved/b/file",
+            # Sharing the prefix of the moved folder, but not inside
+            "/tree/ab": "/tree/ab",
+            "/tree/ab/file": "/tree/ab/file",
+        }
+        assert dao.get_state_from_id(pairs["/tree/a"].id).local_parent_path == (
+            "/tree/ab"
+        )
+        moved = dao.get_state_from_id(pairs["/tree/a/b/c"].id)
+        assert moved.local_parent_path == "/tree/ab/moved/b"
+
+
+def test_move_subtree_to_root():
+    with MockEngineDao("test_engine_migration.db") as dao:
+        pairs = add_tree(dao)
+        dao.update_local_parent_path(pairs["/tree/a/b"], "b", "/")
+        assert dao.get_state_from_id(pairs["/tree/a/b/c"].id).local_path == "/b/c"
+        assert dao.get_state_from_id(pairs["/tree/a/b/file"].id).local_parent_path == (
+            "/b"
+        )
+        assert dao.get_state_from_id(pairs["/tree/ab/file"].id).local_path == (
+            "/tree/ab/file"
+        )
+
+
+def test_delete_local_subtree():
+    with MockEngineDao("test_engine_migration.db") as dao:
+        pairs = add_tree(dao)
+        queue = MockQueueManager()
+        dao._queue_manager = queue
+
+        dao.delete_local_state(pairs["/tree/a"])
+        states = {
+            path: dao.get_state_from_id(pair.id).pair_state
+            for path, pair in pairs.items()
+        }
+        deleted = {"/tree/a", "/tree/a/b", "/tree/a/b/c", "/tree/a/file"}
+        deleted.add("/tree/a/b/file")
+        for path, state in states.items():
+            if path in deleted:
+                assert state == "locally_deleted", path
+            else:
+                assert state == "remotely_created", path
+
+        # Only the root of the subtree is queued
+        assert queue.pushed == [(pairs["/tree/a"].id, "locally_deleted")]
+        assert queue.subtrees == {"/tree/a": pairs["/tree/a"].id}
+
+        # The deletion of a descendant is covered by it
+        dao.delete_local_state(pairs["/tree/a/b"])
+        assert len(queue.pushed) == 1
+
+        # Not the deletion of a folder sharing its prefix
+        dao.delete_local_state(pairs["/tree/ab"])
+        assert queue.pushed[1] == (pairs["/tree/ab"].id, "locally_deleted")
+
+
+def test_download_ranges():
+    with MockEngineDao("test_engine_migration.db") as dao:
+        dao.save_download("/file.nxpart", "digest", "etag")
+        assert not dao.get_download("/file.nxpart").ranges
+
+        dao.add_download_range("/file.nxpart", 0, 99)
+        dao.add_download_range("/file.nxpart", 200, 299)
+        assert dao.get_download("/file.nxpart").ranges == "0-99,200-299,"
+
+        # A new download starts from scratch
+        dao.save_download("/file.nxpart", "digest", "etag2")
+        assert not dao.get_download("/file.nxpart").ranges
+
+
+def test_downloads_removed_with_pairs(tmpdir):
+    with MockEngineDao("test_engine_migration.db") as dao:
+        pairs = add_tree(dao)
+        paths = {}
+        for path in ("/tree/a/file", "/tree/a/b/file", "/tree/ab/file"):
+            paths[path] = str(tmpdir.join(path.replace("/", "_") + ".nxpart"))
+            with open(paths[path], "wb") as f:
+                f.write(b"partial")
+            dao.save_download(paths[path], "digest", None, doc_pair=pairs[path].id)
+        other = str(tmpdir.join("other.nxpart"))
+        dao.save_download(other, "digest", None)
+
+        # The downloads of the subtree go with it
+        dao.remove_state(pairs["/tree/a"])
+        assert not dao.get_download(paths["/tree/a/file"])
+        assert not dao.get_download(paths["/tree/a/b/file"])
+        assert not os.path.exists(paths["/tree/a/file"])
+        assert not os.path.exists(paths["/tree/a/b/file"])
+
+        # Not the ones of other pairs, nor the ones without pair
+        assert dao.get_download(paths["/tree/ab/file"])
+        assert os.path.isfile(paths["/tree/ab/file"])
+        assert dao.get_download(other)
+
+
+def test_purge_downloads(tmpdir):
+    with MockEngineDao("test_engine_migration.db") as dao:
+        old, recent = str(tmpdir.join("old.nxpart")), str(tmpdir.join("new.nxpart"))
+        for path in (old, recent):
+            with open(path, "wb") as f:
+                f.write(b"partial")
+            dao.save_download(path, "digest", "etag")
+        c = dao._get_write_connection().cursor()
+        c.execute("UPDATE Downloads SET started = 1000 WHERE path = ?", (old,))
+
+        dao.purge_downloads(3600)
+        assert not dao.get_download(old)
+        assert not os.path.exists(old)
+        assert dao.get_download(recent).etag == "etag"
+        assert os.path.isfile(recent)
@@ -0,0 +1,52 @@
+# coding: utf-8
+import errno
+import os
+
+import pytest
+
+from nxdrive.client import file_copy
+from nxdrive.client.file_copy import copy_file
+
+
+def test_copy_file(tmpdir):
+    src = tmpdir.join("src")
+    src.write(b"content" * 100_000, mode="wb")
+    src.chmod(0o640)
+    dst = tmpdir.join("dst")
+    dst.write(b"something longer than the source" * 100_000, mode="wb")
+
+    assert copy_file(str(src), str(dst)) in (
+        "buffered",
+        "clonefile",
+        "copy_file_range",
+        "reflink",
+        "sendfile",
+    )
+    assert dst.read_binary() == src.read_binary()
+    if os.name != "nt":
+        assert dst.stat().mode & 0o777 == 0o640
+
+
+def test_unsupported_mechanism(tmpdir, monkeypatch):
+    def unsupported(fsrc, fdst):
+        fdst.write(b"partial")
+        fdst.flush()
+        raise OSError(errno.EXDEV, "Cross-device link")
+
+    def failing(fsrc, fdst):
+        raise OSError(errno.EIO, "I/O error")
+
+    src = tmpdir.join("src")
+    src.write(b"content", mode="wb")
+    dst = tmpdir.join("dst")
+
+    # The next mechanism is used, from the beginning of the file
+    monkeypatch.setattr(file_copy, "MAC", False)
+    monkeypatch.setattr(file_copy, "STRATEGIES", [("unsupported", unsupported)])
+    assert copy_file(str(src), str(dst)) == "buffered"
+    assert dst.read_binary() == b"content"
+
+    # Other errors are not hidden
+    monkeypatch.setattr(file_copy, "STRATEGIES", [("failing", failing)])
+    with pytest.raises(OSError):
+        copy_file(str(src), str(dst))
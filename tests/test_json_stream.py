@@ -0,0 +1,53 @@
+# coding: utf-8
+import json
+
+import pytest
+
+from nxdrive.client.json_stream import JSONArrayStream
+
+
+def chunked(data, size):
+    data = data.encode("utf-8")
+    return (data[idx : idx + size] for idx in range(0, len(data), size))
+
+
+@pytest.mark.parametrize("size", [1, 3, 7, 1024])
+def test_array_in_object(size):
+    items = [{"id": idx, "name": "fïle {}".format(idx)} for idx in range(50)]
+    data = json.dumps({"scrollId": "abc", "fileSystemItems": items, "n": 1.25})
+    stream = JSONArrayStream(chunked(data, size), key="fileSystemItems")
+
+    assert list(stream) == items
+    assert stream.fields == {"scrollId": "abc", "n": 1.25}
+
+
+@pytest.mark.parametrize("size", [1, 5, 1024])
+def test_top_level_array(size):
+    items = [1, 22, 333, "4444", None, [5], {"6": [6]}]
+    stream = JSONArrayStream(chunked(json.dumps(items), size))
+    assert list(stream) == items
+
+
+def test_empty_and_null():
+    assert not list(JSONArrayStream([b" [ ] "]))
+    stream = JSONArrayStream([b'{"entries": null, "x": []}'], key="entries")
+    assert not list(stream)
+    assert stream.fields == {"entries": None, "x": []}
+
+
+def test_close():
+    closed = []
+    data = json.dumps(list(range(100)))
+    stream = JSONArrayStream(chunked(data, 10), close=lambda: closed.append(1))
+
+    for item in stream:
+        if item == 3:
+            break
+    del item
+    assert closed == [1]
+
+
+def test_truncated():
+    stream = JSONArrayStream([b'[{"id": 1}, {"id": '])
+    with pytest.raises(ValueError):
+        list(stream)
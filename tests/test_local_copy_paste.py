@@ -1,6 +1,7 @@
 # coding: utf-8
 import os
 import shutil
+from unittest.mock import patch
 
 from .common import FILE_CONTENT, UnitTestCase
 
@@ -82,6 +83,25 @@ class TestLocalCopyPaste(UnitTestCase):
     def test_local_copy_paste_files_stopped(self):
         self._local_copy_paste_files(stopped=True)
 
+    def test_local_copy_paste_files_without_upload(self):
+        """ Copies of synchronized files are made on the server. """
+        remote = self.engine_1.remote
+        local = self.local_1
+        src = local.abspath(self.folder_path_1)
+        dst = local.abspath(self.folder_path_2)
+        for f in os.listdir(src):
+            shutil.copy(os.path.join(src, f), dst)
+
+        with patch.object(remote, "upload", wraps=remote.upload) as upload:
+            self.engine_1.start()
+            self.wait_sync()
+        assert not upload.called
+
+        children = remote.get_fs_children(self.remote_ref_2)
+        assert {child.name for child in children} == set(self.local_files_list)
+        for child in children:
+            assert child.digest == local.get_info("/B/" + child.name).get_digest()
+
     def _local_copy_paste_files(self, stopped=False):
         if not stopped:
             self.engine_1.start()
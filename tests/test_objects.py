@@ -0,0 +1,78 @@
+# coding: utf-8
+from datetime import datetime, timezone
+
+from nxdrive.objects import NuxeoDocumentInfo, RemoteFileInfo, parse_date
+
+
+def test_parse_date():
+    assert parse_date("2018-09-12T13:41:12.123Z") == datetime(
+        2018, 9, 12, 13, 41, 12, 123000
+    )
+    assert parse_date("2018-09-12T13:41:12Z") == datetime(2018, 9, 12, 13, 41, 12)
+
+    # Other formats are handled by dateutil, and converted to UTC
+    assert parse_date("2018-09-12T15:41:12.123456+02:00") == datetime(
+        2018, 9, 12, 13, 41, 12, 123456
+    )
+    assert parse_date("2018-09-12") == datetime(2018, 9, 12)
+
+
+def test_remote_file_info():
+    fs_item = {
+        "id": "defaultFileSystemItemFactory#default#uid",
+        "parentId": "defaultSyncRootFolderItemFactory#default#parent",
+        "path": "/root/parent/uid",
+        "name": "Fichier ń.txt",
+        "folder": False,
+        "creationDate": 1536759672000,
+        "lastModificationDate": 1536759672000,
+        "digest": "0" * 32,
+        "digestAlgorithm": "MD5",
+        "downloadURL": "nxfile/default/uid/blobholder:0/file.txt",
+        "canRename": True,
+        "canDelete": False,
+        "canUpdate": True,
+        "lockInfo": {"owner": "Administrator", "created": 1536759672000},
+    }
+    infos = RemoteFileInfo.from_dicts([fs_item])
+    assert len(infos) == 1
+
+    info = infos[0]
+    assert info.name == "Fichier ń.txt"
+    assert info.uid == fs_item["id"]
+    assert info.digest_algorithm == "md5"
+    assert not info.can_delete
+    assert not info.can_create_child
+    assert not info.can_scroll_descendants
+    assert info.last_modification_time == datetime.fromtimestamp(1536759672)
+    assert info.lock_created == datetime.fromtimestamp(1536759672)
+
+
+def test_nuxeo_document_info():
+    doc = {
+        "uid": "uid",
+        "root": "root",
+        "path": "/default-domain/workspaces/ws/file",
+        "repository": "default",
+        "type": "File",
+        "state": "project",
+        "facets": [],
+        "lastModified": "2018-09-12T13:41:12.123Z",
+        "lockOwner": "Administrator",
+        "lockCreated": "2018-09-12T13:41:12.345Z",
+        "properties": {
+            "dc:title": "file",
+            "dc:lastContributor": "Administrator",
+            "file:content": {"name": "file.txt", "digest": "0" * 32},
+        },
+    }
+    info = NuxeoDocumentInfo.from_dict(doc, parent_uid="parent")
+    assert info.parent_uid == "parent"
+    assert info.filename == "file.txt"
+    assert info.has_blob
+    assert not info.is_trashed
+    assert info.version is None
+    assert info.last_modification_time == datetime(2018, 9, 12, 13, 41, 12, 123000)
+    assert info.lock_created == datetime(
+        2018, 9, 12, 13, 41, 12, 345000, tzinfo=timezone.utc
+    )
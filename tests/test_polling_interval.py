@@ -0,0 +1,44 @@
+# coding: utf-8
+from nxdrive.engine.watcher.remote_watcher import PollingInterval
+
+
+def test_shrink_on_changes():
+    polling = PollingInterval(30, 5, 300)
+    assert polling.interval == 30
+
+    polling.update(True, 0)
+    assert polling.interval == 15
+    for _ in range(5):
+        polling.update(True, 0)
+    assert polling.interval == 5
+
+
+def test_backoff_on_empty_polls():
+    polling = PollingInterval(30, 5, 300)
+    polling.update(True, 0)
+
+    # Back to the configured delay, then doubled
+    polling.update(False, 1)
+    assert polling.interval == 30
+    polling.update(False, 2)
+    assert polling.interval == 60
+    polling.update(False, 3)
+    assert polling.interval == 120
+    polling.update(False, 100)
+    assert polling.interval == 300
+
+
+def test_bounds():
+    """ The delay is kept when it is out of the bounds. """
+    polling = PollingInterval(3, 5, 3)
+    polling.update(True, 0)
+    assert polling.interval == 3
+    polling.update(False, 10)
+    assert polling.interval == 3
+
+
+def test_jitter():
+    polling = PollingInterval(30, 5, 300)
+    delays = {polling.next() for _ in range(100)}
+    assert len(delays) > 1
+    assert all(27 <= delay <= 33 for delay in delays)
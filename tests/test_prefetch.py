@@ -0,0 +1,118 @@
+# coding: utf-8
+from threading import Event, Lock, Thread
+
+import pytest
+
+from nxdrive.engine.prefetch import Prefetcher
+from nxdrive.exceptions import NotFound
+
+
+class Item:
+    def __init__(self, row_id):
+        self.id = row_id
+
+
+class Engine:
+    """ Just what the prefetcher needs: queued pairs and a remote client. """
+
+    def __init__(self, refs):
+        self.refs = refs
+        self.calls = []
+        self.lock = Lock()
+        self.remote = self
+
+    def get_queue_manager(self):
+        return self
+
+    def get_dao(self):
+        return self
+
+    def peek_local_items(self, limit):
+        return [Item(idx) for idx in range(len(self.refs))][:limit]
+
+    def get_remote_refs(self, row_ids):
+        return [self.refs[idx] for idx in row_ids]
+
+    def get_fs_info(self, ref, raise_if_missing=True):
+        with self.lock:
+            self.calls.append(ref)
+        return None if ref == "gone" else "info of " + ref
+
+
+def test_prefetch():
+    engine = Engine(["ref1", "ref2", "ref3"])
+    prefetcher = Prefetcher(engine)
+
+    assert prefetcher.get_fs_info("ref1") == "info of ref1"
+    # The next queued changes were fetched at the same time
+    for future in list(prefetcher._pending.values()):
+        future.result()
+    assert sorted(engine.calls) == ["ref1", "ref2", "ref3"]
+    assert prefetcher.get_fs_info("ref2") == "info of ref2"
+    assert prefetcher.get_fs_info("ref3") == "info of ref3"
+    assert len(engine.calls) == 3
+
+    # Infos are consumed
+    assert prefetcher.get_fs_info("ref2") == "info of ref2"
+    assert len(engine.calls) > 3
+
+    metrics = prefetcher.get_metrics()
+    assert metrics["hits"] == 2
+    assert metrics["misses"] == 2
+
+
+def test_forget():
+    engine = Engine(["ref1", "ref2"])
+    prefetcher = Prefetcher(engine)
+
+    prefetcher.get_fs_info("ref1")
+    prefetcher.forget("ref2")
+    prefetcher.get_fs_info("ref2")
+    assert engine.calls.count("ref2") == 2
+
+
+def test_forget_while_fetching():
+    """ An info fetched before the remote change must not be given. """
+    engine = Engine(["ref1"])
+    fetching, release = Event(), Event()
+    versions = iter(["old info", "new info"])
+
+    def get_fs_info(ref, raise_if_missing=True):
+        fetching.set()
+        release.wait(2)
+        return next(versions)
+
+    engine.get_fs_info = get_fs_info
+    prefetcher = Prefetcher(engine)
+    results = []
+    thread = Thread(target=lambda: results.append(prefetcher.get_fs_info("ref1")))
+    thread.start()
+    assert fetching.wait(2)
+
+    prefetcher.forget("ref1")
+    release.set()
+    thread.join()
+    assert results == ["new info"]
+    assert not prefetcher.get_metrics()["fetched"]
+
+
+def test_shutdown():
+    engine = Engine(["ref1", "ref2"])
+    prefetcher = Prefetcher(engine)
+    prefetcher.get_fs_info("ref1")
+
+    prefetcher.shutdown()
+    assert prefetcher._executor is None
+
+    # Infos are dropped, a new executor is created when needed
+    assert prefetcher.get_fs_info("ref2") == "info of ref2"
+    assert engine.calls.count("ref2") == 2
+    prefetcher.shutdown()
+
+
+def test_not_found():
+    engine = Engine(["gone"])
+    prefetcher = Prefetcher(engine)
+
+    with pytest.raises(NotFound):
+        prefetcher.get_fs_info("gone")
@@ -0,0 +1,145 @@
+# coding: utf-8
+from nxdrive.engine.queue_manager import QueueManager
+
+
+class Pair:
+    def __init__(self, row_id, local_path, pair_state, folderish=True):
+        self.id = row_id
+        self.local_path = local_path
+        self.local_parent_path = local_path.rsplit("/", 1)[0] or "/"
+        self.remote_ref = "ref{}".format(row_id)
+        self.remote_parent_ref = None
+        self.pair_state = pair_state
+        self.folderish = folderish
+        self.processor = 0
+        self.error_count = 0
+
+    def __repr__(self):
+        return "Pair[{}]({!r}, {!r})".format(self.id, self.local_path, self.pair_state)
+
+
+class MockDAO:
+    """ Pairs by row ID, the queue manager only reads them. """
+
+    def __init__(self, *pairs):
+        self.pairs = {pair.id: pair for pair in pairs}
+
+    def register_queue_manager(self, manager):
+        pass
+
+    def get_state_from_id(self, row_id):
+        return self.pairs.get(row_id)
+
+    def get_state_from_local(self, path):
+        for pair in self.pairs.values():
+            if pair.local_path == path:
+                return pair
+        return None
+
+
+class MockEngine:
+    def cancel_action_on(self, row_id):
+        pass
+
+
+def get_queue(*pairs):
+    return QueueManager(MockEngine(), MockDAO(*pairs))
+
+
+def queued(queue):
+    items = []
+    for getter in (queue._get_local_folder, queue._get_local_file):
+        item = getter()
+        while item:
+            items.append(item)
+            item = getter()
+    return items
+
+
+def test_child_parked_until_parent_released():
+    parent = Pair(1, "/a", "locally_created")
+    child = Pair(2, "/a/b", "locally_created", folderish=False)
+    queue = get_queue(parent, child)
+
+    # The parent is not created remotely yet
+    queue.park(child)
+    assert queue.get_parked_count() == 1
+    assert not queued(queue)
+
+    parent.pair_state = "synchronized"
+    queue.release(parent)
+    assert not queue.get_parked_count()
+    assert queued(queue) == [child]
+
+
+def test_parent_already_synchronized():
+    parent = Pair(1, "/a", "synchronized")
+    child = Pair(2, "/a/b", "locally_created", folderish=False)
+    queue = get_queue(parent, child)
+
+    # Nothing would release the child, it is retried later
+    queue.park(child)
+    assert not queue.get_parked_count()
+    assert 2 in queue._on_error_queue
+
+
+def test_claim_same_folder():
+    folder = Pair(1, "/a", "locally_created")
+    queue = get_queue(folder)
+    assert queue.claim_folder(folder)
+
+    # Another processor got the same folder, it waits for the first one
+    same = Pair(1, "/a", "locally_created")
+    assert not queue.claim_folder(same)
+    assert queue.get_parked_count() == 1
+
+    queue.release(folder)
+    assert queued(queue) == [same]
+    assert queue.claim_folder(same)
+
+
+def test_claim_nested_folders():
+    parent = Pair(1, "/a", "locally_created")
+    child = Pair(2, "/a/b", "locally_created")
+    other = Pair(3, "/ab", "locally_created")
+    queue = get_queue(parent, child, other)
+    assert queue.claim_folder(child)
+
+    # Ancestors and descendants wait, siblings sharing a prefix do not
+    assert not queue.claim_folder(parent)
+    assert queue.claim_folder(other)
+
+    queue.release(child)
+    assert queued(queue) == [parent]
+
+
+def test_release_after_error():
+    parent = Pair(1, "/a", "locally_created")
+    children = [
+        Pair(2, "/a/b", "locally_created", folderish=False),
+        Pair(3, "/a/c", "locally_created"),
+    ]
+    queue = get_queue(parent, *children)
+    assert queue.claim_folder(parent)
+    for child in children:
+        queue.park(child)
+    assert queue.get_parked_count() == 2
+
+    # The processor failed on the parent, it is retried later and the
+    # children are requeued to be parked again, instead of being held
+    queue.push_error(parent)
+    queue.release(parent)
+    assert not queue.get_parked_count()
+    assert sorted(pair.id for pair in queued(queue)) == [2, 3]
+
+
+def test_release_on_give_up():
+    parent = Pair(1, "/a", "locally_created")
+    child = Pair(2, "/a/b", "locally_created", folderish=False)
+    queue = get_queue(parent, child)
+    queue.park(child)
+
+    parent.error_count = queue.get_error_threshold() + 1
+    queue.push_error(parent)
+    assert 1 not in queue._on_error_queue
+    assert queued(queue) == [child]
@@ -3,7 +3,6 @@ import hashlib
 import operator
 import os
 from shutil import copyfile
-from threading import current_thread
 
 import pytest
 
@@ -102,9 +101,7 @@ class TestRemoteFileSystemClient(UnitTestCase):
         file_path = os.path.join(self.local_test_folder_1, "Document 1.txt")
         tmp_file = remote.stream_content(fs_item_id, file_path)
         assert os.path.exists(tmp_file)
-        assert os.path.basename(tmp_file) == (
-            ".Document 1.txt" + str(current_thread().ident) + ".nxpart"
-        )
+        assert os.path.basename(tmp_file) == ".Document 1.txt.nxpart"
         with open(tmp_file, "rb") as f:
             assert f.read() == b"Content of doc 1."
 
@@ -0,0 +1,92 @@
+# coding: utf-8
+from collections import namedtuple
+from threading import Lock
+from time import sleep
+
+import pytest
+
+from nxdrive.engine.dao.sqlite import EngineDAO
+from nxdrive.engine.watcher.remote_watcher import RemoteWatcher
+from nxdrive.options import Options
+
+Pair = namedtuple("Pair", "local_path, remote_parent_path, remote_ref")
+Info = namedtuple("Info", "uid, folderish, can_scroll_descendants")
+
+# Folder -> subfolders
+TREE = {
+    "root": ["a", "b", "c", "d", "e"],
+    "a": ["a1", "a2"],
+    "b": ["b1"],
+    "c": [],
+    "d": ["d1"],
+    "e": [],
+    "a1": [],
+    "a2": ["a21"],
+    "a21": [],
+    "b1": [],
+    "d1": [],
+}
+
+
+class MockRemote:
+    """ Folder listings taking some time, to see them fetched together. """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def get_fs_children(self, uid):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        return [Info(child, True, False) for child in TREE[uid]]
+
+
+class MockEngine:
+    def __init__(self, remote):
+        self.remote = remote
+
+
+@pytest.fixture()
+def dao(tmpdir):
+    dao = EngineDAO(str(tmpdir.join("engine.db")))
+    yield dao
+    dao.dispose()
+
+
+def test_parallel_scan(dao):
+    remote = MockRemote()
+    watcher = RemoteWatcher(MockEngine(remote), dao, 30)
+    watcher._interact = lambda: None
+    handled = []
+
+    def handle_children(pair, path, children, force_recursion):
+        # Listings are received by the scan threads
+        assert isinstance(children, list)
+        handled.append(pair.remote_ref)
+        return [(Pair("/" + info.uid, path, info.uid), info) for info in children]
+
+    watcher._handle_children = handle_children
+    scanned = []
+    add_path_scanned = dao.add_path_scanned
+
+    def add_scanned(path):
+        scanned.append(path)
+        add_path_scanned(path)
+
+    dao.add_path_scanned = add_scanned
+    watcher._scan_remote_recursive(Pair("/", "", "root"), Info("root", True, False))
+
+    assert sorted(handled) == sorted(TREE)
+    assert 1 < remote.max_running <= Options.max_remote_scans
+
+    # Folders are marked as scanned once their whole subtree is scanned
+    assert len(scanned) == len(TREE)
+    assert scanned[-1] == "/root"
+    for path in scanned:
+        for child in TREE[path.rsplit("/", 1)[-1]]:
+            assert scanned.index(path + "/" + child) < scanned.index(path)
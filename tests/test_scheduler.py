@@ -0,0 +1,102 @@
+# coding: utf-8
+from threading import Event, Thread
+from time import sleep
+
+from nxdrive.engine.scheduler import Scheduler
+
+
+def test_global_limit():
+    scheduler = Scheduler(max_transfers=2)
+    scheduler.register("engine1")
+    scheduler.register("engine2")
+    release = Event()
+
+    def transfer(uid):
+        with scheduler.transfer(uid):
+            release.wait()
+
+    uids = ("engine1", "engine1", "engine1", "engine2")
+    threads = [Thread(target=transfer, args=(uid,)) for uid in uids]
+    for thread in threads:
+        thread.start()
+    sleep(0.5)
+
+    # Only 2 slots, shared between engines
+    metrics = scheduler.get_metrics()
+    assert metrics["transfer_running"] == 2
+    assert metrics["transfer_waiting"] == 2
+
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    metrics = scheduler.get_metrics()
+    assert not metrics["transfer_running"]
+    assert not metrics["transfer_waiting"]
+    assert scheduler.get_engine_metrics("engine1")["transfer_count"] == 3
+    assert scheduler.get_engine_metrics("engine2")["transfer_count"] == 1
+
+
+def test_fairness():
+    """ A busy engine must not starve another one. """
+    scheduler = Scheduler(max_hashing=1)
+    scheduler.register("busy")
+    scheduler.register("idle")
+    order = []
+
+    def hashing(uid):
+        with scheduler.hashing(uid):
+            order.append(uid)
+            sleep(0.1)
+
+    with scheduler.hashing("busy"):
+        threads = [
+            Thread(target=hashing, args=(uid,))
+            for uid in ("busy", "busy", "busy", "idle")
+        ]
+        for thread in threads:
+            thread.start()
+            sleep(0.1)
+
+    for thread in threads:
+        thread.join()
+
+    # The idle engine is served first, then slots are shared
+    assert order == ["idle", "busy", "busy", "busy"]
+
+
+def test_weight():
+    scheduler = Scheduler(max_transfers=3)
+    scheduler.register("engine1", weight=2)
+    scheduler.register("engine2")
+    scheduler.register("gate")
+    gate, release = Event(), Event()
+
+    def transfer(uid, event):
+        with scheduler.transfer(uid):
+            event.wait()
+
+    # Hold all slots until every engine is waiting
+    threads = [Thread(target=transfer, args=("gate", gate)) for _ in range(3)]
+    uids = ("engine1",) * 3 + ("engine2",) * 3
+    threads += [Thread(target=transfer, args=(uid, release)) for uid in uids]
+    for thread in threads:
+        thread.start()
+    sleep(0.5)
+    gate.set()
+    sleep(0.5)
+
+    # engine1 has twice the share of engine2
+    assert scheduler.get_engine_metrics("engine1")["transfer_running"] == 2
+    assert scheduler.get_engine_metrics("engine2")["transfer_running"] == 1
+
+    release.set()
+    for thread in threads:
+        thread.join()
+
+
+def test_not_registered():
+    scheduler = Scheduler(max_transfers=1)
+    with scheduler.transfer("unknown"), scheduler.transfer("unknown"):
+        pass
+    assert not scheduler.get_metrics()["transfer_running"]
@@ -0,0 +1,33 @@
+# coding: utf-8
+from nxdrive.engine.watcher.remote_watcher import ScrollBatchSize
+
+
+def test_grow_on_fast_batches():
+    batch_size = ScrollBatchSize(100, 1000)
+    assert batch_size.size == 100
+
+    batch_size.update(100, 100, 0.1)
+    assert batch_size.size == 200
+    for _ in range(5):
+        batch_size.update(batch_size.size, batch_size.size, 0.1)
+    assert batch_size.size == 1000
+
+
+def test_shrink_on_slow_batches():
+    batch_size = ScrollBatchSize(100, 1000)
+    batch_size.size = 800
+
+    batch_size.update(800, 800, 4)
+    assert batch_size.size == 400
+    batch_size.update(400, 400, 1.25)
+    assert batch_size.size == 320
+    for _ in range(5):
+        batch_size.update(batch_size.size, batch_size.size, 10)
+    assert batch_size.size == 100
+
+
+def test_partial_batch():
+    """ The last batch of a scroll says nothing about the server speed. """
+    batch_size = ScrollBatchSize(100, 1000)
+    batch_size.update(10, 100, 0.01)
+    assert batch_size.size == 100
@@ -0,0 +1,136 @@
+# coding: utf-8
+from threading import Event, Thread
+from time import sleep
+
+import pytest
+
+from nxdrive.engine.subtree_lock import SubtreeLockManager
+
+
+def hold(locks, path, exclusive, acquired, release):
+    with locks.lock(path, exclusive=exclusive):
+        acquired.set()
+        release.wait()
+
+
+def start(locks, path, exclusive=False):
+    acquired, release = Event(), Event()
+    thread = Thread(target=hold, args=(locks, path, exclusive, acquired, release))
+    thread.start()
+    return thread, acquired, release
+
+
+def test_exclusive_waits_for_subtree_only():
+    locks = SubtreeLockManager()
+    inside, inside_acquired, inside_release = start(locks, "/a/b/file.txt")
+    outside, outside_acquired, outside_release = start(locks, "/c/file.txt")
+    assert inside_acquired.wait(1)
+    assert outside_acquired.wait(1)
+
+    # The folder lock must wait for the processor inside the subtree
+    folder, folder_acquired, folder_release = start(locks, "/a", exclusive=True)
+    assert not folder_acquired.wait(0.5)
+    assert locks.is_claimed("/a/b/file.txt")
+    assert not locks.is_claimed("/c/file.txt")
+
+    inside_release.set()
+    assert folder_acquired.wait(2)
+
+    # Work outside of the subtree keeps flowing
+    other, other_acquired, other_release = start(locks, "/c/other.txt")
+    assert other_acquired.wait(1)
+
+    # But nothing can enter the locked subtree
+    new, new_acquired, new_release = start(locks, "/a/new.txt")
+    assert not new_acquired.wait(0.5)
+
+    folder_release.set()
+    assert new_acquired.wait(2)
+
+    for event in (outside_release, other_release, new_release):
+        event.set()
+    for thread in (inside, outside, folder, other, new):
+        thread.join()
+    assert not locks.get_metrics()["owners"]
+
+
+def test_exclusive_ancestor():
+    locks = SubtreeLockManager()
+    root, root_acquired, root_release = start(locks, "/", exclusive=True)
+    assert root_acquired.wait(1)
+
+    folder, folder_acquired, folder_release = start(locks, "/a", exclusive=True)
+    assert not folder_acquired.wait(0.5)
+
+    root_release.set()
+    assert folder_acquired.wait(2)
+    folder_release.set()
+    for thread in (root, folder):
+        thread.join()
+
+
+def test_upgrade():
+    """ A processor holding an intention lock can take the exclusive one. """
+    locks = SubtreeLockManager()
+    with locks.lock("/a"):
+        # Pending exclusive lock on the root from another thread
+        root, root_acquired, root_release = start(locks, "/", exclusive=True)
+        sleep(0.2)
+        assert not root_acquired.is_set()
+
+        with locks.lock("/a", exclusive=True):
+            pass
+
+    assert root_acquired.wait(2)
+    root_release.set()
+    root.join()
+
+
+def test_interact_gives_up():
+    locks = SubtreeLockManager()
+    inside, inside_acquired, inside_release = start(locks, "/a/file.txt")
+    assert inside_acquired.wait(1)
+
+    def interact():
+        raise ValueError("Stop")
+
+    # The folder lock is abandoned, new work can enter the subtree again
+    with pytest.raises(ValueError):
+        with locks.lock("/a", exclusive=True, interact=interact):
+            pass
+    assert not locks.is_claimed("/a/file.txt")
+    other, other_acquired, other_release = start(locks, "/a/other.txt")
+    assert other_acquired.wait(1)
+
+    for event in (inside_release, other_release):
+        event.set()
+    for thread in (inside, other):
+        thread.join()
+    assert not locks.get_metrics()["owners"]
+
+
+def test_freeze():
+    """ New work waits for the frozen folder, current work keeps going. """
+    locks = SubtreeLockManager()
+    inside, inside_acquired, inside_release = start(locks, "/a/file.txt")
+    assert inside_acquired.wait(1)
+
+    with locks.lock("/a", freeze=True):
+        assert not locks.is_claimed("/a/file.txt")
+        new, new_acquired, new_release = start(locks, "/a/new.txt")
+        folder, folder_acquired, folder_release = start(locks, "/a", exclusive=True)
+        other, other_acquired, other_release = start(locks, "/b/file.txt")
+        assert other_acquired.wait(1)
+        assert not new_acquired.wait(0.5)
+        assert not folder_acquired.is_set()
+
+    # The pending folder lock goes first
+    inside_release.set()
+    assert folder_acquired.wait(2)
+    folder_release.set()
+    assert new_acquired.wait(2)
+    for event in (new_release, other_release):
+        event.set()
+    for thread in (inside, new, folder, other):
+        thread.join()
+    assert not locks.get_metrics()["owners"]
@@ -0,0 +1,151 @@
+# coding: utf-8
+import asyncio
+import hashlib
+import ssl
+from threading import Thread
+
+import pytest
+from nuxeo.exceptions import CorruptedFile
+from requests import certs
+
+from nxdrive.engine.activity import FileAction
+from nxdrive.engine.transfer import TransferService
+from nxdrive.options import Options
+
+web = pytest.importorskip("aiohttp.web")
+
+CONTENT = b"Nuxeo Drive" * 100000
+# Requests received by the server for uploads
+RECEIVED = {}
+
+
+@pytest.fixture()
+def server():
+    """ Local server serving CONTENT on /file, and receiving uploads. """
+    loop = asyncio.new_event_loop()
+    RECEIVED.clear()
+
+    async def handler(request):
+        return web.Response(body=CONTENT)
+
+    async def new_batch(request):
+        return web.json_response({"batchId": "batch"})
+
+    async def blob(request):
+        RECEIVED["headers"] = dict(request.headers)
+        RECEIVED["data"] = await request.read()
+        return web.json_response({"fileIdx": "0"})
+
+    async def execute(request):
+        RECEIVED["command"] = request.match_info["command"]
+        RECEIVED["exec_headers"] = dict(request.headers)
+        RECEIVED["params"] = (await request.json())["params"]
+        return web.json_response({"id": "document"})
+
+    app = web.Application(client_max_size=2 * len(CONTENT))
+    app.router.add_get("/file", handler)
+    app.router.add_post("/upload/", new_batch)
+    app.router.add_post("/upload/batch/0", blob)
+    app.router.add_post("/upload/batch/0/execute/{command}", execute)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+
+    thread = Thread(target=loop.run_forever)
+    thread.start()
+    yield f"http://127.0.0.1:{port}/file"
+
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.run_until_complete(runner.cleanup())
+    loop.close()
+
+
+@pytest.fixture()
+def service():
+    transfers = TransferService()
+    transfers.start()
+    yield transfers
+    transfers.stop()
+
+
+def test_download(server, service, tmpdir):
+    file_out = str(tmpdir.join("file"))
+    digest = hashlib.md5(CONTENT).hexdigest()
+    action = FileAction("Download", file_out, size=0)
+    try:
+        job = service.download(server, file_out, {}, digest=digest, action=action)
+        assert service.run(job) == file_out
+    finally:
+        FileAction.finish_action()
+
+    with open(file_out, "rb") as f:
+        assert f.read() == CONTENT
+    assert action.progress == action.size == len(CONTENT)
+    assert service.get_metrics()["downloads"] == 1
+
+
+def test_download_corrupted(server, service, tmpdir):
+    file_out = str(tmpdir.join("file"))
+    job = service.download(server, file_out, {}, digest="0" * 32)
+    with pytest.raises(CorruptedFile):
+        service.run(job)
+
+
+def test_interrupted(service):
+    def interact():
+        raise ValueError("Stop")
+
+    async def never_ending():
+        await asyncio.sleep(60)
+
+    with pytest.raises(ValueError):
+        service.run(never_ending(), interact=interact)
+
+
+def test_upload(server, service, tmpdir):
+    path = tmpdir.join("file")
+    path.write(CONTENT, mode="wb")
+    action = FileAction("Upload", str(path))
+    try:
+        job = service.upload(
+            server[: -len("file")],
+            str(path),
+            "name é",
+            len(CONTENT),
+            None,
+            "NuxeoDrive.CreateFile",
+            {"parentId": "parent"},
+            {"X-Device-Id": "device"},
+            action=action,
+        )
+        assert service.run(job) == {"id": "document"}
+    finally:
+        FileAction.finish_action()
+
+    assert RECEIVED["data"] == CONTENT
+    assert RECEIVED["headers"]["X-File-Name"] == "name%20%C3%A9"
+    assert RECEIVED["headers"]["X-File-Size"] == str(len(CONTENT))
+    assert RECEIVED["headers"]["X-Device-Id"] == "device"
+    assert RECEIVED["command"] == "NuxeoDrive.CreateFile"
+    assert RECEIVED["params"] == {"parentId": "parent"}
+    assert "Nuxeo-Transaction-Timeout" in RECEIVED["exec_headers"]
+    assert action.progress == len(CONTENT)
+    assert service.get_metrics()["uploads"] == 1
+
+
+@Options.mock()
+def test_ssl():
+    assert TransferService._get_ssl() is None
+
+    Options.set("ca_bundle", certs.where(), setter="manual")
+    assert isinstance(TransferService._get_ssl(), ssl.SSLContext)
+
+    Options.set("ca_bundle", "missing.pem", setter="manual")
+    with pytest.raises(OSError):
+        TransferService._get_ssl()
+
+    Options.set("consider_ssl_errors", False, setter="manual")
+    assert TransferService._get_ssl() is False
@@ -0,0 +1,299 @@
+# coding: utf-8
+import time
+from threading import Event
+
+import pytest
+from nuxeo.exceptions import HTTPError
+
+from nxdrive.client.remote_client import Remote
+from nxdrive.client.upload_batch import SentBlobs, SharedBatch
+
+
+class Batch:
+    def __init__(self, uid):
+        self.uid = uid
+        self.dropped = False
+
+    def cancel(self):
+        self.dropped = True
+
+
+class Batches:
+    def __init__(self):
+        self.created = []
+
+    def __call__(self):
+        batch = Batch("batch{}".format(len(self.created)))
+        self.created.append(batch)
+        return batch
+
+
+def test_shared_batch():
+    batches = Batches()
+    shared = SharedBatch(batches, max_count=3, max_size=100)
+
+    uploads = [shared.acquire(10) for _ in range(3)]
+    assert [index for _, index in uploads] == [0, 1, 2]
+    assert len(batches.created) == 1
+
+    # Limited by count, then by size
+    batch, index = shared.acquire(10)
+    assert (batch.uid, index) == ("batch1", 0)
+    batch, index = shared.acquire(95)
+    assert (batch.uid, index) == ("batch2", 0)
+
+    # A batch is dropped once all its files are released
+    first = batches.created[0]
+    for batch, _ in uploads[:2]:
+        shared.release(batch)
+    assert not first.dropped
+    shared.release(uploads[2][0])
+    assert first.dropped
+
+    # The batch in use is dropped too, the next file starts a new one
+    shared.release(batches.created[2])
+    assert batches.created[2].dropped
+    batch, index = shared.acquire(10)
+    assert (batch.uid, index) == ("batch3", 0)
+
+
+def test_groups():
+    batches = Batches()
+    shared = SharedBatch(batches)
+
+    batch_a, index_a = shared.acquire(10, group="a")
+    batch_b, index_b = shared.acquire(10, group="b")
+    assert batch_a is not batch_b
+    assert index_a == index_b == 0
+    assert shared.acquire(10, group="a") == (batch_a, 1)
+
+
+def test_discard():
+    batches = Batches()
+    shared = SharedBatch(batches)
+
+    batch, _ = shared.acquire(10)
+    other, _ = shared.acquire(10)
+    assert other is batch
+    shared.discard(batch)
+
+    # The server does not know the batch anymore
+    shared.release(batch)
+    shared.release(batch)
+    assert not batch.dropped
+
+    new, index = shared.acquire(10)
+    assert new is not batch
+    assert index == 0
+
+
+def test_discard_released_batch():
+    batches = Batches()
+    shared = SharedBatch(batches)
+
+    batch, _ = shared.acquire(10)
+    shared.release(batch)
+    assert batch.dropped
+    shared.discard(batch)
+    assert shared.acquire(10)[0] is not batch
+
+
+def sent_blobs(tmpdir, send=None, ttl=60):
+    calls = []
+
+    def record(batch, index, path, name):
+        calls.append((batch.uid, index, path, name))
+        return "blob of {}".format(name)
+
+    batches = Batches()
+    blobs = SentBlobs(SharedBatch(batches), send or record, ttl=ttl)
+    files = []
+    for name in ("a", "b"):
+        path = tmpdir.join(name)
+        path.write(b"content of " + name.encode())
+        files.append((str(path), name))
+    return blobs, batches, files, calls
+
+
+def test_sent_blobs(tmpdir):
+    blobs, batches, files, calls = sent_blobs(tmpdir)
+    blobs.send("parent", files)
+    blobs.send("parent", files)
+
+    batch, upload = blobs.take(*files[0])
+    assert upload.result() == "blob of a"
+    assert blobs.take(*files[0]) is None
+    assert batch is batches.created[0]
+
+    batch, upload = blobs.take(*files[1])
+    assert upload.result() == "blob of b"
+    assert sorted(calls) == [
+        ("batch0", 0, files[0][0], "a"),
+        ("batch0", 1, files[1][0], "b"),
+    ]
+    blobs.shutdown()
+
+
+def test_sent_blobs_not_used(tmpdir):
+    blobs, batches, files, _ = sent_blobs(tmpdir)
+    blobs.send("parent", files)
+
+    # Renamed, then modified meanwhile
+    assert blobs.take(files[0][0], "other name") is None
+    time.sleep(0.01)
+    with open(files[1][0], "ab") as f:
+        f.write(b" and more")
+    assert blobs.take(*files[1]) is None
+
+    blobs.shutdown()
+    time.sleep(0.1)
+    assert batches.created[0].dropped
+
+
+def test_sent_blobs_expired(tmpdir):
+    blobs, batches, files, calls = sent_blobs(tmpdir, ttl=0)
+    blobs.send("parent", files[:1])
+    assert blobs.take(*files[0]) is None
+    time.sleep(0.1)
+    assert batches.created[0].dropped
+
+    # Expired blobs are released when sending the next ones
+    blobs.send("parent", files[:1])
+    blobs.send("parent", files[1:])
+    time.sleep(0.1)
+    assert len(calls) == 3
+    # Only the last blob still holds a batch, depending on the timing it is
+    # the batch of the expired one or a new one
+    assert list(blobs.batches._pending.values()) == [1]
+    blobs.shutdown()
+
+
+def test_sent_blobs_shutdown(tmpdir):
+    sending = Event()
+
+    def send(batch, index, path, name):
+        assert sending.wait(5)
+
+    blobs, batches, files, _ = sent_blobs(tmpdir, send=send)
+    blobs.send("parent", files)
+    blobs.shutdown()
+    assert not batches.created[0].dropped
+
+    # Released once the running upload is done
+    sending.set()
+    time.sleep(0.1)
+    assert batches.created[0].dropped
+    assert blobs.take(*files[0]) is None
+
+
+class Operations:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    def execute(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.error:
+            raise self.error
+        return {"id": "new document"}
+
+
+class Client:
+    """ The server does not know the upload batch anymore. """
+
+    api_path = "api/v1"
+
+    def request(self, method, path, **kwargs):
+        raise HTTPError(status=404, message="Unknown batch")
+
+
+def get_remote(operations, send=None):
+    remote = Remote.__new__(Remote)
+    remote.client = Client()
+    remote.operations = operations
+    if send:
+        remote._send_small = send
+    remote.small_uploads = SharedBatch(Batches())
+    remote.sent_blobs = SentBlobs(remote.small_uploads, remote._send_small)
+    return remote
+
+
+def test_upload_small_file(tmpdir):
+    path = tmpdir.join("file")
+    path.write(b"content")
+    sent = []
+
+    def send(batch, index, file_path, filename=None, mime_type=None):
+        sent.append((batch.uid, index, filename))
+        return "blob"
+
+    operations = Operations()
+    remote = get_remote(operations, send)
+    remote.sent_blobs.send("parent", [(str(path), "file")])
+
+    # The blob sent ahead is used
+    assert remote._upload_small(str(path), command="Create", parentId="parent")
+    assert sent == [("batch0", 0, "file")]
+    assert operations.calls[0]["input_obj"] == "blob"
+    assert operations.calls[0]["headers"]["X-Batch-No-Drop"] == "true"
+    assert remote.small_uploads._pending == {}
+
+    # Then the blob is sent when the document is created
+    remote._upload_small(str(path), filename="name", command="Create")
+    assert sent[1] == ("batch1", 0, "name")
+
+
+def test_upload_small_file_expired_batch(tmpdir):
+    path = tmpdir.join("file")
+    path.write(b"content")
+    operations = Operations()
+    remote = get_remote(operations)
+    batch, _ = remote.small_uploads.acquire(10)
+    with pytest.raises(HTTPError):
+        remote._upload_small(str(path), command="Create")
+    assert not operations.calls
+
+    # Replaced, and not dropped once released
+    assert remote.small_uploads.acquire(10)[0] is not batch
+    remote.small_uploads.release(batch)
+    assert not batch.dropped
+
+
+def test_upload_small_file_sent_ahead_error(tmpdir):
+    path = tmpdir.join("file")
+    path.write(b"content")
+    sent = []
+
+    def send_ahead(batch, index, file_path, filename=None, mime_type=None):
+        raise HTTPError(status=500, message="Server error")
+
+    def send(batch, index, file_path, filename=None, mime_type=None):
+        sent.append((batch.uid, index))
+        return "blob"
+
+    operations = Operations()
+    remote = get_remote(operations, send)
+    remote.sent_blobs._send = send_ahead
+    remote.sent_blobs.send("parent", [(str(path), "file")])
+
+    # Sent again when the document is created
+    remote._upload_small(str(path), command="Create", parentId="parent")
+    assert sent == [("batch1", 0)]
+    assert remote.small_uploads._new_batch.created[0].dropped
+
+
+def test_upload_small_file_creation_error(tmpdir):
+    path = tmpdir.join("file")
+    path.write(b"content")
+
+    def send(batch, index, file_path, filename=None, mime_type=None):
+        return "blob"
+
+    # The operation fails, the batch is kept for other files
+    operations = Operations(error=HTTPError(status=404, message="No parent"))
+    remote = get_remote(operations, send)
+    batch, _ = remote.small_uploads.acquire(10)
+    with pytest.raises(HTTPError):
+        remote._upload_small(str(path), command="Create")
+    assert remote.small_uploads.acquire(10)[0] is batch
+    assert not batch.dropped
@@ -0,0 +1,200 @@
+# coding: utf-8
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from nuxeo.exceptions import HTTPError
+from nuxeo.models import Batch, Blob, FileBlob
+
+from nxdrive.client.remote_client import Remote
+from nxdrive.client.uploader import ChunkedUploadsAPI, upload_blob
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class Server:
+    """ Stand-in for the Nuxeo client, keeping the requests sending blobs. """
+
+    api_path = "api/v1"
+
+    def __init__(self):
+        self.lock = Lock()
+        self.batches = 0
+        self.blobs = []
+
+    def request(self, method, path, headers=None, data=None, raw=False, **kwargs):
+        if path.endswith("/upload"):
+            with self.lock:
+                self.batches += 1
+                return Response({"batchId": "batch{}".format(self.batches)})
+
+        # Let concurrent uploads prepare their own request meanwhile
+        time.sleep(0.01)
+        with self.lock:
+            self.blobs.append((path, dict(headers), data))
+        return Response({"name": headers["X-File-Name"], "fileIdx": "0"})
+
+
+def test_concurrent_uploads_headers(tmpdir):
+    server = Server()
+    blobs = []
+    for idx in range(20):
+        path = tmpdir.join("file{}".format(idx))
+        path.write(b"x" * (idx + 1), mode="wb")
+        blobs.append(FileBlob(str(path)))
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        results = list(executor.map(lambda blob: upload_blob(server, blob), blobs))
+
+    assert server.batches == 20
+    assert len(server.blobs) == 20
+    for path, headers, data in server.blobs:
+        name = "file{}".format(len(data) - 1)
+        assert headers["X-File-Name"] == name
+        assert headers["X-File-Size"] == str(len(data))
+        assert headers["Content-Length"] == str(len(data))
+        assert "X-Upload-Type" not in headers
+    assert sorted(result.batch_id for result in results) == sorted(
+        "batch{}".format(idx) for idx in range(1, 21)
+    )
+
+
+def test_upload_at_index(tmpdir):
+    server = Server()
+    path = tmpdir.join("file")
+    path.write(b"content", mode="wb")
+
+    result = upload_blob(server, FileBlob(str(path)), batch_id="shared", index=3)
+    assert result.batch_id == "shared"
+    assert not server.batches
+    assert server.blobs[0][0] == "api/v1/upload/shared/3"
+
+
+def test_chunked_upload_resumed(tmpdir):
+    server = Server()
+    path = tmpdir.join("file")
+    path.write(b"0123456789", mode="wb")
+    sent = []
+
+    service = ChunkedUploadsAPI(
+        server, 3, uploaded={0, 1, 3}, callback=lambda *args: sent.append(args)
+    )
+    # Sent again after the first missing chunk
+    batch = Batch(service=service, batchId="batch")
+    batch.upload(FileBlob(str(path)), chunked=True)
+    assert sent == [(2, 3), (3, 1)]
+    for (_, headers, data), index in zip(server.blobs, (2, 3)):
+        assert headers["X-Upload-Type"] == "chunked"
+        assert headers["X-Upload-Chunk-Count"] == "4"
+        assert headers["X-Upload-Chunk-Index"] == str(index)
+    assert [data for _, _, data in server.blobs] == [b"678", b"9"]
+
+
+def test_chunked_upload_complete(tmpdir):
+    server = Server()
+    path = tmpdir.join("file")
+    path.write(b"012345", mode="wb")
+
+    # The last chunk gives the details of the blob
+    service = ChunkedUploadsAPI(server, 3, uploaded={0, 1})
+    Batch(service=service, batchId="batch").upload(FileBlob(str(path)), chunked=True)
+    assert [data for _, _, data in server.blobs] == [b"345"]
+
+
+Upload = namedtuple("Upload", "batch_id, chunk_size, chunks")
+
+
+class DAO:
+    def __init__(self, upload=None):
+        self.upload = upload
+        self.chunks = []
+        self.removed = False
+
+    def get_upload(self, doc_pair, digest):
+        return self.upload
+
+    def save_upload(self, doc_pair, digest, batch_id, chunk_size):
+        self.upload = Upload(batch_id, chunk_size, "")
+
+    def add_upload_chunk(self, doc_pair, index):
+        self.chunks.append(index)
+
+    def remove_upload(self, doc_pair):
+        self.removed = True
+
+
+class Uploads:
+    def __init__(self, received=None):
+        self.received = received
+
+    def get(self, batch_id, file_idx=None):
+        if self.received is None:
+            raise HTTPError(status=404, message="Unknown batch")
+        return Blob(uploadedChunkIds=self.received)
+
+    def batch(self):
+        return Batch(batchId="new batch")
+
+
+class Operations:
+    def __init__(self):
+        self.calls = []
+
+    def execute(self, **kwargs):
+        self.calls.append(kwargs)
+        return {"id": "document"}
+
+
+def chunked_upload(tmpdir, dao, uploads):
+    path = tmpdir.join("file")
+    path.write(b"0123456789", mode="wb")
+    server = Server()
+    remote = Remote.__new__(Remote)
+    remote.client = server
+    remote._dao = dao
+    remote.uploads = uploads
+    remote.operations = Operations()
+    remote.check_suspended = None
+    doc_pair = namedtuple("DocPair", "id, local_digest")(1, "digest")
+
+    res = remote._upload_chunked(
+        str(path), command="Update", doc_pair=doc_pair, chunk_size=3, ref="doc"
+    )
+    assert res == {"id": "document"}
+    assert dao.removed
+    call = remote.operations.calls[0]
+    assert call["command"] == "Update"
+    assert call["ref"] == "doc"
+    assert call["input_obj"].batch_id == dao.upload.batch_id
+    assert "Nuxeo-Transaction-Timeout" in call["headers"]
+    return server
+
+
+def test_upload_chunked(tmpdir):
+    dao = DAO()
+    server = chunked_upload(tmpdir, dao, Uploads())
+    assert dao.upload.batch_id == "new batch"
+    assert dao.chunks == [0, 1, 2, 3]
+    assert {path for path, _, _ in server.blobs} == {"api/v1/upload/new batch/0"}
+
+
+def test_upload_chunked_resumed(tmpdir):
+    # Chunk 2 was saved but not received by the server
+    dao = DAO(Upload("batch", 3, "0,1,2,"))
+    server = chunked_upload(tmpdir, dao, Uploads(received=["0", "1"]))
+    assert dao.chunks == [2, 3]
+    assert [data for _, _, data in server.blobs] == [b"678", b"9"]
+
+
+def test_upload_chunked_expired(tmpdir):
+    dao = DAO(Upload("batch", 3, "0,1,2,"))
+    chunked_upload(tmpdir, dao, Uploads())
+    assert dao.upload.batch_id == "new batch"
+    assert dao.chunks == [0, 1, 2, 3]
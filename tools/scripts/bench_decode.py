@@ -0,0 +1,115 @@
+# coding: utf-8
+"""
+Benchmark the decoding of server items into RemoteFileInfo and
+NuxeoDocumentInfo objects.
+
+Synthetic file system items, as sent in scroll pages and children listings,
+and documents, as sent by Document.Query, are decoded one by one and in
+batches.
+
+Usage: python tools/scripts/bench_decode.py [ITEMS] [ROUNDS]
+"""
+
+import sys
+import time
+import uuid
+
+from nxdrive.objects import NuxeoDocumentInfo, RemoteFileInfo
+
+__version__ = "0.1.0"
+
+PARENT = "defaultFileSystemItemFactory#default#" + "0" * 36
+
+
+def fs_item(idx):
+    uid = "defaultFileSystemItemFactory#default#" + str(uuid.uuid4())
+    folder = not idx % 10
+    item = {
+        "id": uid,
+        "parentId": PARENT,
+        "path": "/org.nuxeo.drive.service.impl.DefaultTopLevelFolderItemFactory#/"
+        + PARENT
+        + "/"
+        + uid,
+        "name": "Fichier n°{}.txt".format(idx),
+        "folder": folder,
+        "creationDate": 1536759672000 + idx,
+        "lastModificationDate": 1536759672000 + idx,
+        "lastContributor": "Administrator",
+        "canRename": True,
+        "canDelete": True,
+        "lockInfo": None,
+    }
+    if folder:
+        item.update(canCreateChild=True, canScrollDescendants=True)
+    else:
+        item.update(
+            digest=uuid.uuid4().hex,
+            digestAlgorithm="MD5",
+            downloadURL="nxfile/default/{}/blobholder:0/file.txt".format(uid),
+            canUpdate=True,
+        )
+    return item
+
+
+def document(idx):
+    return {
+        "uid": str(uuid.uuid4()),
+        "root": "0" * 36,
+        "path": "/default-domain/workspaces/ws/file-{}".format(idx),
+        "repository": "default",
+        "type": "File",
+        "state": "project",
+        "isTrashed": False,
+        "facets": ["Versionable", "Commentable"],
+        "lastModified": "2018-09-12T13:41:12.{:03d}Z".format(idx % 1000),
+        "lockOwner": "Administrator",
+        "lockCreated": "2018-09-12T13:41:12.345Z",
+        "properties": {
+            "dc:title": "Fichier n°{}.txt".format(idx),
+            "dc:lastContributor": "Administrator",
+            "uid:major_version": 0,
+            "uid:minor_version": 1,
+            "file:content": {
+                "name": "file-{}.txt".format(idx),
+                "digest": uuid.uuid4().hex,
+                "digestAlgorithm": "MD5",
+            },
+        },
+    }
+
+
+def bench(name, func, items, rounds):
+    best = min(timeit(func, items) for _ in range(rounds))
+    print("{:<32} {:.3f} sec ({:,.0f} items/sec)".format(name, best, len(items) / best))
+
+
+def timeit(func, items):
+    start = time.perf_counter()
+    func(items)
+    return time.perf_counter() - start
+
+
+def main(count=100000, rounds=3):
+    fs_items = [fs_item(idx) for idx in range(count)]
+    documents = [document(idx) for idx in range(count)]
+    print("Decoding {:,} items, best of {} rounds".format(count, rounds))
+
+    bench(
+        "RemoteFileInfo.from_dict()",
+        lambda items: [RemoteFileInfo.from_dict(item) for item in items],
+        fs_items,
+        rounds,
+    )
+    bench("RemoteFileInfo.from_dicts()", RemoteFileInfo.from_dicts, fs_items, rounds)
+    bench(
+        "NuxeoDocumentInfo.from_dict()",
+        lambda items: [NuxeoDocumentInfo.from_dict(item) for item in items],
+        documents,
+        rounds,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
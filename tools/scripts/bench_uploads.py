@@ -0,0 +1,139 @@
+# coding: utf-8
+"""
+Benchmark concurrent uploads.
+
+A local stand-in server mimics the Nuxeo endpoints used by `Remote.upload()`
+(batch creation, blob upload and batch execution) and adds a fixed latency to
+every request. The same set of small files is uploaded sequentially, as it was
+done when uploads were serialized, then with several concurrent uploads.
+
+Usage: python tools/scripts/bench_uploads.py [FILES] [CONCURRENCY] [LATENCY_MS]
+"""
+
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Thread
+
+from nxdrive.client.remote_client import Remote
+
+__version__ = "0.1.0"
+
+COMMAND = "NuxeoDrive.CreateFile"
+LATENCY = 0.05
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    """ Answer just enough for the upload path to work. """
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, data):
+        time.sleep(LATENCY)
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.endswith("json/cmis"):
+            self._reply({"default": {"productVersion": "10.10"}})
+        elif self.path.rstrip("/").endswith("automation"):
+            params = [
+                {"name": "parentId", "type": "string", "required": True},
+                {"name": "overwrite", "type": "boolean", "required": False},
+            ]
+            operation = {
+                "id": COMMAND,
+                "aliases": [],
+                "params": params,
+                "signature": ["blob", "document"],
+            }
+            self._reply({"operations": [operation], "chains": []})
+        elif "/upload/" in self.path:
+            self._reply(
+                {"name": "file", "size": 0, "uploadType": "normal", "fileIdx": "0"}
+            )
+        else:
+            self._reply({})
+
+    def do_POST(self):
+        size = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(size)
+
+        if self.path.rstrip("/").endswith("/upload"):
+            self._reply({"batchId": uuid.uuid4().hex})
+        elif re.search("/upload/[^/]+/[0-9]+$", self.path):
+            self._reply(
+                {
+                    "uploaded": "true",
+                    "fileIdx": "0",
+                    "uploadType": "normal",
+                    "uploadedSize": str(size),
+                }
+            )
+        else:
+            self._reply({"id": "defaultFileSystemItemFactory#default#" + "0" * 32})
+
+
+def bench(remote, files, concurrency):
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        jobs = [
+            executor.submit(
+                remote.upload, path, command=COMMAND, parentId="root", overwrite=False
+            )
+            for path in files
+        ]
+        for job in jobs:
+            job.result()
+    return time.time() - start
+
+
+def main(count=100, concurrency=8, latency=50):
+    global LATENCY
+    LATENCY = latency / 1000
+
+    server = Server(("127.0.0.1", 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}/nuxeo/".format(server.server_address[1])
+
+    with tempfile.TemporaryDirectory() as folder:
+        files = []
+        for idx in range(count):
+            path = os.path.join(folder, "file_{}.txt".format(idx))
+            with open(path, "wb") as f:
+                f.write(os.urandom(1024))
+            files.append(path)
+
+        for workers in (1, concurrency):
+            remote = Remote(
+                url, "user", "device", "bench", password="pwd", max_uploads=workers
+            )
+            duration = bench(remote, files, workers)
+            print(
+                "{} uploads, {} at a time: {:.2f} sec ({:.1f} files/sec)".format(
+                    count, workers, duration, count / duration
+                )
+            )
+
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))